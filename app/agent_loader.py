@@ -2,8 +2,11 @@ import yaml
 import json
 import os
 import re
+import asyncio
+import uuid
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional, Any, List
+from typing import Dict, Optional, Any, List, Tuple, Iterable
 from app.models import AgentConfig
 from app.config import settings
 from app.infrastructure import prisma_db
@@ -12,48 +15,120 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+AGENTS_CHANNEL = "agents:changed"
+AGENT_FILE_SUFFIXES = ['.yaml', '.yml', '.json']
+
+
+class AgentRegistry:
+    """Snapshot imutável dos agentes carregados; trocado atomicamente a cada mudança"""
+    
+    def __init__(self, version: int = 0, agents: Optional[Dict[str, AgentConfig]] = None):
+        self.version = version
+        self.agents: Dict[str, AgentConfig] = agents or {}
+        self.webhook_map: Dict[str, str] = {  # webhook_name -> agent_id
+            agent.webhook_name: agent_id for agent_id, agent in self.agents.items() if agent.webhook_name
+        }
+
 
 class AgentLoader:
     """Carrega e gerencia configurações de agentes"""
     
-    def __init__(self, agents_dir: Optional[str] = None):
+    def __init__(self, agents_dir: Optional[str] = None, redis_client=None):
         self.agents_dir = Path(agents_dir or settings.agents_dir)
-        self.agents: Dict[str, AgentConfig] = {}
-        self.webhook_map: Dict[str, str] = {}  # webhook_name -> agent_id
+        self.redis = redis_client
+        self._registry = AgentRegistry()
+        # Origem de cada agente: ("file", caminho) ou ("db", updatedAt)
+        self._sources: Dict[str, Tuple[str, Any]] = {}
+        self._file_versions: Dict[str, int] = {}  # caminho -> mtime_ns já carregado
+        self._db_watermark: Optional[datetime] = None
+        # Valores "enc:" só são decifrados no primeiro acesso ao agente: agent_id -> (config cifrada, decifrada)
+        self._decrypted: Dict[str, Tuple[AgentConfig, AgentConfig]] = {}
+        self._refresh_lock = asyncio.Lock()
+        self._instance_id = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
         # Note: Initialization is now async via load_all_agents()
     
+    @property
+    def agents(self) -> Dict[str, AgentConfig]:
+        return self._registry.agents
+    
+    @property
+    def webhook_map(self) -> Dict[str, str]:
+        return self._registry.webhook_map
+    
+    @property
+    def version(self) -> int:
+        return self._registry.version
+    
+    def _swap(
+        self,
+        upserts: Iterable[Tuple[AgentConfig, Tuple[str, Any]]] = (),
+        removals: Iterable[str] = (),
+        replace: bool = False
+    ) -> int:
+        """Aplica mudanças sobre o snapshot atual e publica um novo (sem await: nunca expõe estado parcial)"""
+        agents = {} if replace else dict(self._registry.agents)
+        sources = {} if replace else self._sources
+        changed = 0
+        for agent_id in removals:
+            if agents.pop(agent_id, None) is not None:
+                changed += 1
+            sources.pop(agent_id, None)
+        for agent, source in upserts:
+            current = sources.get(agent.id)
+            # Banco tem precedência sobre arquivo com o mesmo id
+            if source[0] == "file" and current and current[0] == "db":
+                continue
+            agents[agent.id] = agent
+            sources[agent.id] = source
+            changed += 1
+        if changed or replace:
+            self._sources = sources
+            self._registry = AgentRegistry(self._registry.version + 1, agents)
+            for agent_id in list(self._decrypted):
+                if agent_id not in agents:
+                    self._decrypted.pop(agent_id, None)
+        return changed
+    
     async def load_all_agents(self):
         """Carrega todos os agentes (Arquivos + Banco de Dados)"""
         if not self.agents_dir.exists():
             logger.warning(f"Agents directory {self.agents_dir} does not exist. Creating it.")
             self.agents_dir.mkdir(parents=True, exist_ok=True)
         
-        # Limpa mapeamentos
-        self.agents.clear()
-        self.webhook_map.clear()
-        
-        # 1. Carrega de arquivos (Legado/Dev) - Síncrono por natureza de IO local, mas OK em startup
-        await self._load_from_files()
-        
-        # 2. Carrega do Banco de Dados (Produção/Dinâmico)
-        await self._load_from_db()
+        async with self._refresh_lock:
+            # Monta o registro completo à parte e só então troca (leituras nunca veem registro vazio)
+            self._file_versions.clear()
+            
+            # 1. Carrega de arquivos (Legado/Dev) - Síncrono por natureza de IO local, mas OK em startup
+            upserts = await self._load_from_files()
+            
+            # 2. Carrega do Banco de Dados (Produção/Dinâmico)
+            self._db_watermark = None
+            upserts.extend(await self._load_from_db())
+            
+            self._swap(upserts, replace=True)
         
-        logger.info(f"Total agents loaded: {len(self.agents)}")
-
-    async def _load_from_files(self):
-        """Carrega agentes do sistema de arquivos"""
+        logger.info(f"Total agents loaded: {len(self.agents)} (registry v{self.version})")
+    
+    async def _load_from_files(self, only_changed: bool = False) -> List[Tuple[AgentConfig, Tuple[str, Any]]]:
+        """Carrega agentes do sistema de arquivos (com only_changed, apenas arquivos com mtime novo)"""
+        upserts = []
         for file_path in self.agents_dir.iterdir():
-            if file_path.suffix in ['.yaml', '.yml', '.json']:
+            if file_path.suffix in AGENT_FILE_SUFFIXES:
                 try:
+                    mtime = file_path.stat().st_mtime_ns
+                    if only_changed and self._file_versions.get(str(file_path)) == mtime:
+                        continue
+                    self._file_versions[str(file_path)] = mtime
                     agent = self._load_agent_file(file_path)
                     if agent:
-                        self.agents[agent.id] = agent
-                        if agent.webhook_name:
-                            self.webhook_map[agent.webhook_name] = agent.id
+                        upserts.append((agent, ("file", str(file_path))))
                         logger.info(f"Loaded file agent: {agent.id}")
                 except Exception as e:
                     logger.error(f"Error loading agent from {file_path}: {e}")
-
+        return upserts
+    
     def _load_agent_file(self, file_path: Path) -> Optional[AgentConfig]:
         """Lê um arquivo de agente"""
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -62,36 +137,47 @@ class AgentLoader:
             else:
                 data = json.load(f)
         return AgentConfig(**data)
-
-    async def _load_from_db(self):
+    
+    def _agent_from_row(self, db_agent) -> AgentConfig:
+        # Construct config (encrypted values are decrypted lazily on first access)
+        config_data = dict(db_agent.configuracoes or {})
+        
+        # Ensure ID and Nome match the DB record
+        config_data['id'] = db_agent.id
+        if db_agent.nome:
+             config_data['nome'] = db_agent.nome
+        if db_agent.grupoId:
+             config_data['grupoId'] = db_agent.grupoId
+        
+        # Create AgentConfig object
+        return AgentConfig(**config_data)
+    
+    def _track_db_row(self, db_agent):
+        updated_at = getattr(db_agent, "updatedAt", None)
+        if updated_at and (self._db_watermark is None or updated_at > self._db_watermark):
+            self._db_watermark = updated_at
+    
+    async def _load_from_db(self, where: Optional[Dict[str, Any]] = None) -> List[Tuple[AgentConfig, Tuple[str, Any]]]:
         """Busca agentes no banco de dados Prisma"""
+        upserts = []
         try:
-            db_agents = await prisma_db.db.agente.find_many()
+            db_agents = await prisma_db.db.agente.find_many(where=where) if where else await prisma_db.db.agente.find_many()
             for db_agent in db_agents:
                 try:
-                    # Decrypt and construct config
-                    config_data = self._decrypt_config(db_agent.configuracoes)
-                    
-                    # Ensure ID and Nome match the DB record
-                    config_data['id'] = db_agent.id
-                    if db_agent.nome:
-                         config_data['nome'] = db_agent.nome
-                    if db_agent.grupoId:
-                         config_data['grupoId'] = db_agent.grupoId
-                         
-                    # Create AgentConfig object
-                    agent = AgentConfig(**config_data)
-                    
-                    self.agents[agent.id] = agent
-                    if agent.webhook_name:
-                         self.webhook_map[agent.webhook_name] = agent.id
-                         
+                    self._track_db_row(db_agent)
+                    current = self._sources.get(db_agent.id)
+                    updated_at = getattr(db_agent, "updatedAt", None)
+                    if where and current == ("db", updated_at):
+                        continue
+                    agent = self._agent_from_row(db_agent)
+                    upserts.append((agent, ("db", updated_at)))
                     logger.info(f"Loaded DB agent: {agent.id}")
                 except Exception as e:
                     logger.error(f"Error loading agent {db_agent.id} from DB: {e}")
         except Exception as e:
             logger.error(f"Failed to fetch agents from DB: {e}")
-
+        return upserts
+    
     def _decrypt_config(self, value: Any) -> Any:
         """Recursively decrypts config values"""
         if isinstance(value, dict):
@@ -107,29 +193,165 @@ class AgentLoader:
                      logger.warning("Failed to decrypt value, returning original")
                      return value
         return value
-
+    
+    def _has_encrypted(self, value: Any) -> bool:
+        if isinstance(value, dict):
+            return any(self._has_encrypted(v) for v in value.values())
+        if isinstance(value, list):
+            return any(self._has_encrypted(v) for v in value)
+        return isinstance(value, str) and value.startswith("enc:")
+    
+    def _materialize(self, agent: Optional[AgentConfig]) -> Optional[AgentConfig]:
+        """Versão decifrada do agente, calculada uma vez por config carregada"""
+        if agent is None:
+            return None
+        cached = self._decrypted.get(agent.id)
+        if cached and cached[0] is agent:
+            return cached[1]
+        data = agent.model_dump()
+        decrypted = AgentConfig(**self._decrypt_config(data)) if self._has_encrypted(data) else agent
+        self._decrypted[agent.id] = (agent, decrypted)
+        return decrypted
+    
     def get_agent(self, agent_id: str) -> Optional[AgentConfig]:
-        return self.agents.get(agent_id)
+        return self._materialize(self._registry.agents.get(agent_id))
     
     def list_agents(self) -> Dict[str, AgentConfig]:
-        return self.agents.copy()
+        return {agent_id: self._materialize(agent) for agent_id, agent in self._registry.agents.items()}
     
-    async def reload(self):
-        """Recarrega todos os agentes assincronamente"""
-        await self.load_all_agents()
+    async def reload(self) -> int:
+        """Recarrega apenas o que mudou: arquivos com mtime novo e linhas com updatedAt novo"""
+        async with self._refresh_lock:
+            upserts: List[Tuple[AgentConfig, Tuple[str, Any]]] = []
+            removals: List[str] = []
+            
+            if self.agents_dir.exists():
+                upserts.extend(await self._load_from_files(only_changed=True))
+                # Arquivos removidos
+                for path in list(self._file_versions):
+                    if not os.path.exists(path):
+                        self._file_versions.pop(path, None)
+                        removals.extend(
+                            agent_id for agent_id, source in self._sources.items() if source == ("file", path)
+                        )
+            
+            if self._db_watermark is not None:
+                upserts.extend(await self._load_from_db(where={"updatedAt": {"gte": self._db_watermark}}))
+            else:
+                upserts.extend(await self._load_from_db())
+            removals.extend(await self._deleted_db_agents(
+                {agent.id for agent, source in upserts if source[0] == "db"}
+            ))
+            
+            changed = self._swap(upserts, removals)
+        
+        if changed:
+            logger.info(f"Reloaded {changed} changed agents (registry v{self.version})")
+        return changed
+    
+    async def _deleted_db_agents(self, loaded: Iterable[str] = ()) -> List[str]:
+        """Ids de agentes do banco que não existem mais (só consulta ids se a contagem divergir)"""
+        known = {agent_id for agent_id, source in self._sources.items() if source[0] == "db"} | set(loaded)
+        try:
+            if await prisma_db.db.agente.count() == len(known):
+                return []
+            rows = await prisma_db.db.query_raw('SELECT id::text AS id FROM "Agente"')
+        except Exception as e:
+            logger.error(f"Failed to check deleted DB agents: {e}")
+            return []
+        existing = {row["id"] for row in rows}
+        return [agent_id for agent_id in known if agent_id not in existing]
     
     async def reload_agent(self, agent_id: str) -> bool:
-        """Recarrega um agente específico (Re-lê tudo por enquanto para simplificar ou busca específico)"""
-        # For simplicity and correctness with DB, we'll reload all. 
-        # Making granular update requires checking if it's file or DB.
-        # Given the content, reloading all is safer to sync properly.
-        await self.load_all_agents()
-        return agent_id in self.agents
+        """Recarrega um agente específico a partir da sua origem (arquivo ou linha do banco)"""
+        async with self._refresh_lock:
+            source = self._sources.get(agent_id)
+            
+            # Arquivo: o conhecido ou <agent_id>.<ext> no diretório de agentes
+            if source is None or source[0] == "file":
+                paths = [Path(source[1])] if source else [
+                    self.agents_dir / f"{agent_id}{suffix}" for suffix in AGENT_FILE_SUFFIXES
+                ]
+                for path in paths:
+                    if not path.exists():
+                        continue
+                    try:
+                        self._file_versions[str(path)] = path.stat().st_mtime_ns
+                        agent = self._load_agent_file(path)
+                    except Exception as e:
+                        logger.error(f"Error loading agent from {path}: {e}")
+                        continue
+                    if agent and agent.id == agent_id:
+                        self._swap([(agent, ("file", str(path)))])
+                        return True
+            
+            # Banco de dados
+            try:
+                db_agent = await prisma_db.db.agente.find_unique(where={"id": agent_id})
+            except Exception as e:
+                logger.debug(f"Agent {agent_id} not found in DB: {e}")
+                db_agent = None
+            if db_agent:
+                self._track_db_row(db_agent)
+                self._swap([(self._agent_from_row(db_agent), ("db", getattr(db_agent, "updatedAt", None)))])
+                return True
+            
+            # Não existe mais em nenhuma origem
+            self._swap(removals=[agent_id])
+            return False
+    
+    async def notify_changed(self, agent_id: Optional[str] = None):
+        """Avisa as outras instâncias (API e workers) que um agente (ou todos) mudou"""
+        if self.redis:
+            await self.redis.publish(
+                AGENTS_CHANNEL,
+                {"agent_id": agent_id, "origin": self._instance_id, "version": self.version}
+            )
+    
+    async def start(self):
+        """Passa a aplicar as mudanças publicadas por outras instâncias"""
+        if self._task is None and self.redis and self.redis.client:
+            self._task = asyncio.create_task(self._listen_changes())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _listen_changes(self):
+        while True:
+            try:
+                subscribed = asyncio.Event()
+                changes = self.redis.listen(AGENTS_CHANNEL, subscribed=subscribed)
+                async for message in changes:
+                    if message.get("origin") == self._instance_id:
+                        continue
+                    agent_id = message.get("agent_id")
+                    if agent_id:
+                        await self.reload_agent(agent_id)
+                    else:
+                        await self.reload()
+                    logger.info(f"Applied agent change notification ({agent_id or 'all'}), registry v{self.version}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Agent change listener error: {e}")
+            # Notificações podem ter sido perdidas enquanto desconectado
+            await asyncio.sleep(5)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f"Error reloading agents after listener reconnect: {e}")
     
     def get_agent_by_webhook_name(self, webhook_name: str) -> Optional[AgentConfig]:
-        agent_id = self.webhook_map.get(webhook_name)
+        registry = self._registry
+        agent_id = registry.webhook_map.get(webhook_name)
         if agent_id:
-            return self.agents.get(agent_id)
+            return self._materialize(registry.agents.get(agent_id))
         return None
     
     def _validate_agent_id(self, agent_id: str) -> bool:
@@ -162,15 +384,14 @@ class AgentLoader:
             with open(file_path, 'w', encoding='utf-8') as f:
                 yaml.dump(data, f, default_flow_style=False, allow_unicode=True, sort_keys=False)
             
-            self.agents[agent_config.id] = agent_config
-            if agent_config.webhook_name:
-                self.webhook_map[agent_config.webhook_name] = agent_config.id
+            self._file_versions[str(file_path)] = file_path.stat().st_mtime_ns
+            self._swap([(agent_config, ("file", str(file_path)))])
             
             return True
         except Exception as e:
             logger.error(f"Error saving agent: {e}")
             return False
-
+    
     def delete_agent(self, agent_id: str) -> bool:
         """Remove agente (apenas arquivo por enquanto)"""
         # ... (Lógica existente)
@@ -178,14 +399,12 @@ class AgentLoader:
             agent = self.agents.get(agent_id)
             if not agent: return False
             
-            if agent.webhook_name:
-                self.webhook_map.pop(agent.webhook_name, None)
-            
             file_path = self.agents_dir / f"{agent_id}.yaml"
             if file_path.exists():
                 file_path.unlink()
+            self._file_versions.pop(str(file_path), None)
             
-            self.agents.pop(agent_id, None)
+            self._swap(removals=[agent_id])
             return True
         except Exception:
             return False
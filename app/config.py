@@ -27,6 +27,40 @@ try:
         migrate_on_startup: bool = True
         
         migrate_on_startup: bool = True
+        llm_dedupe_inflight: bool = True
+        job_result_ttl_seconds: int = 3600
+        job_wait_max_seconds: int = 60
+        stream_via_worker: bool = False
+        metrics_buffered: bool = True
+        metrics_flush_interval_seconds: float = 1.0
+        trace_sample_rate: float = 0.01
+        trace_slow_ms: float = 2000.0
+        trace_buffer_size: int = 200
+        trace_export_path: Optional[str] = None
+        worker_metrics_port: int = 9100
+        rate_limit_per_minute: int = 60
+        rate_limit_token_per_minute: int = 300
+        rate_limit_routes: str = ""
+        rate_limit_lease_size: int = 10
+        rate_limit_lease_ttl_seconds: float = 1.0
+        auth_token_cache_size: int = 10000
+        auth_revocation_resync_seconds: float = 300.0
+        password_hash_workers: int = 2
+        password_hash_max_pending: int = 32
+        login_max_failures_per_account: int = 5
+        login_max_failures_per_ip: int = 20
+        login_failure_window_seconds: int = 900
+        data_cache_max_mb: int = 512
+        data_sql_timeout_seconds: float = 10.0
+        data_sql_memory_limit_mb: int = 256
+        data_result_max_rows: int = 200
+        data_result_max_bytes: int = 32768
+        data_query_processes: int = 2
+        data_query_timeout_seconds: float = 30.0
+        data_query_memory_limit_mb: int = 1024
+        data_query_max_pending: int = 32
+        data_description_max_chars: int = 4000
+        metrics_scrape_token: str = ""
 
 
         @field_validator("database_url", mode="before")
@@ -74,6 +108,40 @@ except Exception:
             self.migrate_on_startup = (os.getenv("MIGRATE_ON_STARTUP", "true").strip().lower() in {"1", "true", "yes", "y"})
             
             self.migrate_on_startup = (os.getenv("MIGRATE_ON_STARTUP", "true").strip().lower() in {"1", "true", "yes", "y"})
+            self.llm_dedupe_inflight = (os.getenv("LLM_DEDUPE_INFLIGHT", "true").strip().lower() in {"1", "true", "yes", "y"})
+            self.job_result_ttl_seconds = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+            self.job_wait_max_seconds = int(os.getenv("JOB_WAIT_MAX_SECONDS", "60"))
+            self.stream_via_worker = (os.getenv("STREAM_VIA_WORKER", "false").strip().lower() in {"1", "true", "yes", "y"})
+            self.metrics_buffered = (os.getenv("METRICS_BUFFERED", "true").strip().lower() in {"1", "true", "yes", "y"})
+            self.metrics_flush_interval_seconds = float(os.getenv("METRICS_FLUSH_INTERVAL_SECONDS", "1.0"))
+            self.trace_sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+            self.trace_slow_ms = float(os.getenv("TRACE_SLOW_MS", "2000"))
+            self.trace_buffer_size = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+            self.trace_export_path = os.getenv("TRACE_EXPORT_PATH") or None
+            self.worker_metrics_port = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+            self.rate_limit_per_minute = int(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
+            self.rate_limit_token_per_minute = int(os.getenv("RATE_LIMIT_TOKEN_PER_MINUTE", "300"))
+            self.rate_limit_routes = os.getenv("RATE_LIMIT_ROUTES", "")
+            self.rate_limit_lease_size = int(os.getenv("RATE_LIMIT_LEASE_SIZE", "10"))
+            self.rate_limit_lease_ttl_seconds = float(os.getenv("RATE_LIMIT_LEASE_TTL_SECONDS", "1.0"))
+            self.auth_token_cache_size = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+            self.auth_revocation_resync_seconds = float(os.getenv("AUTH_REVOCATION_RESYNC_SECONDS", "300"))
+            self.password_hash_workers = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+            self.password_hash_max_pending = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+            self.login_max_failures_per_account = int(os.getenv("LOGIN_MAX_FAILURES_PER_ACCOUNT", "5"))
+            self.login_max_failures_per_ip = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", "20"))
+            self.login_failure_window_seconds = int(os.getenv("LOGIN_FAILURE_WINDOW_SECONDS", "900"))
+            self.data_cache_max_mb = int(os.getenv("DATA_CACHE_MAX_MB", "512"))
+            self.data_sql_timeout_seconds = float(os.getenv("DATA_SQL_TIMEOUT_SECONDS", "10.0"))
+            self.data_sql_memory_limit_mb = int(os.getenv("DATA_SQL_MEMORY_LIMIT_MB", "256"))
+            self.data_result_max_rows = int(os.getenv("DATA_RESULT_MAX_ROWS", "200"))
+            self.data_result_max_bytes = int(os.getenv("DATA_RESULT_MAX_BYTES", "32768"))
+            self.data_query_processes = int(os.getenv("DATA_QUERY_PROCESSES", "2"))
+            self.data_query_timeout_seconds = float(os.getenv("DATA_QUERY_TIMEOUT_SECONDS", "30.0"))
+            self.data_query_memory_limit_mb = int(os.getenv("DATA_QUERY_MEMORY_LIMIT_MB", "1024"))
+            self.data_query_max_pending = int(os.getenv("DATA_QUERY_MAX_PENDING", "32"))
+            self.data_description_max_chars = int(os.getenv("DATA_DESCRIPTION_MAX_CHARS", "4000"))
+            self.metrics_scrape_token = os.getenv("METRICS_SCRAPE_TOKEN", "")
 
         @staticmethod
         def _normalize_database_url(v: Optional[str]) -> Optional[str]:
@@ -1,11 +1,15 @@
 from typing import List, Dict, Any, AsyncIterator, Optional
 from app.models import AgentConfig, WebhookMessage, AgentResponse, RAGContext
+from app.domain.query_plan import QUERY_PLAN_TOOL_PARAMETERS
 from app.domain.rag_service import RAGService
+from app.domain.sql_engine import SQL_ENGINES, SQL_TOOL_PARAMETERS
 from app.infrastructure.openai_client import OpenAIClient
 from app.infrastructure.redis_client import RedisClient
+from app.infrastructure.tracing import tracer
 import uuid
 import logging
 import json
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -18,12 +22,16 @@ class AgentService:
         redis_client: RedisClient,
         openai_client: OpenAIClient,
         rag_service: RAGService,
-        data_analysis_service: Optional[Any] = None
+        data_analysis_service: Optional[Any] = None,
+        metrics_service: Optional[Any] = None,
+        query_pool: Optional[Any] = None
     ):
         self.redis = redis_client
         self.openai = openai_client
         self.rag = rag_service
         self.data_analysis = data_analysis_service
+        self.metrics = metrics_service
+        self.query_pool = query_pool
     
     async def process_message(
         self,
@@ -86,11 +94,17 @@ Pergunta: {message.text}"""
             # Stream resposta
             if stream:
                 tool_calls_received = None
+                started = time.perf_counter()
+                first_chunk = True
                 async for chunk in self.openai.chat_completion_stream(
                     messages=messages,
                     model=agent_config.model,
                     tools=tools
                 ):
+                    if first_chunk:
+                        first_chunk = False
+                        tracer.add_span("llm.ttft", (time.perf_counter() - started) * 1000, model=agent_config.model)
+                        await self._record_latency(agent_config.id, "llm_ttft", started)
                     if chunk.get("type") == "content":
                         yield chunk["data"]
                     elif chunk.get("type") == "tool_calls":
@@ -119,7 +133,7 @@ Pergunta: {message.text}"""
                         
                         # Executa função
                         if function_name == "query_data" and self.data_analysis:
-                            query_result = await self.execute_data_query(agent_config.id, function_args.get('query', ''))
+                            query_result = await self.execute_data_query(agent_config, function_args)
                             messages.append({
                                 "role": "tool",
                                 "tool_call_id": tool_call_id,
@@ -141,11 +155,13 @@ Pergunta: {message.text}"""
                         if chunk.get("type") == "content":
                             yield chunk["data"]
             else:
+                started = time.perf_counter()
                 response = await self.openai.chat_completion(
                     messages=messages,
                     model=agent_config.model,
                     tools=tools
                 )
+                await self._record_latency(agent_config.id, "llm", started)
                 yield response['content']
         
         except Exception as e:
@@ -208,11 +224,13 @@ Pergunta: {message.text}"""
                 tools = self._prepare_tools(agent_config)
             
             # Chama API diretamente para capturar tokens
+            started = time.perf_counter()
             response = await self.openai.chat_completion(
                 messages=messages,
                 model=agent_config.model,
                 tools=tools
             )
+            await self._record_latency(agent_config.id, "llm", started)
             
             # Processa tool calls se houver
             tool_calls = response.get('tool_calls')
@@ -255,7 +273,7 @@ Pergunta: {message.text}"""
                     
                     # Executa função
                     if function_name == "query_data" and self.data_analysis:
-                        query_result = await self.execute_data_query(agent_config.id, function_args.get('query', ''))
+                        query_result = await self.execute_data_query(agent_config, function_args)
                         # Adiciona resultado como mensagem de tool
                         messages.append({
                             "role": "tool",
@@ -297,6 +315,11 @@ Pergunta: {message.text}"""
             tokens_used=tokens_used
         )
     
+    async def _record_latency(self, agent_id: str, stage: str, started: float):
+        """Registra a latência de um estágio no histograma do agente"""
+        if self.metrics:
+            await self.metrics.record_latency(agent_id, stage, time.perf_counter() - started)
+    
     def _prepare_tools(self, agent_config: AgentConfig) -> List[Dict[str, Any]]:
         """Prepara tools para function calling da OpenAI"""
         openai_tools = []
@@ -319,39 +342,58 @@ Pergunta: {message.text}"""
             if agent_config.data_analysis.files:
                 self.data_analysis.load_agent_files(agent_config.id, agent_config.data_analysis.files)
             
-            # Obtém informações dos DataFrames
-            df_info = self.data_analysis.get_dataframe_info(agent_config.id)
+            # Descrição compacta dos arquivos a partir dos perfis (tamanho limitado)
+            use_sql = agent_config.data_analysis.query_engine in SQL_ENGINES
+            files_description = self.data_analysis.describe_files(agent_config.id, sql=use_sql)
             
-            # Cria tool de query
-            data_tool = {
-                "type": "function",
-                "function": {
-                    "name": "query_data",
-                    "description": "Executa queries em dados carregados (CSV, JSON, XLSX) usando pandas. Use esta ferramenta para analisar dados, filtrar, agregar, calcular estatísticas, etc.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": f"Query pandas a ser executada. Dados disponíveis: {json.dumps(df_info, indent=2) if df_info.get('files') else 'Nenhum arquivo carregado'}. Exemplos: 'df.head()', 'df.describe()', 'df[df[\"coluna\"] > 10]', 'df.groupby(\"coluna\").sum()'"
-                            }
-                        },
-                        "required": ["query"]
+            if use_sql:
+                data_tool = self._sql_data_tool(files_description)
+            else:
+                # Cria tool de query (plano estruturado, sem código)
+                data_tool = {
+                    "type": "function",
+                    "function": {
+                        "name": "query_data",
+                        "description": (
+                            "Consulta dados carregados (CSV, JSON, XLSX) com um plano estruturado: filtros, agrupamento, "
+                            "agregações, ordenação e limite. Use para filtrar, agregar e calcular estatísticas. "
+                            f"Dados disponíveis:\n{files_description}\n"
+                            "Exemplo: {\"file\": \"vendas.csv\", \"filters\": [{\"column\": \"ano\", \"op\": \"==\", \"value\": 2024}], "
+                            "\"group_by\": [\"regiao\"], \"aggregates\": [{\"column\": \"valor\", \"func\": \"sum\"}], "
+                            "\"sort\": [{\"column\": \"sum_valor\", \"descending\": true}], \"limit\": 10}"
+                        ),
+                        "parameters": QUERY_PLAN_TOOL_PARAMETERS
                     }
                 }
-            }
             openai_tools.append(data_tool)
         
         return openai_tools if openai_tools else None
     
-    async def execute_data_query(self, agent_id: str, query: str) -> Dict[str, Any]:
-        """Executa uma query de análise de dados"""
-        if not self.data_analysis:
+    @staticmethod
+    def _sql_data_tool(files_description: str) -> Dict[str, Any]:
+        """Tool query_data para agentes com engine SQL: cada arquivo é uma tabela"""
+        return {
+            "type": "function",
+            "function": {
+                "name": "query_data",
+                "description": (
+                    "Executa uma consulta SQL somente leitura (SELECT, dialeto DuckDB) nos dados carregados. "
+                    "Prefira agregar no SQL a retornar muitas linhas. "
+                    f"Tabelas disponíveis:\n{files_description}"
+                ),
+                "parameters": SQL_TOOL_PARAMETERS
+            }
+        }
+    
+    async def execute_data_query(self, agent_config: AgentConfig, plan: Dict[str, Any]) -> Dict[str, Any]:
+        """Executa um plano de consulta (ou SQL, conforme a engine) de análise de dados"""
+        if not self.data_analysis or not agent_config.data_analysis:
             return {"success": False, "error": "Data analysis service not available"}
+        if not self.query_pool:
+            return {"success": False, "error": "Data query pool not available"}
         
-        # Executa de forma síncrona (pandas é síncrono)
-        import asyncio
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, self.data_analysis.execute_query, agent_id, query)
-        return result
+        # Pool dedicado com tempo limite; cancelar esta task (cliente desconectou) aborta a consulta
+        return await self.query_pool.execute(
+            agent_config.id, agent_config.data_analysis.files, plan, agent_config.data_analysis.query_engine
+        )
 
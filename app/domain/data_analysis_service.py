@@ -4,17 +4,52 @@ from pathlib import Path
 from typing import List, Dict, Any, Optional
 import logging
 import os
+import uuid
+
+from app.domain.data_ingestion import iter_chunks
+from app.domain.dataset_profile import (
+    DEFAULT_DESCRIPTION_MAX_CHARS, column_names, delete_profile, profile_dataframe, read_profile,
+    render_profiles, write_profile
+)
+from app.domain.dataset_registry import Dataset, DatasetRegistry, DatasetVersion, file_version
+from app.domain.query_plan import QueryPlan, QueryPlanError, run_plan
+from app.domain.result_shaping import DEFAULT_MAX_BYTES, DEFAULT_MAX_ROWS, shape_result
+from app.domain.sql_engine import SQL_ENGINES, SQLQueryEngine, SQLQueryError, table_name
+from app.infrastructure.columnar_store import ColumnarStore
 
 logger = logging.getLogger(__name__)
 
+# Uploads em andamento (fora da listagem de arquivos do agente)
+UPLOAD_DIR = ".uploads"
+
 
 class DataAnalysisService:
     """Serviço de análise de dados usando pandas"""
     
-    def __init__(self, data_dir: str = "./data"):
+    def __init__(
+        self,
+        data_dir: str = "./data",
+        columnar_store: Optional[ColumnarStore] = None,
+        cache_max_bytes: int = 0,
+        sql_engine: Optional[SQLQueryEngine] = None,
+        result_max_rows: int = DEFAULT_MAX_ROWS,
+        result_max_bytes: int = DEFAULT_MAX_BYTES,
+        description_max_chars: int = DEFAULT_DESCRIPTION_MAX_CHARS
+    ):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(parents=True, exist_ok=True)
-        self._dataframes: Dict[str, Dict[str, pd.DataFrame]] = {}  # agent_id -> {filename: DataFrame}
+        self.columnar = columnar_store or ColumnarStore()
+        self.sql_engine = sql_engine or SQLQueryEngine()
+        # Limites do resultado devolvido ao modelo (linhas e bytes do JSON)
+        self.result_max_rows = result_max_rows
+        self.result_max_bytes = result_max_bytes
+        # Tamanho máximo da descrição dos arquivos na tool query_data
+        self.description_max_chars = description_max_chars
+        # DataFrames em LRU limitado por memória; carregados sob demanda na primeira query
+        self.datasets = DatasetRegistry(max_bytes=cache_max_bytes)
+        self._agent_files: Dict[str, Dict[str, Path]] = {}  # agent_id -> {filename: caminho}
+        # (agent_id, sql) -> (perfis usados, descrição renderizada)
+        self._descriptions: Dict[tuple, tuple] = {}
     
     def _get_agent_data_dir(self, agent_id: str) -> Path:
         """Retorna o diretório de dados de um agente"""
@@ -22,8 +57,57 @@ class DataAnalysisService:
         agent_dir.mkdir(parents=True, exist_ok=True)
         return agent_dir
     
+    def _get_dataset(self, file_path: Path) -> Optional[Dataset]:
+        """Dataset do arquivo; só faz o parse se o arquivo mudou desde a última carga"""
+        version = file_version(file_path)
+        if version is None:
+            return None
+        dataset = self.datasets.get(file_path, version)
+        if dataset is not None:
+            return dataset
+        df = self._load_file(file_path)
+        if df is None:
+            return None
+        # O perfil é calculado uma vez por versão e gravado ao lado da cópia colunar
+        profile = self._get_profile(file_path, version)
+        if profile is None:
+            profile = profile_dataframe(file_path.name, df)
+            write_profile(file_path, version, profile)
+        return self.datasets.put(file_path, version, df, profile)
+    
+    def _get_profile(self, file_path: Path, version: DatasetVersion) -> Optional[Dict[str, Any]]:
+        """Perfil da versão do arquivo em memória ou em disco, sem carregar o DataFrame"""
+        profile = self.datasets.summary(file_path, version)
+        if profile is None:
+            profile = read_profile(file_path, version)
+            if profile is not None:
+                self.datasets.set_summary(file_path, version, profile)
+        return profile
+    
     def _load_file(self, file_path: Path) -> Optional[pd.DataFrame]:
-        """Carrega um arquivo em DataFrame"""
+        """Carrega um arquivo em DataFrame (cópia colunar via memory-map quando disponível)"""
+        df = self.columnar.read(file_path)
+        if df is not None:
+            return df
+
+        # CSV/XLSX são convertidos em blocos, sem o arquivo inteiro em memória
+        chunks = iter_chunks(file_path)
+        if chunks is not None and self.columnar.write_chunks(file_path, chunks):
+            df = self.columnar.read(file_path)
+            if df is not None:
+                return df
+        
+        df = self._parse_file(file_path)
+        if df is not None and self.columnar.write(file_path, df):
+            # Arquivos enviados antes da cópia colunar são convertidos na primeira leitura;
+            # relê pelo memory-map para não manter a cópia do parse em memória
+            mapped = self.columnar.read(file_path)
+            if mapped is not None:
+                return mapped
+        return df
+
+    def _parse_file(self, file_path: Path) -> Optional[pd.DataFrame]:
+        """Faz o parse do arquivo original (CSV/JSON/XLSX)"""
         try:
             suffix = file_path.suffix.lower()
             
@@ -50,28 +134,41 @@ class DataAnalysisService:
             logger.error(f"Error loading file {file_path}: {e}", exc_info=True)
             return None
     
+    def upload_path(self, agent_id: str) -> Path:
+        """Caminho temporário para gravar um upload antes de `ingest_file`"""
+        upload_dir = self._get_agent_data_dir(agent_id) / UPLOAD_DIR
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        return upload_dir / uuid.uuid4().hex
+    
     def save_file(self, agent_id: str, filename: str, file_content: bytes) -> bool:
         """Salva um arquivo para um agente"""
+        upload_path = self.upload_path(agent_id)
+        upload_path.write_bytes(file_content)
+        return self.ingest_file(agent_id, filename, upload_path)
+    
+    def ingest_file(self, agent_id: str, filename: str, upload_path: Path) -> bool:
+        """Move um upload já gravado em disco para os arquivos do agente e o converte para colunar"""
         try:
             agent_dir = self._get_agent_data_dir(agent_id)
             file_path = agent_dir / filename
             
-            # Validação de segurança: apenas permite extensões específicas
+            # Validação de segurança: apenas permite extensões específicas e nomes sem diretório
             allowed_extensions = {'.csv', '.json', '.xlsx', '.xls'}
+            if Path(filename).name != filename or filename.startswith('.'):
+                logger.error(f"Invalid file name: {filename}")
+                upload_path.unlink(missing_ok=True)
+                return False
             if file_path.suffix.lower() not in allowed_extensions:
                 logger.error(f"File type not allowed: {file_path.suffix}")
+                upload_path.unlink(missing_ok=True)
                 return False
             
             # Salva arquivo
-            with open(file_path, 'wb') as f:
-                f.write(file_content)
+            os.replace(upload_path, file_path)
             
             # Carrega DataFrame
-            df = self._load_file(file_path)
-            if df is not None:
-                if agent_id not in self._dataframes:
-                    self._dataframes[agent_id] = {}
-                self._dataframes[agent_id][filename] = df
+            if self._get_dataset(file_path) is not None:
+                self._agent_files.setdefault(agent_id, {})[filename] = file_path
                 logger.info(f"Saved and loaded file {filename} for agent {agent_id}")
                 return True
             else:
@@ -97,10 +194,10 @@ class DataAnalysisService:
                     }
                     
                     # Adiciona informações do DataFrame se carregado
-                    if agent_id in self._dataframes and file_path.name in self._dataframes[agent_id]:
-                        df = self._dataframes[agent_id][file_path.name]
-                        file_info["rows"] = len(df)
-                        file_info["columns"] = list(df.columns)
+                    profile = self._get_profile(file_path, file_version(file_path))
+                    if profile is not None:
+                        file_info["rows"] = profile["rows"]
+                        file_info["columns"] = column_names(profile)
                     
                     files.append(file_info)
             
@@ -120,12 +217,14 @@ class DataAnalysisService:
                 logger.warning(f"File not found: {file_path}")
                 return False
             
-            # Remove arquivo
+            # Remove arquivo, sua cópia colunar e seu perfil
             file_path.unlink()
+            self.columnar.delete(file_path)
+            delete_profile(file_path)
             
             # Remove do cache de DataFrames
-            if agent_id in self._dataframes:
-                self._dataframes[agent_id].pop(filename, None)
+            self.datasets.discard(file_path)
+            self._agent_files.get(agent_id, {}).pop(filename, None)
             
             logger.info(f"Deleted file {filename} for agent {agent_id}")
             return True
@@ -135,22 +234,26 @@ class DataAnalysisService:
             return False
     
     def load_agent_files(self, agent_id: str, filenames: List[str]) -> bool:
-        """Carrega arquivos de um agente na memória"""
+        """Registra os arquivos de um agente
+
+        O DataFrame só é carregado se ainda não há perfil da versão atual do arquivo
+        (em memória ou em disco); nos demais casos a carga fica para a primeira query.
+        """
         try:
             agent_dir = self._get_agent_data_dir(agent_id)
-            
-            if agent_id not in self._dataframes:
-                self._dataframes[agent_id] = {}
+            loaded = self._agent_files.setdefault(agent_id, {})
             
             for filename in filenames:
                 file_path = agent_dir / filename
-                if file_path.exists():
-                    df = self._load_file(file_path)
-                    if df is not None:
-                        self._dataframes[agent_id][filename] = df
-                        logger.info(f"Loaded file {filename} for agent {agent_id}")
-                else:
+                version = file_version(file_path)
+                if version is None:
                     logger.warning(f"File not found: {file_path}")
+                    continue
+                if self._get_profile(file_path, version) is None:
+                    if self._get_dataset(file_path) is None:
+                        continue
+                    logger.info(f"Loaded file {filename} for agent {agent_id}")
+                loaded[filename] = file_path
             
             return True
             
@@ -158,167 +261,132 @@ class DataAnalysisService:
             logger.error(f"Error loading agent files: {e}", exc_info=True)
             return False
     
-    def execute_query(self, agent_id: str, query: str) -> Dict[str, Any]:
-        """Executa uma query pandas nos dados do agente"""
+    def execute_query(self, agent_id: str, plan: Dict[str, Any], engine: str = "pandas") -> Dict[str, Any]:
+        """Executa um plano de consulta estruturado (ver query_plan) em um arquivo do agente
+
+        Com engine SQL (`query_engine` = "sql"/"duckdb") o plano é {"sql": "SELECT ..."}.
+        """
+        if engine in SQL_ENGINES:
+            return self._execute_sql(agent_id, (plan or {}).get("sql") or "")
         try:
-            if agent_id not in self._dataframes or not self._dataframes[agent_id]:
+            query_plan = QueryPlan.parse(plan)
+            file_paths = self._agent_files.get(agent_id, {})
+            if not file_paths:
                 return {
                     "success": False,
                     "error": "No data files loaded for this agent"
                 }
             
-            # Combina todos os DataFrames do agente em um único DataFrame
-            # Usa o primeiro arquivo como base ou combina todos
-            dfs = list(self._dataframes[agent_id].values())
-            if not dfs:
+            # Cada arquivo é consultado isoladamente (sem concatenar os DataFrames)
+            filename = query_plan.file
+            if filename is None:
+                if len(file_paths) > 1:
+                    return {
+                        "success": False,
+                        "error": f"Informe 'file'. Arquivos disponíveis: {list(file_paths)}"
+                    }
+                filename = next(iter(file_paths))
+            if filename not in file_paths:
                 return {
                     "success": False,
-                    "error": "No data available"
+                    "error": f"Arquivo '{filename}' não encontrado. Arquivos disponíveis: {list(file_paths)}"
                 }
             
-            # Se houver múltiplos DataFrames, combina ou usa o primeiro
-            if len(dfs) == 1:
-                df = dfs[0]
-            else:
-                # Combina todos os DataFrames (concatena)
-                df = pd.concat(dfs, ignore_index=True)
-            
-            # Executa query de forma segura
-            try:
-                # Sanitiza query básica (remove comandos perigosos)
-                forbidden_keywords = ['import', 'exec', 'eval', '__', 'open', 'file', 'system', 'os', 'subprocess', 'globals', 'locals']
-                query_lower = query.lower()
-                if any(keyword in query_lower for keyword in forbidden_keywords):
-                    return {
-                        "success": False,
-                        "error": "Query contains forbidden operations"
-                    }
-                
-                # Tenta executar como query string primeiro
-                if query.strip().startswith('df.'):
-                    # Remove 'df.' do início
-                    query = query.strip()[3:].strip()
-                
-                # Executa query de forma segura usando um dicionário de métodos permitidos
-                try:
-                    # Cria um namespace seguro com apenas o DataFrame
-                    safe_dict = {'df': df, 'pd': pd}
-                    
-                    # Lista de métodos permitidos do pandas
-                    allowed_methods = [
-                        'head', 'tail', 'describe', 'info', 'columns', 'shape', 
-                        'dtypes', 'isna', 'notna', 'sum', 'mean', 'median', 
-                        'max', 'min', 'std', 'count', 'value_counts', 'groupby',
-                        'sort_values', 'dropna', 'fillna', 'query', 'loc', 'iloc',
-                        'select_dtypes', 'nunique', 'unique', 'sample'
-                    ]
-                    
-                    # Verifica se a query usa apenas métodos permitidos
-                    query_clean = query.strip()
-                    
-                    # Se começar com df., remove
-                    if query_clean.startswith('df.'):
-                        query_clean = query_clean[3:].strip()
-                    
-                    # Extrai o nome do método
-                    method_name = query_clean.split('(')[0].split('[')[0].strip()
-                    
-                    # Se for um método permitido ou uma operação de indexação/filtro
-                    if method_name in allowed_methods or '[' in query_clean or 'query' in query_lower:
-                        # Tenta executar usando eval com namespace seguro
-                        # Remove comandos perigosos antes
-                        if any(cmd in query_lower for cmd in ['import ', 'exec', 'eval', '__', 'globals', 'locals', 'open(']):
-                            return {
-                                "success": False,
-                                "error": "Query contains forbidden operations"
-                            }
-                        
-                        # Executa a query
-                        try:
-                            result = eval(query_clean, {"__builtins__": {}}, safe_dict)
-                        except NameError:
-                            # Se falhar, tenta com df. explícito
-                            try:
-                                result = eval(f"df.{query_clean}", {"__builtins__": {}}, safe_dict)
-                            except:
-                                # Última tentativa: executa como string de query do pandas
-                                if 'query' in query_lower or '[' in query_clean:
-                                    # Tenta como filtro
-                                    if '[' in query_clean and ']' in query_clean:
-                                        # Extrai a condição dentro de []
-                                        condition = query_clean[query_clean.find('[')+1:query_clean.rfind(']')]
-                                        if condition.strip():
-                                            # Tenta executar como df[condition]
-                                            try:
-                                                result = eval(f"df[{condition}]", {"__builtins__": {}}, safe_dict)
-                                            except:
-                                                result = df
-                                        else:
-                                            result = df
-                                    else:
-                                        result = df
-                                else:
-                                    raise
-                    else:
-                        return {
-                            "success": False,
-                            "error": f"Método '{method_name}' não permitido. Use métodos como: head(), tail(), describe(), query(), etc."
-                        }
-                        
-                except Exception as query_error:
-                    return {
-                        "success": False,
-                        "error": f"Query execution error: {str(query_error)}. Exemplos válidos: 'head(10)', 'describe()', \"query('coluna > 10')\", \"df[df['coluna'] == 'valor']\""
-                    }
-                
-                # Converte resultado para formato serializável
-                if isinstance(result, pd.DataFrame):
-                    return {
-                        "success": True,
-                        "result": result.to_dict(orient='records'),
-                        "rows": len(result),
-                        "columns": list(result.columns)
-                    }
-                elif isinstance(result, pd.Series):
-                    return {
-                        "success": True,
-                        "result": result.to_dict(),
-                        "type": "series"
-                    }
-                else:
-                    return {
-                        "success": True,
-                        "result": str(result),
-                        "type": "scalar"
-                    }
-                    
-            except Exception as e:
+            dataset = self._get_dataset(file_paths[filename])
+            if dataset is None:
                 return {
                     "success": False,
-                    "error": f"Query execution error: {str(e)}"
+                    "error": f"Could not load file {filename}"
                 }
-                
+            
+            result = run_plan(dataset.df, query_plan)
+            return {"success": True, "file": filename, **self._shape(result, limit=query_plan.limit)}
+            
+        except QueryPlanError as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
         except Exception as e:
             logger.error(f"Error executing query: {e}", exc_info=True)
+            return {
+                "success": False,
+                "error": f"Query execution error: {str(e)}"
+            }
+    
+    def _execute_sql(self, agent_id: str, sql: str) -> Dict[str, Any]:
+        """Executa SQL somente leitura com os arquivos do agente registrados como tabelas"""
+        try:
+            file_paths = self._agent_files.get(agent_id, {})
+            if not file_paths:
+                return {
+                    "success": False,
+                    "error": "No data files loaded for this agent"
+                }
+            if not sql.strip():
+                return {
+                    "success": False,
+                    "error": "Informe 'sql'"
+                }
+            
+            # Só carrega os arquivos cujas tabelas aparecem na consulta
+            tables = self.sql_engine.referenced_tables(
+                sql, {table_name(filename): path for filename, path in file_paths.items()}
+            )
+            frames = {}
+            for name, file_path in tables.items():
+                dataset = self._get_dataset(file_path)
+                if dataset is None:
+                    return {
+                        "success": False,
+                        "error": f"Could not load file {file_path.name}"
+                    }
+                frames[name] = dataset.df
+            
+            result, more = self.sql_engine.execute(frames, sql)
+            # Com mais linhas que o buscado, o resumo cobre só as linhas buscadas
+            return {"success": True, "engine": "sql", **self._shape(result, rows_capped=more)}
+            
+        except SQLQueryError as e:
             return {
                 "success": False,
                 "error": str(e)
             }
+        except Exception as e:
+            logger.error(f"Error executing SQL query: {e}", exc_info=True)
+            return {
+                "success": False,
+                "error": f"Query execution error: {str(e)}"
+            }
+    
+    def _shape(self, result: pd.DataFrame, limit: Optional[int] = None, rows_capped: bool = False) -> Dict[str, Any]:
+        return shape_result(
+            result, limit,
+            max_rows=self.result_max_rows, max_bytes=self.result_max_bytes, rows_capped=rows_capped
+        )
     
     def get_dataframe_info(self, agent_id: str) -> Dict[str, Any]:
         """Retorna informações sobre os DataFrames carregados"""
-        if agent_id not in self._dataframes or not self._dataframes[agent_id]:
-            return {"files": []}
-        
-        info = {"files": []}
-        for filename, df in self._dataframes[agent_id].items():
-            info["files"].append({
-                "filename": filename,
-                "rows": len(df),
-                "columns": list(df.columns),
-                "dtypes": df.dtypes.astype(str).to_dict(),
-                "sample": df.head(5).to_dict(orient='records') if len(df) > 0 else []
-            })
-        
-        return info
+        # Perfis são calculados uma vez por versão do arquivo
+        files = []
+        for file_path in self._agent_files.get(agent_id, {}).values():
+            profile = self.datasets.summary(file_path)
+            if profile is not None:
+                files.append(profile)
+        return {"files": files}
+    
+    def describe_files(self, agent_id: str, sql: bool = False) -> str:
+        """Descrição limitada dos arquivos do agente para a tool query_data (com nomes de tabela se `sql`)"""
+        profiles = self.get_dataframe_info(agent_id)["files"]
+        key = (agent_id, sql)
+        cached = self._descriptions.get(key)
+        # Os perfis só mudam com uma nova versão de arquivo (novo objeto)
+        if cached is not None and len(cached[0]) == len(profiles) and all(
+            a is b for a, b in zip(cached[0], profiles)
+        ):
+            return cached[1]
+        tables = [table_name(p["filename"]) for p in profiles] if sql else None
+        description = render_profiles(profiles, self.description_max_chars, tables)
+        self._descriptions[key] = (profiles, description)
+        return description
 
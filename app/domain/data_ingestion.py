@@ -0,0 +1,78 @@
+"""Leitura em blocos de CSV/XLSX grandes, com tipos inferidos de uma amostra"""
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+CHUNK_ROWS = 100_000
+SAMPLE_ROWS = 10_000
+# Bloco do leitor de CSV do pyarrow; os tipos são inferidos no primeiro bloco
+CSV_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+def _dtypes_from_sample(sample: pd.DataFrame) -> Dict[str, str]:
+    """Tipos anuláveis, para um bloco posterior com vazios não mudar o tipo da coluna"""
+    dtypes = {}
+    for column, dtype in sample.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            dtypes[column] = "boolean"
+        elif pd.api.types.is_integer_dtype(dtype):
+            dtypes[column] = "Int64"
+        elif pd.api.types.is_float_dtype(dtype):
+            dtypes[column] = "float64"
+        else:
+            dtypes[column] = "string"
+    return dtypes
+
+
+def iter_csv_chunks(file_path: Path, chunk_rows: int = CHUNK_ROWS) -> Iterator[Any]:
+    """RecordBatches do leitor em streaming do pyarrow; sem pyarrow, DataFrames do pandas"""
+    try:
+        from pyarrow import csv
+    except ImportError:
+        sample = pd.read_csv(file_path, nrows=SAMPLE_ROWS)
+        yield from pd.read_csv(file_path, chunksize=chunk_rows, dtype=_dtypes_from_sample(sample))
+        return
+
+    reader = csv.open_csv(file_path, read_options=csv.ReadOptions(block_size=CSV_BLOCK_BYTES))
+    for batch in reader:
+        yield batch
+
+
+def iter_xlsx_chunks(file_path: Path, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Primeira planilha lida linha a linha (openpyxl em modo somente leitura)"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+
+        dtypes: Optional[Dict[str, str]] = None
+        buffer: List[tuple] = []
+        for row in rows:
+            buffer.append(row)
+            # O primeiro bloco é a amostra que define os tipos
+            if len(buffer) >= (SAMPLE_ROWS if dtypes is None else chunk_rows):
+                chunk = pd.DataFrame(buffer, columns=columns).infer_objects()
+                dtypes = dtypes or _dtypes_from_sample(chunk)
+                yield chunk.astype(dtypes)
+                buffer = []
+        if buffer or dtypes is None:
+            chunk = pd.DataFrame(buffer, columns=columns).infer_objects()
+            yield chunk.astype(dtypes or _dtypes_from_sample(chunk))
+    finally:
+        workbook.close()
+
+
+def iter_chunks(file_path: Path, chunk_rows: int = CHUNK_ROWS) -> Optional[Iterator[Any]]:
+    """Blocos do arquivo, ou None se o formato não tem leitura em blocos (ex.: JSON)"""
+    suffix = file_path.suffix.lower()
+    if suffix == ".csv":
+        return iter_csv_chunks(file_path, chunk_rows)
+    if suffix == ".xlsx":
+        return iter_xlsx_chunks(file_path, chunk_rows)
+    return None
@@ -0,0 +1,211 @@
+"""Perfil compacto de cada versão de arquivo (schema, cardinalidade, min/max, amostra) e sua descrição para tools"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import json
+import logging
+import os
+
+import pandas as pd
+
+from app.domain.dataset_registry import DatasetVersion
+from app.infrastructure.columnar_store import COLUMNAR_DIR
+
+logger = logging.getLogger(__name__)
+
+# Incrementar quando o formato do perfil mudar (perfis antigos são recalculados)
+PROFILE_FORMAT = 1
+PROFILE_SUFFIX = ".profile.json"
+PROFILE_SAMPLE_ROWS = 3
+# Fração da descrição de um arquivo largo usada em colunas detalhadas; o resto lista nomes
+PROFILE_DETAIL_SHARE = 0.6
+# Colunas de texto com até esta cardinalidade listam os valores (categorias)
+PROFILE_CATEGORY_MAX = 20
+PROFILE_CATEGORY_VALUES = 10
+PROFILE_VALUE_CHARS = 40
+DEFAULT_DESCRIPTION_MAX_CHARS = 4000
+
+
+def _clip(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > PROFILE_VALUE_CHARS:
+        return value[:PROFILE_VALUE_CHARS - 1] + "…"
+    return value
+
+
+def _clean(value: Any) -> Any:
+    return None if isinstance(value, float) and value != value else _clip(value)
+
+
+def _encode(value: Any) -> Any:
+    """Tipos numpy/Arrow/pandas -> JSON (NA/NaT -> None)"""
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    if hasattr(value, "item"):
+        try:
+            return value.item()
+        except ValueError:
+            pass
+    return str(value)
+
+
+def _type_label(dtype) -> str:
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "int"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if isinstance(dtype, pd.ArrowDtype):
+        import pyarrow as pa
+        if pa.types.is_date(dtype.pyarrow_dtype):
+            return "date"
+        if pa.types.is_timestamp(dtype.pyarrow_dtype):
+            return "datetime"
+    if pd.api.types.is_string_dtype(dtype):
+        return "text"
+    return str(dtype)
+
+
+def _profile_column(series: pd.Series) -> Dict[str, Any]:
+    kind = _type_label(series.dtype)
+    info: Dict[str, Any] = {"name": str(series.name), "type": kind, "nulls": int(series.isna().sum())}
+    try:
+        info["distinct"] = int(series.nunique(dropna=True))
+        if kind in ("int", "float", "date", "datetime") and info["distinct"]:
+            info["min"] = _clean(series.min())
+            info["max"] = _clean(series.max())
+        elif kind in ("text", "bool") and info["distinct"] <= PROFILE_CATEGORY_MAX:
+            counts = series.value_counts(dropna=True).head(PROFILE_CATEGORY_VALUES)
+            info["values"] = [_clip(str(v)) for v in counts.index]
+    except TypeError:
+        # Valores não hasheáveis/comparáveis (listas, dicts) ficam só com tipo e nulos
+        pass
+    return info
+
+
+def profile_dataframe(filename: str, df: pd.DataFrame) -> Dict[str, Any]:
+    """Perfil do arquivo; calculado uma vez por versão (no upload ou na primeira carga)"""
+    sample = df.head(PROFILE_SAMPLE_ROWS).to_dict(orient="records") if len(df) > 0 else []
+    profile = {
+        "filename": filename,
+        "rows": len(df),
+        "columns": [_profile_column(df[column]) for column in df.columns],
+        "sample": [{str(k): _clean(v) for k, v in row.items()} for row in sample],
+    }
+    return json.loads(json.dumps(profile, default=_encode))
+
+
+def column_names(profile: Dict[str, Any]) -> List[str]:
+    return [column["name"] for column in profile["columns"]]
+
+
+def profile_path(source: Path) -> Path:
+    return source.parent / COLUMNAR_DIR / (source.name + PROFILE_SUFFIX)
+
+
+def read_profile(source: Path, version: DatasetVersion) -> Optional[Dict[str, Any]]:
+    """Perfil gravado da versão atual do arquivo (None se ausente ou de outra versão)"""
+    try:
+        with open(profile_path(source), "r", encoding="utf-8") as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable profile of {source.name}: {e}")
+        return None
+    if stored.get("format") != PROFILE_FORMAT or tuple(stored.get("version") or ()) != tuple(version):
+        return None
+    return stored.get("profile")
+
+
+def write_profile(source: Path, version: DatasetVersion, profile: Dict[str, Any]):
+    """Grava o perfil ao lado da cópia colunar (arquivo temporário + rename)"""
+    target = profile_path(source)
+    tmp = target.with_name(target.name + f".{os.getpid()}.tmp")
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"format": PROFILE_FORMAT, "version": list(version), "profile": profile}, f, ensure_ascii=False)
+        os.replace(tmp, target)
+    except OSError as e:
+        logger.warning(f"Could not write profile of {source.name}: {e}")
+        tmp.unlink(missing_ok=True)
+
+
+def delete_profile(source: Path):
+    profile_path(source).unlink(missing_ok=True)
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def _column_line(column: Dict[str, Any], rows: int) -> str:
+    parts = [column["type"]]
+    if column.get("values") is not None:
+        parts.append(f"valores: {' | '.join(column['values'])}")
+    elif "distinct" in column:
+        parts.append(f"{column['distinct']} distintos")
+    if column.get("min") is not None:
+        parts.append(f"{_format_value(column['min'])} a {_format_value(column['max'])}")
+    if column["nulls"]:
+        parts.append(f"{column['nulls'] * 100 // max(rows, 1) or '<1'}% nulos")
+    return f"- {column['name']}: {', '.join(parts)}"
+
+
+def _render_profile(profile: Dict[str, Any], budget: int, table: Optional[str]) -> str:
+    columns = profile["columns"]
+    header = profile["filename"] + (f" (tabela {table})" if table else "")
+    lines = [f"{header}: {profile['rows']} linhas, {len(columns)} colunas"]
+    size = len(lines[0])
+
+    details = [_column_line(column, profile["rows"]) for column in columns]
+    # Arquivo largo: colunas detalhadas em parte do orçamento; depois só os nomes; depois a contagem
+    detail_budget = budget
+    if size + sum(len(line) + 1 for line in details) > budget:
+        detail_budget = int(budget * PROFILE_DETAIL_SHARE)
+    shown = 0
+    for line in details:
+        if size + len(line) + 1 > detail_budget:
+            break
+        lines.append(line)
+        size += len(line) + 1
+        shown += 1
+    if shown < len(columns):
+        names: List[str] = []
+        for column in columns[shown:]:
+            if size + len(column["name"]) + 40 > budget:
+                break
+            names.append(column["name"])
+            size += len(column["name"]) + 2
+        rest = len(columns) - shown - len(names)
+        lines.append(
+            f"- outras colunas: {', '.join(names)}" + (f" (+{rest} omitidas)" if rest else "")
+            if names else f"- +{rest} colunas omitidas"
+        )
+    elif profile["sample"]:
+        example = f"Exemplo: {json.dumps(profile['sample'][0], ensure_ascii=False, default=str)}"
+        if size + len(example) + 1 <= budget:
+            lines.append(example)
+    return "\n".join(lines)
+
+
+def render_profiles(
+    profiles: List[Dict[str, Any]],
+    max_chars: int = DEFAULT_DESCRIPTION_MAX_CHARS,
+    tables: Optional[List[str]] = None
+) -> str:
+    """Descrição em texto dos arquivos, limitada a ~`max_chars` independente da largura dos arquivos"""
+    if not profiles:
+        return "Nenhum arquivo carregado"
+    budget = max(200, max_chars // len(profiles))
+    return "\n".join(
+        _render_profile(profile, budget, tables[i] if tables else None)
+        for i, profile in enumerate(profiles)
+    )
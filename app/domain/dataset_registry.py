@@ -0,0 +1,136 @@
+"""Registro de datasets carregados, versionados por caminho + mtime/tamanho"""
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+import logging
+import os
+import threading
+
+import pandas as pd
+
+from app.infrastructure.metrics_registry import registry
+
+logger = logging.getLogger(__name__)
+
+# (st_mtime_ns, st_size): muda sempre que o arquivo é regravado
+DatasetVersion = Tuple[int, int]
+
+DATA_CACHE_LOOKUPS = registry.counter(
+    "data_cache_lookups_total", "Buscas de DataFrames no cache de datasets", labels=("result",)
+)
+DATA_CACHE_EVICTIONS = registry.counter("data_cache_evictions_total", "DataFrames removidos do cache por LRU")
+DATA_CACHE_BYTES = registry.gauge("data_cache_bytes", "Memória ocupada pelos DataFrames em cache")
+
+
+def file_version(path: Path) -> Optional[DatasetVersion]:
+    """Versão atual do arquivo (None se não existe)"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Dataset:
+    """DataFrame de um arquivo com o perfil (schema/amostra) da versão carregada"""
+
+    __slots__ = ("path", "version", "df", "summary", "nbytes")
+
+    def __init__(self, path: Path, version: DatasetVersion, df: pd.DataFrame, summary: Dict[str, Any]):
+        self.path = path
+        self.version = version
+        self.df = df
+        self.summary = summary
+        self.nbytes = int(df.memory_usage(deep=True).sum())
+
+
+class DatasetRegistry:
+    """Datasets por caminho em um LRU limitado por bytes
+
+    Uma entrada só vale enquanto a versão do arquivo não muda. Os resumos (perfis, ver
+    dataset_profile) sobrevivem à remoção do DataFrame, então descrever os dados não exige
+    recarregá-los.
+    """
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes  # 0 = sem limite
+        self._frames: "OrderedDict[str, Dataset]" = OrderedDict()
+        self._summaries: Dict[str, Tuple[DatasetVersion, Dict[str, Any]]] = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        # Consultas rodam em threads do executor
+        self._lock = threading.Lock()
+
+    def get(self, path: Path, version: Optional[DatasetVersion] = None) -> Optional[Dataset]:
+        """Entrada do caminho; com `version`, só se ainda corresponder ao arquivo"""
+        key = str(path)
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is not None and version is not None and entry.version != version:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                DATA_CACHE_LOOKUPS.inc(result="miss")
+                return None
+            self._frames.move_to_end(key)
+            self._hits += 1
+            DATA_CACHE_LOOKUPS.inc(result="hit")
+            return entry
+
+    def put(self, path: Path, version: DatasetVersion, df: pd.DataFrame, summary: Dict[str, Any]) -> Dataset:
+        entry = Dataset(path, version, df, summary)
+        key = str(path)
+        with self._lock:
+            self._remove(key)
+            self._frames[key] = entry
+            self._summaries[key] = (version, entry.summary)
+            self._bytes += entry.nbytes
+            # Mantém ao menos a entrada recém-carregada, mesmo acima do limite
+            while self.max_bytes and self._bytes > self.max_bytes and len(self._frames) > 1:
+                oldest = next(iter(self._frames))
+                self._remove(oldest)
+                self._evictions += 1
+                DATA_CACHE_EVICTIONS.inc()
+                logger.debug(f"Evicted dataset {oldest} from cache")
+            DATA_CACHE_BYTES.set(self._bytes)
+        return entry
+
+    def summary(self, path: Path, version: Optional[DatasetVersion] = None) -> Optional[Dict[str, Any]]:
+        """Resumo do arquivo, mesmo que o DataFrame já tenha saído do cache"""
+        cached = self._summaries.get(str(path))
+        if cached is None or (version is not None and cached[0] != version):
+            return None
+        return cached[1]
+
+    def set_summary(self, path: Path, version: DatasetVersion, summary: Dict[str, Any]):
+        """Registra um resumo sem o DataFrame (ex.: perfil gravado em disco)"""
+        with self._lock:
+            self._summaries[str(path)] = (version, summary)
+
+    def discard(self, path: Path):
+        key = str(path)
+        with self._lock:
+            self._remove(key)
+            self._summaries.pop(key, None)
+            DATA_CACHE_BYTES.set(self._bytes)
+
+    def _remove(self, key: str):
+        entry = self._frames.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "datasets": len(self._frames),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+        }
+
+    def __len__(self) -> int:
+        return len(self._frames)
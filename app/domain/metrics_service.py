@@ -2,16 +2,96 @@
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 from app.infrastructure.redis_client import RedisClient
+import asyncio
+import json
 import logging
+import math
+import time
 
 logger = logging.getLogger(__name__)
 
 
+METRICS_TTL = 30 * 24 * 60 * 60  # 30 dias
+MAX_BUFFERED_ENTRIES = 10000
+
+# Contadores em buckets de tempo (hashes com messages/tokens/success/errors)
+MINUTE_BUCKET_TTL = 2 * 24 * 60 * 60  # 2 dias
+HOUR_BUCKET_TTL = 90 * 24 * 60 * 60  # 90 dias
+DAY_BUCKET_TTL = 91 * 24 * 60 * 60  # 91 dias (cobre o dia parcial no início da janela)
+MAX_WINDOW_DAYS = 90
+# Primeiro dia (UTC) com agregados diários; dias anteriores são lidos pelos buckets horários
+ROLLUP_SINCE_KEY = "metrics:rollup:since"
+COUNTER_FIELDS = ("messages", "tokens", "success", "errors")
+
+# Histogramas de latência log-lineares: cada potência de 2 (em ms) é dividida
+# em LATENCY_SUB_BUCKETS faixas lineares (erro relativo máximo de 12,5%)
+LATENCY_SUB_BUCKETS = 8
+LATENCY_STAGES = ("embedding", "retrieval", "llm_ttft", "llm", "total", "enqueue")
+
+
+def latency_bucket(value_ms: float) -> int:
+    """Índice do bucket log-linear para uma latência em ms (0 = abaixo de 1 ms)"""
+    if value_ms < 1:
+        return 0
+    exponent = int(math.floor(math.log2(value_ms)))
+    sub = int((value_ms / (2 ** exponent) - 1) * LATENCY_SUB_BUCKETS)
+    return exponent * LATENCY_SUB_BUCKETS + min(sub, LATENCY_SUB_BUCKETS - 1) + 1
+
+
+def latency_bucket_upper_ms(index: int) -> float:
+    """Limite superior (ms) de um bucket log-linear"""
+    if index <= 0:
+        return 1.0
+    exponent, sub = divmod(index - 1, LATENCY_SUB_BUCKETS)
+    return (2 ** exponent) * (1 + (sub + 1) / LATENCY_SUB_BUCKETS)
+
+
+def histogram_percentile(counts: Dict[int, int], quantile: float) -> float:
+    """Percentil (ms) estimado pelo limite superior do bucket que contém o rank"""
+    total = sum(counts.values())
+    if total == 0:
+        return 0.0
+    rank = quantile * total
+    cumulative = 0
+    for index in sorted(counts):
+        cumulative += counts[index]
+        if cumulative >= rank:
+            return latency_bucket_upper_ms(index)
+    return latency_bucket_upper_ms(max(counts))
+
+
 class MetricsService:
     """Serviço para coletar e armazenar métricas do sistema"""
     
-    def __init__(self, redis_client: RedisClient):
+    def __init__(
+        self,
+        redis_client: RedisClient,
+        buffered: bool = False,
+        flush_interval: float = 1.0
+    ):
         self.redis = redis_client
+        self.buffered = buffered
+        self.flush_interval = flush_interval
+        self._buffer: List[Dict] = []
+        self._latency_buffer: Dict[str, Dict[str, float]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._rollup_since: Optional[int] = None
+    
+    async def start(self):
+        """Inicia o flusher em background (modo buffered)"""
+        if self.buffered and not self._flush_task:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def stop(self):
+        """Para o flusher e grava o que estiver pendente"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
     
     async def record_message(
         self,
@@ -20,62 +100,239 @@ class MetricsService:
         channel: str,
         response_time: float,
         tokens_used: Optional[int] = None,
-        success: bool = True
+        success: bool = True,
+        latency_stage: str = "total"
     ):
-        """Registra uma mensagem processada"""
-        timestamp = datetime.now()
-        
-        # Métricas por agente
-        await self._increment_counter(f"metrics:agent:{agent_id}:messages")
-        
-        # Incrementa tokens apenas se não for None
-        if tokens_used is not None and tokens_used > 0:
-            await self._increment_counter(f"metrics:agent:{agent_id}:tokens", tokens_used)
-        
-        # Sempre registra sucesso ou erro
-        if success:
-            await self._increment_counter(f"metrics:agent:{agent_id}:success")
-            logger.debug(f"Recorded success for agent {agent_id}")
-        else:
-            await self._increment_counter(f"metrics:agent:{agent_id}:errors")
-            logger.debug(f"Recorded error for agent {agent_id}")
-        
-        # Métricas globais
-        await self._increment_counter("metrics:global:messages")
-        
-        # Incrementa tokens globais apenas se não for None
-        if tokens_used is not None and tokens_used > 0:
-            await self._increment_counter("metrics:global:tokens", tokens_used)
-        
-        # Armazenar tempo de resposta (apenas se > 0)
-        if response_time > 0:
-            await self._record_response_time(agent_id, response_time)
-        
-        # Log estruturado
-        log_entry = {
-            "timestamp": timestamp.isoformat(),
+        """Registra uma mensagem processada
+
+        `response_time` entra no histograma de `latency_stage`: "total" para o tempo de ponta
+        a ponta (worker ou resposta síncrona), "enqueue" para o webhook que só enfileira.
+        """
+        entry = {
+            "ts": time.time(),
+            "timestamp": datetime.now().isoformat(),
             "agent_id": agent_id,
             "user_id": user_id,
             "channel": channel,
             "response_time": response_time,
             "tokens_used": tokens_used,
-            "success": success
+            "success": success,
+            "latency_stage": latency_stage
         }
         
-        await self._add_to_log("metrics:logs", log_entry)
+        # Fora do caminho da requisição: o flusher grava em lote
+        if self._flush_task:
+            self._buffer.append(entry)
+            if len(self._buffer) >= MAX_BUFFERED_ENTRIES:
+                await self.flush()
+            return
+        
+        await self._write_entries([entry])
+    
+    async def record_latency(self, agent_id: str, stage: str, seconds: float):
+        """Registra a latência de um estágio (embedding, retrieval, llm_ttft, llm, total, enqueue)"""
+        if seconds < 0:
+            return
+        if self._flush_task:
+            self._add_latency(self._latency_buffer, agent_id, stage, seconds, time.time())
+            return
+        latencies: Dict[str, Dict[str, float]] = {}
+        self._add_latency(latencies, agent_id, stage, seconds, time.time())
+        await self._write_entries([], latencies)
+    
+    async def flush(self):
+        """Grava as entradas pendentes no Redis"""
+        if not self._buffer and not self._latency_buffer:
+            return
+        entries, self._buffer = self._buffer, []
+        latencies, self._latency_buffer = self._latency_buffer, {}
+        await self._write_entries(entries, latencies)
+    
+    def _add_latency(
+        self,
+        target: Dict[str, Dict[str, float]],
+        agent_id: str,
+        stage: str,
+        seconds: float,
+        ts: float
+    ):
+        """Acumula uma amostra nos histogramas horário e diário do agente e global"""
+        value_ms = seconds * 1000
+        field = str(latency_bucket(value_ms))
+        hour, day = int(ts // 3600), int(ts // 86400)
+        for scope in (f"agent:{agent_id}", "global"):
+            for suffix in (f"h:{hour}", f"d:{day}"):
+                hist = target.setdefault(f"metrics:latency:{scope}:{stage}:{suffix}", {})
+                hist[field] = hist.get(field, 0) + 1
+                hist["count"] = hist.get("count", 0) + 1
+                hist["sum_ms"] = hist.get("sum_ms", 0.0) + value_ms
+    
+    async def _flush_loop(self):
+        """Loop do flusher em background"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing metrics: {e}")
+    
+    async def _write_entries(
+        self,
+        entries: List[Dict],
+        latencies: Optional[Dict[str, Dict[str, float]]] = None
+    ):
+        """Grava um lote de entradas em um único pipeline (um round trip)"""
+        latencies = latencies if latencies is not None else {}
+        if not self.redis.client or (not entries and not latencies):
+            return
+        
+        buckets: Dict[str, Dict[str, int]] = {}
+        top: Dict[str, Dict[str, int]] = {}
+        logs: List[str] = []
+        
+        for entry in entries:
+            agent_id = entry["agent_id"]
+            tokens_used = entry.get("tokens_used")
+            ts = entry.get("ts") or time.time()
+            minute, hour, day = int(ts // 60), int(ts // 3600), int(ts // 86400)
+            
+            increments = {"messages": 1, "success" if entry.get("success") else "errors": 1}
+            if tokens_used is not None and tokens_used > 0:
+                increments["tokens"] = tokens_used
+            
+            # Buckets por minuto, hora e dia, para o agente e global
+            for scope in (f"agent:{agent_id}", "global"):
+                for key in (f"metrics:{scope}:m:{minute}", f"metrics:{scope}:h:{hour}", f"metrics:{scope}:d:{day}"):
+                    bucket = buckets.setdefault(key, {})
+                    for field, value in increments.items():
+                        bucket[field] = bucket.get(field, 0) + value
+            
+            # Ranking diário de agentes (top-N mantido na escrita)
+            day_top = top.setdefault(f"metrics:top:d:{day}", {})
+            day_top[agent_id] = day_top.get(agent_id, 0) + 1
+            
+            # Tempo de resposta (apenas se > 0) no estágio informado
+            if entry.get("response_time", 0) > 0:
+                stage = entry.get("latency_stage", "total")
+                self._add_latency(latencies, agent_id, stage, entry["response_time"], ts)
+            
+            # Log estruturado
+            logs.append(json.dumps({k: v for k, v in entry.items() if k != "ts"}))
+        
+        try:
+            pipe = self.redis.client.pipeline(transaction=False)
+            pipe.set(ROLLUP_SINCE_KEY, int(time.time() // 86400), nx=True)
+            for key, fields in buckets.items():
+                for field, value in fields.items():
+                    pipe.hincrby(key, field, value)
+                pipe.expire(key, self._bucket_ttl(key))
+            for key, members in top.items():
+                for agent_id, value in members.items():
+                    pipe.zincrby(key, value, agent_id)
+                pipe.expire(key, HOUR_BUCKET_TTL)
+            for key, fields in latencies.items():
+                for field, value in fields.items():
+                    if field == "sum_ms":
+                        pipe.hincrbyfloat(key, field, value)
+                    else:
+                        pipe.hincrby(key, field, int(value))
+                pipe.expire(key, self._bucket_ttl(key))
+            if logs:
+                pipe.lpush("metrics:logs", *logs)
+                pipe.ltrim("metrics:logs", 0, 9999)  # Manter últimos 10000
+                pipe.expire("metrics:logs", METRICS_TTL)
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error writing metrics: {e}")
+    
+    @staticmethod
+    def _bucket_ttl(key: str) -> int:
+        if ":m:" in key:
+            return MINUTE_BUCKET_TTL
+        return DAY_BUCKET_TTL if ":d:" in key else HOUR_BUCKET_TTL
+    
+    def _window_seconds(self, days: int, hours: Optional[int] = None) -> float:
+        """Converte o período pedido em segundos (limitado à retenção dos buckets)"""
+        seconds = hours * 3600 if hours else days * 86400
+        return float(max(60, min(seconds, MAX_WINDOW_DAYS * 86400)))
+    
+    async def _get_rollup_since(self) -> Optional[int]:
+        """Primeiro dia com agregados diários (fixo depois de gravado, então fica em cache)"""
+        if self._rollup_since is None:
+            value = await self.redis.client.get(ROLLUP_SINCE_KEY)
+            self._rollup_since = int(value) if value is not None else None
+        return self._rollup_since
+    
+    def _hour_range_buckets(self, first_hour: int, end_hour: int, rollup_since: Optional[int]) -> List[str]:
+        """Sufixos ('h:<hora>' / 'd:<dia>') que cobrem as horas [first_hour, end_hour).
+        
+        Dias completos usam o agregado diário; só as bordas (e os dias anteriores
+        a `rollup_since`, sem agregado completo) usam horas.
+        """
+        first_day = max(-(-first_hour // 24), rollup_since + 1 if rollup_since is not None else end_hour)
+        end_day = end_hour // 24
+        if first_day >= end_day:
+            return [f"h:{h}" for h in range(first_hour, end_hour)]
+        return (
+            [f"h:{h}" for h in range(first_hour, first_day * 24)]
+            + [f"d:{d}" for d in range(first_day, end_day)]
+            + [f"h:{h}" for h in range(end_day * 24, end_hour)]
+        )
+    
+    def _window_buckets(self, start: float, end: float, rollup_since: Optional[int] = None) -> List[str]:
+        """Sufixos de buckets ('m:<minuto>' / 'h:<hora>' / 'd:<dia>') que cobrem [start, end].
+        
+        Dias completos usam o bucket diário, horas completas o horário; só as bordas usam minutos.
+        """
+        if time.time() - start > MINUTE_BUCKET_TTL - 3600:
+            # Minutos tão antigos já expiraram: a borda inicial fica com resolução horária
+            start = (start // 3600) * 3600
+        start_min, end_min = int(start // 60), int(end // 60)
+        first_hour = -(-start_min // 60)
+        end_hour = (end_min + 1) // 60
+        if first_hour >= end_hour:
+            return [f"m:{m}" for m in range(start_min, end_min + 1)]
+        return (
+            [f"m:{m}" for m in range(start_min, first_hour * 60)]
+            + self._hour_range_buckets(first_hour, end_hour, rollup_since)
+            + [f"m:{m}" for m in range(end_hour * 60, end_min + 1)]
+        )
+    
+    async def _get_window_counters(self, scope: str, window_seconds: float) -> Dict[str, int]:
+        """Soma os buckets de uma janela de tempo em um único pipeline"""
+        totals = {field: 0 for field in COUNTER_FIELDS}
+        if not self.redis.client:
+            return totals
+        end = time.time()
+        try:
+            rollup_since = await self._get_rollup_since()
+            pipe = self.redis.client.pipeline(transaction=False)
+            for suffix in self._window_buckets(end - window_seconds, end, rollup_since):
+                pipe.hgetall(f"metrics:{scope}:{suffix}")
+            for bucket in await pipe.execute():
+                for field, value in (bucket or {}).items():
+                    if field in totals:
+                        totals[field] += int(value)
+        except Exception as e:
+            logger.error(f"Error reading metrics window for {scope}: {e}")
+        return totals
     
     async def get_agent_metrics(
         self,
         agent_id: str,
-        days: int = 7
+        days: int = 7,
+        hours: Optional[int] = None
     ) -> Dict:
-        """Obtém métricas de um agente"""
-        messages = await self._get_counter(f"metrics:agent:{agent_id}:messages")
-        tokens = await self._get_counter(f"metrics:agent:{agent_id}:tokens")
-        success = await self._get_counter(f"metrics:agent:{agent_id}:success")
-        errors = await self._get_counter(f"metrics:agent:{agent_id}:errors")
+        """Obtém métricas de um agente no período (últimos `days` dias ou `hours` horas)"""
+        window_seconds = self._window_seconds(days, hours)
+        counters = await self._get_window_counters(f"agent:{agent_id}", window_seconds)
+        messages = counters["messages"]
+        tokens = counters["tokens"]
+        success = counters["success"]
+        errors = counters["errors"]
         
-        avg_response_time = await self._get_avg_response_time(agent_id)
+        latency = await self.get_latency_stats(f"agent:{agent_id}", window_seconds)
+        avg_response_time = latency.get("total", {}).get("avg", 0.0)
         
         # Calcula taxa de sucesso: se não há mensagens, retorna 0, senão calcula baseado em sucesso/total
         total_attempts = success + errors
@@ -87,91 +344,85 @@ class MetricsService:
         return {
             "agent_id": agent_id,
             "period_days": days,
+            "period_hours": hours,
             "messages": messages,
             "tokens_used": tokens,
             "success_count": success,
             "error_count": errors,
             "success_rate": success_rate,
-            "avg_response_time": round(avg_response_time, 3)
+            "avg_response_time": round(avg_response_time, 3),
+            "latency": latency
         }
     
-    async def get_global_metrics(self, days: int = 7) -> Dict:
-        """Obtém métricas globais"""
-        messages = await self._get_counter("metrics:global:messages")
-        tokens = await self._get_counter("metrics:global:tokens")
+    async def get_global_metrics(self, days: int = 7, hours: Optional[int] = None) -> Dict:
+        """Obtém métricas globais no período"""
+        window_seconds = self._window_seconds(days, hours)
+        counters = await self._get_window_counters("global", window_seconds)
+        messages = counters["messages"]
+        tokens = counters["tokens"]
         
         return {
             "period_days": days,
+            "period_hours": hours,
             "total_messages": messages,
             "total_tokens": tokens,
-            "avg_tokens_per_message": tokens / messages if messages > 0 else 0
+            "avg_tokens_per_message": tokens / messages if messages > 0 else 0,
+            "latency": await self.get_latency_stats("global", window_seconds)
         }
     
-    async def get_top_agents(self, limit: int = 10) -> List[Dict]:
-        """Obtém top agentes por volume de mensagens"""
-        # Busca todos os agentes com métricas
-        pattern = "metrics:agent:*:messages"
-        # Implementação simplificada - em produção, usar SCAN
-        return []
-    
-    async def _increment_counter(self, key: str, value: int = 1):
-        """Incrementa um contador"""
-        if not self.redis.client:
-            return
-        try:
-            await self.redis.client.incrby(key, value)
-            # Expira após 30 dias
-            await self.redis.client.expire(key, 30 * 24 * 60 * 60)
-        except Exception as e:
-            logger.error(f"Error incrementing counter {key}: {e}")
-    
-    async def _get_counter(self, key: str) -> int:
-        """Obtém valor de um contador"""
-        if not self.redis.client:
-            return 0
-        try:
-            value = await self.redis.client.get(key)
-            return int(value) if value else 0
-        except Exception as e:
-            logger.error(f"Error getting counter {key}: {e}")
-            return 0
-    
-    async def _record_response_time(self, agent_id: str, response_time: float):
-        """Registra tempo de resposta"""
+    async def get_top_agents(self, limit: int = 10, days: int = 7) -> List[Dict]:
+        """Obtém top agentes por volume de mensagens (resolução diária)"""
         if not self.redis.client:
-            return
+            return []
+        days = max(1, min(days, MAX_WINDOW_DAYS))
+        today = int(time.time() // 86400)
+        keys = [f"metrics:top:d:{day}" for day in range(today - days + 1, today + 1)]
         try:
-            key = f"metrics:agent:{agent_id}:response_times"
-            await self.redis.client.lpush(key, response_time)
-            await self.redis.client.ltrim(key, 0, 999)  # Manter últimos 1000
-            await self.redis.client.expire(key, 30 * 24 * 60 * 60)
+            ranking = await self.redis.client.zunion(keys, withscores=True)
         except Exception as e:
-            logger.error(f"Error recording response time: {e}")
+            logger.error(f"Error getting top agents: {e}")
+            return []
+        ranking = sorted(ranking, key=lambda item: item[1], reverse=True)[:limit]
+        return [{"agent_id": agent_id, "messages": int(score)} for agent_id, score in ranking]
     
-    async def _get_avg_response_time(self, agent_id: str) -> float:
-        """Obtém tempo médio de resposta"""
+    async def get_latency_stats(self, scope: str, window_seconds: float) -> Dict[str, Dict]:
+        """Mescla os histogramas da janela (dias completos + horas nas bordas) e calcula média e percentis (em segundos)"""
         if not self.redis.client:
-            return 0.0
+            return {}
+        end = time.time()
         try:
-            key = f"metrics:agent:{agent_id}:response_times"
-            times = await self.redis.client.lrange(key, 0, 99)  # Últimas 100
-            if not times:
-                return 0.0
-            times_float = [float(t) for t in times]
-            return sum(times_float) / len(times_float)
+            suffixes = self._hour_range_buckets(
+                int((end - window_seconds) // 3600), int(end // 3600) + 1, await self._get_rollup_since()
+            )
+            pipe = self.redis.client.pipeline(transaction=False)
+            for stage in LATENCY_STAGES:
+                for suffix in suffixes:
+                    pipe.hgetall(f"metrics:latency:{scope}:{stage}:{suffix}")
+            results = await pipe.execute()
         except Exception as e:
-            logger.error(f"Error getting avg response time: {e}")
-            return 0.0
-    
-    async def _add_to_log(self, key: str, entry: Dict):
-        """Adiciona entrada ao log"""
-        if not self.redis.client:
-            return
-        try:
-            import json
-            await self.redis.client.lpush(key, json.dumps(entry))
-            await self.redis.client.ltrim(key, 0, 9999)  # Manter últimos 10000
-            await self.redis.client.expire(key, 30 * 24 * 60 * 60)
-        except Exception as e:
-            logger.error(f"Error adding to log: {e}")
-
+            logger.error(f"Error reading latency histograms for {scope}: {e}")
+            return {}
+        
+        stats: Dict[str, Dict] = {}
+        per_stage = len(suffixes)
+        for i, stage in enumerate(LATENCY_STAGES):
+            counts: Dict[int, int] = {}
+            count, sum_ms = 0, 0.0
+            for hist in results[i * per_stage:(i + 1) * per_stage]:
+                for field, value in (hist or {}).items():
+                    if field == "count":
+                        count += int(value)
+                    elif field == "sum_ms":
+                        sum_ms += float(value)
+                    else:
+                        counts[int(field)] = counts.get(int(field), 0) + int(value)
+            if count == 0:
+                continue
+            stats[stage] = {
+                "count": count,
+                "avg": round(sum_ms / count / 1000, 3),
+                "p50": round(histogram_percentile(counts, 0.50) / 1000, 3),
+                "p95": round(histogram_percentile(counts, 0.95) / 1000, 3),
+                "p99": round(histogram_percentile(counts, 0.99) / 1000, 3),
+            }
+        return stats
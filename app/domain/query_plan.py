@@ -0,0 +1,188 @@
+"""Plano de consulta estruturado (filtro, agrupamento, agregação, ordenação, limite) para DataFrames"""
+from typing import Any, Dict, List, Literal, Optional
+
+import pandas as pd
+from pydantic import BaseModel, Field, ValidationError
+
+FilterOp = Literal[
+    "==", "!=", ">", ">=", "<", "<=", "in", "not_in", "contains", "startswith", "is_null", "not_null"
+]
+AggregateFunc = Literal["count", "sum", "mean", "median", "min", "max", "std", "nunique"]
+
+
+class QueryPlanError(ValueError):
+    """Plano inválido para os dados do arquivo (coluna inexistente, operador sem valor, etc.)"""
+
+
+class QueryFilter(BaseModel):
+    column: str
+    op: FilterOp = "=="
+    value: Any = None
+
+
+class QueryAggregate(BaseModel):
+    column: Optional[str] = None  # None com func=count conta linhas
+    func: AggregateFunc = "count"
+    name: Optional[str] = None
+
+
+class QuerySort(BaseModel):
+    column: str
+    descending: bool = False
+
+
+class QueryPlan(BaseModel):
+    """Consulta em um arquivo: filtros (E lógico) -> agrupamento/agregações -> ordenação -> limite"""
+    file: Optional[str] = None
+    columns: List[str] = Field(default_factory=list)
+    filters: List[QueryFilter] = Field(default_factory=list)
+    group_by: List[str] = Field(default_factory=list)
+    aggregates: List[QueryAggregate] = Field(default_factory=list)
+    sort: List[QuerySort] = Field(default_factory=list)
+    limit: int = Field(default=50, ge=0)
+
+    @classmethod
+    def parse(cls, raw: Dict[str, Any]) -> "QueryPlan":
+        try:
+            return cls.model_validate(raw or {})
+        except ValidationError as e:
+            errors = "; ".join(
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+            )
+            raise QueryPlanError(f"Plano inválido: {errors}")
+
+
+# Parâmetros da tool query_data (JSON Schema do function calling)
+QUERY_PLAN_TOOL_PARAMETERS: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "file": {"type": "string", "description": "Arquivo consultado (obrigatório se houver mais de um)"},
+        "columns": {
+            "type": "array", "items": {"type": "string"},
+            "description": "Colunas retornadas quando não há agregação (vazio = todas)"
+        },
+        "filters": {
+            "type": "array",
+            "description": "Condições combinadas com E",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "column": {"type": "string"},
+                    "op": {"type": "string", "enum": list(FilterOp.__args__)},
+                    "value": {"description": "Valor comparado; lista para in/not_in"}
+                },
+                "required": ["column", "op"]
+            }
+        },
+        "group_by": {"type": "array", "items": {"type": "string"}},
+        "aggregates": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "column": {"type": "string", "description": "Omitir com func=count para contar linhas"},
+                    "func": {"type": "string", "enum": list(AggregateFunc.__args__)},
+                    "name": {"type": "string", "description": "Nome da coluna no resultado"}
+                },
+                "required": ["func"]
+            }
+        },
+        "sort": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"column": {"type": "string"}, "descending": {"type": "boolean"}},
+                "required": ["column"]
+            }
+        },
+        "limit": {"type": "integer", "description": "Máximo de linhas desejadas"}
+    }
+}
+
+
+def _check_columns(df: pd.DataFrame, columns: List[str]):
+    missing = [c for c in columns if c not in df.columns]
+    if missing:
+        raise QueryPlanError(f"Colunas inexistentes: {missing}. Disponíveis: {list(df.columns)}")
+
+
+def _filter_mask(series: pd.Series, flt: QueryFilter) -> pd.Series:
+    op, value = flt.op, flt.value
+    if op == "is_null":
+        return series.isna()
+    if op == "not_null":
+        return series.notna()
+    if value is None:
+        raise QueryPlanError(f"Filtro '{op}' em '{flt.column}' exige 'value'")
+    if op in ("in", "not_in"):
+        values = value if isinstance(value, list) else [value]
+        mask = series.isin(values)
+        return ~mask if op == "not_in" else mask
+    if op in ("contains", "startswith"):
+        text = (series if pd.api.types.is_string_dtype(series.dtype) else series.astype(str)).str
+        if op == "contains":
+            return text.contains(str(value), case=False, regex=False)
+        return text.startswith(str(value))
+    try:
+        if op == "==":
+            return series == value
+        if op == "!=":
+            return series != value
+        if op == ">":
+            return series > value
+        if op == ">=":
+            return series >= value
+        if op == "<":
+            return series < value
+        return series <= value
+    except TypeError:
+        raise QueryPlanError(f"Valor {value!r} não é comparável com a coluna '{flt.column}' ({series.dtype})")
+
+
+def run_plan(df: pd.DataFrame, plan: QueryPlan) -> pd.DataFrame:
+    """Executa o plano com operações vetorizadas; o limite fica para a serialização do resultado"""
+    referenced = (
+        plan.columns
+        + [f.column for f in plan.filters]
+        + plan.group_by
+        + [a.column for a in plan.aggregates if a.column]
+    )
+    _check_columns(df, referenced)
+
+    if plan.filters:
+        mask = None
+        for flt in plan.filters:
+            flt_mask = _filter_mask(df[flt.column], flt).fillna(False).astype(bool)
+            mask = flt_mask if mask is None else mask & flt_mask
+        df = df.loc[mask]
+
+    if plan.aggregates or plan.group_by:
+        aggregates = plan.aggregates or [QueryAggregate(func="count")]
+        named = {}
+        for agg in aggregates:
+            name = agg.name or (f"{agg.func}_{agg.column}" if agg.column else "count")
+            named[name] = agg
+        if plan.group_by:
+            grouped = df.groupby(plan.group_by, sort=False, observed=True, dropna=False)
+            parts = []
+            for name, agg in named.items():
+                if agg.column is None:
+                    parts.append(grouped.size().rename(name))
+                else:
+                    parts.append(grouped[agg.column].agg(agg.func).rename(name))
+            result = pd.concat(parts, axis=1).reset_index()
+        else:
+            result = pd.DataFrame([{
+                name: len(df) if agg.column is None else df[agg.column].agg(agg.func)
+                for name, agg in named.items()
+            }])
+    else:
+        result = df[plan.columns] if plan.columns else df
+
+    if plan.sort:
+        _check_columns(result, [s.column for s in plan.sort])
+        result = result.sort_values(
+            [s.column for s in plan.sort], ascending=[not s.descending for s in plan.sort]
+        )
+
+    return result
@@ -0,0 +1,231 @@
+"""Pool dedicado para consultas de análise de dados, isolado do executor padrão do event loop"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+
+from app.infrastructure.metrics_registry import registry
+
+logger = logging.getLogger(__name__)
+
+DATA_QUERIES = registry.counter(
+    "data_queries_total", "Consultas de análise de dados por resultado", labels=("outcome",)
+)
+DATA_QUERY_DURATION = registry.histogram("data_query_duration_seconds", "Duração das consultas de análise de dados")
+DATA_QUERY_BUSY = registry.gauge("data_query_pool_busy", "Executores do pool de consultas ocupados")
+DATA_QUERY_PENDING = registry.gauge("data_query_pool_pending", "Consultas em execução ou aguardando executor")
+
+
+def _worker_main(conn, service_options: Dict[str, Any], memory_limit_mb: int):
+    """Loop do processo executor: recebe (agent_id, arquivos, plano, engine) e devolve o resultado"""
+    # Ctrl+C é tratado pelo processo principal, que encerra os executores
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit_mb:
+        import resource
+        # RLIMIT_DATA não conta os arquivos Arrow mapeados (somente leitura), só memória alocada
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+    from app.domain.data_analysis_service import DataAnalysisService
+    service = DataAnalysisService(**service_options)
+
+    while True:
+        try:
+            agent_id, filenames, plan, engine = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        try:
+            service.load_agent_files(agent_id, filenames)
+            result = service.execute_query(agent_id, plan, engine)
+        except MemoryError:
+            result = {"success": False, "error": "Consulta excedeu o limite de memória"}
+        conn.send(result)
+
+
+class _Worker:
+    __slots__ = ("process", "conn")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+
+class QueryPool:
+    """Executa consultas em processos dedicados com limite de tempo e de memória por consulta
+
+    Uma consulta que estoura o tempo, é cancelada (ex.: cliente desconectou) ou derruba o
+    processo tem o executor encerrado e substituído; as demais não são afetadas. Os processos
+    carregam os arquivos pelas cópias colunares (memory-map), então compartilham as páginas.
+    Com `processes=0` as consultas rodam em threads dedicadas do próprio processo (o tempo
+    limite só libera quem espera; a thread termina a consulta).
+    """
+
+    def __init__(
+        self,
+        data_analysis_service,
+        processes: int = 2,
+        timeout: float = 30.0,
+        memory_limit_mb: int = 1024,
+        max_pending: int = 32
+    ):
+        self.data_analysis = data_analysis_service
+        self.processes = processes
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_pending = max_pending
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: List[_Worker] = []
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._busy = 0
+
+    def _service_options(self) -> Dict[str, Any]:
+        service = self.data_analysis
+        return {
+            "data_dir": str(service.data_dir),
+            "cache_max_bytes": service.datasets.max_bytes,
+            "sql_engine": service.sql_engine,
+            "result_max_rows": service.result_max_rows,
+            "result_max_bytes": service.result_max_bytes,
+        }
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self._service_options(), self.memory_limit_mb),
+            name="data-query",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        self._workers.append(worker)
+        return worker
+
+    async def start(self):
+        if self.processes <= 0:
+            self._threads = ThreadPoolExecutor(max_workers=2, thread_name_prefix="data-query")
+            return
+        self._idle = asyncio.Queue()
+        for _ in range(self.processes):
+            self._idle.put_nowait(self._spawn())
+        logger.info(f"Data query pool started with {self.processes} processes")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.conn.close()
+            worker.process.join(timeout=2)
+            if worker.process.is_alive():
+                worker.process.kill()
+        self._workers.clear()
+        if self._threads:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+
+    def _replace(self, worker: _Worker):
+        """Encerra o executor (consulta em andamento é abortada) e sobe outro no lugar"""
+        worker.process.kill()
+        worker.process.join(timeout=1)
+        worker.conn.close()
+        self._workers.remove(worker)
+        self._idle.put_nowait(self._spawn())
+
+    @staticmethod
+    async def _recv(worker: _Worker) -> Dict[str, Any]:
+        """Aguarda a resposta do executor sem ocupar threads"""
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = worker.conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+        return worker.conn.recv()
+
+    async def execute(
+        self, agent_id: str, filenames: List[str], plan: Dict[str, Any], engine: str = "pandas"
+    ) -> Dict[str, Any]:
+        """Executa a consulta no pool; cancelar a task aborta a consulta"""
+        if self._pending >= self.max_pending:
+            DATA_QUERIES.inc(outcome="rejected")
+            return {"success": False, "error": "Muitas consultas em andamento, tente novamente em instantes"}
+
+        self._pending += 1
+        DATA_QUERY_PENDING.set(self._pending)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            if self._threads is not None:
+                result = await self._execute_in_thread(agent_id, filenames, plan, engine)
+            elif self._idle is not None:
+                result = await self._execute_in_process(agent_id, filenames, plan, engine)
+            else:
+                return {"success": False, "error": "Data query pool not started"}
+            if result.get("timeout"):
+                outcome = "timeout"
+            elif result.get("success"):
+                outcome = "ok"
+            return result
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            self._pending -= 1
+            DATA_QUERY_PENDING.set(self._pending)
+            DATA_QUERIES.inc(outcome=outcome)
+            DATA_QUERY_DURATION.observe(time.perf_counter() - start)
+
+    def _timeout_result(self) -> Dict[str, Any]:
+        return {"success": False, "timeout": True, "error": f"Consulta excedeu o tempo limite de {self.timeout:g}s"}
+
+    async def _execute_in_process(self, agent_id, filenames, plan, engine) -> Dict[str, Any]:
+        worker = await self._idle.get()
+        self._busy += 1
+        DATA_QUERY_BUSY.set(self._busy)
+        try:
+            worker.conn.send((agent_id, filenames, plan, engine))
+            result = await asyncio.wait_for(self._recv(worker), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Data query for agent {agent_id} timed out after {self.timeout}s, restarting executor")
+            self._replace(worker)
+            return self._timeout_result()
+        except asyncio.CancelledError:
+            logger.info(f"Data query for agent {agent_id} cancelled, restarting executor")
+            self._replace(worker)
+            raise
+        except (EOFError, OSError) as e:
+            # Processo morreu durante a consulta (ex.: memória)
+            logger.error(f"Data query executor died running query for agent {agent_id}: {e}")
+            self._replace(worker)
+            return {"success": False, "error": "Consulta abortada pelo executor (limite de memória ou falha)"}
+        finally:
+            self._busy -= 1
+            DATA_QUERY_BUSY.set(self._busy)
+        self._idle.put_nowait(worker)
+        return result
+
+    async def _execute_in_thread(self, agent_id, filenames, plan, engine) -> Dict[str, Any]:
+        def run():
+            self.data_analysis.load_agent_files(agent_id, filenames)
+            return self.data_analysis.execute_query(agent_id, plan, engine)
+
+        future = asyncio.get_running_loop().run_in_executor(self._threads, run)
+        try:
+            return await asyncio.wait_for(future, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Data query for agent {agent_id} timed out after {self.timeout}s")
+            return self._timeout_result()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": "process" if self._idle is not None else "thread",
+            "processes": len(self._workers),
+            "busy": self._busy,
+            "pending": self._pending,
+        }
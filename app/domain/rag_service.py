@@ -1,9 +1,11 @@
-from typing import List, Optional
+from typing import Any, List, Optional
 from app.models import AgentConfig, RAGContext
 from app.infrastructure.redis_client import RedisClient
 from app.infrastructure.qdrant_client import QdrantClient
 from app.infrastructure.openai_client import OpenAIClient
+from app.infrastructure.tracing import tracer
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -11,10 +13,17 @@ logger = logging.getLogger(__name__)
 class RAGService:
     """Serviço de RAG (Retrieval Augmented Generation)"""
     
-    def __init__(self, redis_client: RedisClient, openai_client: OpenAIClient, qdrant_client: Optional[QdrantClient] = None):
+    def __init__(
+        self,
+        redis_client: RedisClient,
+        openai_client: OpenAIClient,
+        qdrant_client: Optional[QdrantClient] = None,
+        metrics_service: Optional[Any] = None
+    ):
         self.redis = redis_client
         self.openai = openai_client
         self.qdrant = qdrant_client
+        self.metrics = metrics_service
     
     async def retrieve_context(
         self,
@@ -31,9 +40,12 @@ class RAGService:
         
         try:
             # Gera embedding da query
+            started = time.perf_counter()
             query_embedding = await self.openai.get_embedding(query)
+            await self._record_latency(agent_config.id, "embedding", started)
 
             contexts: List[RAGContext] = []
+            started = time.perf_counter()
 
             if getattr(agent_config.rag, "type", "qdrant") == "qdrant":
                 if not self.qdrant or not self.qdrant.client:
@@ -68,6 +80,7 @@ class RAGService:
                         metadata=result.get('metadata')
                     ))
             
+            await self._record_latency(agent_config.id, "retrieval", started)
             logger.info(f"Retrieved {len(contexts)} contexts for query")
             return contexts
         
@@ -75,6 +88,13 @@ class RAGService:
             logger.error(f"Error retrieving RAG context: {e}")
             return []
     
+    async def _record_latency(self, agent_id: str, stage: str, started: float):
+        """Registra a latência de um estágio no histograma do agente e no trace ativo"""
+        seconds = time.perf_counter() - started
+        tracer.add_span(f"rag.{stage}", seconds * 1000)
+        if self.metrics:
+            await self.metrics.record_latency(agent_id, stage, seconds)
+    
     def build_rag_prompt(
         self,
         query: str,
@@ -0,0 +1,97 @@
+"""Serialização limitada de resultados de consulta para mensagens de tool"""
+from typing import Any, Dict, Optional, Tuple
+import json
+
+import pandas as pd
+
+DEFAULT_MAX_ROWS = 200
+DEFAULT_MAX_BYTES = 32 * 1024
+# Limites do resumo de resultados truncados
+SUMMARY_MAX_COLUMNS = 20
+SUMMARY_TOP_VALUES = 5
+
+
+def _encode_columns(df: pd.DataFrame) -> Dict[str, str]:
+    """JSON de cada coluna como lista de valores (NaN -> null, datas em ISO)"""
+    return {
+        str(column): df[column].to_json(orient="values", date_format="iso", default_handler=str)
+        for column in df.columns
+    }
+
+
+def _encoded_size(encoded: Dict[str, str]) -> int:
+    return sum(len(name) + len(values) + 6 for name, values in encoded.items())
+
+
+def _fit(df: pd.DataFrame, rows: int, max_bytes: int) -> Tuple[int, Dict[str, str]]:
+    """Reduz as linhas proporcionalmente até o JSON caber em `max_bytes`"""
+    encoded = _encode_columns(df.head(rows))
+    size = _encoded_size(encoded)
+    while size > max_bytes and rows > 0:
+        rows = max(0, min(rows - 1, int(rows * max_bytes / size * 0.9)))
+        encoded = _encode_columns(df.head(rows))
+        size = _encoded_size(encoded)
+    return rows, encoded
+
+
+def summarize(df: pd.DataFrame) -> Dict[str, Any]:
+    """Resumo por coluna: min/max/média para números, distintos e valores mais frequentes para o resto"""
+    summary = {}
+    for column in list(df.columns)[:SUMMARY_MAX_COLUMNS]:
+        series = df[column]
+        info: Dict[str, Any] = {"nulls": int(series.isna().sum())}
+        try:
+            if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+                info.update(min=series.min(), max=series.max(), mean=series.mean())
+            else:
+                counts = series.value_counts(dropna=True)
+                info["distinct"] = int(len(counts))
+                info["top"] = {str(k): int(v) for k, v in counts.head(SUMMARY_TOP_VALUES).items()}
+        except TypeError:
+            # Colunas com valores não hasheáveis/comparáveis (listas, dicts) ficam só com nulos
+            pass
+        summary[str(column)] = info
+    # Passa pelo mesmo encoder dos dados (tipos numpy/Arrow -> JSON)
+    return json.loads(json.dumps(summary, default=lambda v: v.item() if hasattr(v, "item") else str(v)))
+
+
+def shape_result(
+    df: pd.DataFrame,
+    limit: Optional[int] = None,
+    max_rows: int = DEFAULT_MAX_ROWS,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    rows_capped: bool = False
+) -> Dict[str, Any]:
+    """Resultado em colunas ({coluna: [valores]}) limitado a `max_rows` linhas e ~`max_bytes` bytes
+
+    `limit` é o número de linhas pedido na consulta. Quando os limites cortam linhas pedidas,
+    marca `truncated` e inclui um resumo de `df` inteiro. `rows_capped` indica que `df` já é
+    um corte de um resultado maior (total desconhecido): o resultado é sempre `truncated`.
+    """
+    total = len(df)
+    requested = total if limit is None else min(total, limit)
+    rows, encoded = _fit(df, min(requested, max_rows), max_bytes)
+    truncated = rows < requested or rows_capped
+    summary = None
+    if truncated:
+        # O resumo entra no mesmo orçamento de bytes
+        summary = summarize(df)
+        budget = max(0, max_bytes - len(json.dumps(summary, ensure_ascii=False)) - 200)
+        if _encoded_size(encoded) > budget:
+            rows, encoded = _fit(df, rows, budget)
+
+    shaped: Dict[str, Any] = {
+        "rows": total,
+        "returned": rows,
+        "data": {name: json.loads(values) for name, values in encoded.items()},
+        "truncated": truncated,
+    }
+    if rows_capped:
+        shaped["rows_capped"] = True
+    if truncated:
+        shaped["note"] = (
+            f"Resultado truncado: {rows} de {'mais de ' if rows_capped else ''}{total} linhas. "
+            "Use filtros, agregações ou um limite menor para ver o restante."
+        )
+        shaped["summary"] = summary
+    return shaped
@@ -0,0 +1,104 @@
+"""Engine SQL embarcada (DuckDB) para consultas somente leitura nos arquivos de um agente"""
+from typing import Any, Dict, Optional, Tuple
+import logging
+import re
+import threading
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Valores de DataAnalysisConfig.query_engine atendidos por esta engine
+SQL_ENGINES = ("sql", "duckdb")
+
+SQL_TOOL_PARAMETERS: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "sql": {"type": "string", "description": "Uma única consulta SELECT (dialeto DuckDB)"}
+    },
+    "required": ["sql"]
+}
+
+
+class SQLQueryError(ValueError):
+    """Consulta rejeitada (não é um único SELECT) ou falha na execução"""
+
+
+def table_name(filename: str) -> str:
+    """Nome da tabela de um arquivo: 'Vendas 2024.csv' -> 'vendas_2024'"""
+    stem = filename.rsplit(".", 1)[0]
+    name = re.sub(r"\W+", "_", stem).strip("_").lower() or "dados"
+    return f"t_{name}" if name[0].isdigit() else name
+
+
+class SQLQueryEngine:
+    """Executa SQL gerado pelo modelo sobre os DataFrames registrados como tabelas
+
+    Cada consulta usa uma conexão DuckDB em memória sem acesso ao sistema de arquivos
+    e com configuração travada; as tabelas são views sobre os DataFrames (sem cópia).
+    """
+
+    def __init__(
+        self,
+        timeout: float = 10.0,
+        memory_limit_mb: int = 256,
+        threads: int = 2,
+        max_fetch_rows: int = 10000
+    ):
+        self.timeout = timeout
+        self.max_fetch_rows = max_fetch_rows
+        self.memory_limit_mb = memory_limit_mb
+        self.threads = threads
+        self._available: Optional[bool] = None
+
+    @property
+    def available(self) -> bool:
+        if self._available is None:
+            try:
+                import duckdb  # noqa: F401
+                self._available = True
+            except ImportError:
+                logger.warning("duckdb not installed, SQL query engine disabled")
+                self._available = False
+        return self._available
+
+    @staticmethod
+    def referenced_tables(sql: str, tables: Dict[str, Any]) -> Dict[str, Any]:
+        """Subconjunto de `tables` citado na consulta (evita carregar arquivos não usados)"""
+        words = set(re.findall(r"\w+", sql.lower()))
+        return {name: value for name, value in tables.items() if name in words}
+
+    def execute(self, tables: Dict[str, pd.DataFrame], sql: str) -> Tuple[pd.DataFrame, bool]:
+        """Retorna (até `max_fetch_rows` linhas do resultado, se havia mais linhas)"""
+        if not self.available:
+            raise SQLQueryError("Engine SQL indisponível (duckdb não instalado)")
+        import duckdb
+
+        con = duckdb.connect(":memory:", config={
+            "enable_external_access": False,
+            "memory_limit": f"{self.memory_limit_mb}MB",
+            "threads": self.threads,
+        })
+        timer = threading.Timer(self.timeout, con.interrupt)
+        try:
+            for name, df in tables.items():
+                con.register(name, df)
+            con.execute("SET lock_configuration = true")
+
+            statements = con.extract_statements(sql)
+            if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+                raise SQLQueryError("Apenas uma única consulta SELECT é permitida")
+
+            timer.start()
+            relation = con.sql(sql)
+            # Uma linha a mais indica que o resultado tinha mais linhas que o buscado
+            result = relation.limit(self.max_fetch_rows + 1).df()
+        except duckdb.InterruptException:
+            raise SQLQueryError(f"Consulta excedeu o tempo limite de {self.timeout:g}s")
+        except duckdb.Error as e:
+            raise SQLQueryError(str(e))
+        finally:
+            timer.cancel()
+            con.close()
+
+        return result.head(self.max_fetch_rows), len(result) > self.max_fetch_rows
@@ -0,0 +1,143 @@
+"""Cópias colunares (Arrow IPC) dos arquivos de dados, lidas via memory-map"""
+from pathlib import Path
+from typing import Iterable, Optional
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_DIR = ".columnar"
+COLUMNAR_SUFFIX = ".arrow"
+
+
+class ColumnarStore:
+    """Converte um arquivo (CSV/JSON/XLSX) uma vez para Arrow IPC e o carrega sem re-parse
+
+    O arquivo Arrow é gravado sem compressão, então a leitura é um memory-map: as colunas do
+    DataFrame (dtypes Arrow) apontam para as páginas do arquivo, compartilhadas pelo page cache
+    entre processos.
+    """
+
+    def __init__(self):
+        self._available: Optional[bool] = None
+
+    @property
+    def available(self) -> bool:
+        if self._available is None:
+            try:
+                import pyarrow  # noqa: F401
+                self._available = True
+            except ImportError:
+                logger.warning("pyarrow not installed, data files will be parsed on every load")
+                self._available = False
+        return self._available
+
+    def path_for(self, source: Path) -> Path:
+        return source.parent / COLUMNAR_DIR / (source.name + COLUMNAR_SUFFIX)
+
+    def is_fresh(self, source: Path) -> bool:
+        """Existe cópia colunar gravada depois da última alteração do arquivo original"""
+        target = self.path_for(source)
+        try:
+            return target.stat().st_mtime_ns >= source.stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+    def write(self, source: Path, df: pd.DataFrame) -> bool:
+        """Grava a cópia colunar de forma atômica (arquivo temporário + rename)"""
+        if not self.available:
+            return False
+        try:
+            table = self._to_table(df)
+        except Exception as e:
+            logger.warning(f"Could not convert {source.name} to Arrow: {e}")
+            return False
+        return self._write_tables(source, [table])
+
+    def write_chunks(self, source: Path, chunks: Iterable) -> bool:
+        """Grava a cópia colunar bloco a bloco (memória limitada ao tamanho do bloco)
+
+        Blocos são DataFrames ou RecordBatches. O schema vem do primeiro bloco;
+        um bloco incompatível aborta a gravação (False).
+        """
+        if not self.available:
+            return False
+        import pyarrow as pa
+
+        def tables():
+            schema = None
+            for chunk in chunks:
+                if isinstance(chunk, pd.DataFrame):
+                    table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                else:
+                    table = pa.Table.from_batches([chunk])
+                    if schema is not None and not table.schema.equals(schema):
+                        table = table.cast(schema)
+                schema = schema or table.schema
+                yield table
+
+        return self._write_tables(source, tables())
+
+    def _write_tables(self, source: Path, tables: Iterable) -> bool:
+        import pyarrow as pa
+
+        target = self.path_for(source)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(target.name + f".{os.getpid()}.tmp")
+        writer = None
+        try:
+            with pa.OSFile(str(tmp), "wb") as sink:
+                for table in tables:
+                    if writer is None:
+                        writer = pa.ipc.new_file(sink, table.schema)
+                    writer.write_table(table)
+                if writer is None:
+                    return False
+                writer.close()
+            os.replace(tmp, target)
+            return True
+        except Exception as e:
+            logger.warning(f"Error writing columnar copy of {source.name}: {e}")
+            return False
+        finally:
+            try:
+                tmp.unlink()
+            except FileNotFoundError:
+                pass
+
+    def read(self, source: Path) -> Optional[pd.DataFrame]:
+        """Carrega a cópia colunar via memory-map (None se ausente/desatualizada)"""
+        if not self.available or not self.is_fresh(source):
+            return None
+        import pyarrow as pa
+
+        try:
+            with pa.memory_map(str(self.path_for(source)), "r") as source_map:
+                table = pa.ipc.open_file(source_map).read_all()
+            # ArrowDtype mantém os buffers do memory-map (sem cópia para numpy)
+            return table.to_pandas(types_mapper=pd.ArrowDtype)
+        except Exception as e:
+            logger.error(f"Error reading columnar copy of {source.name}: {e}")
+            return None
+
+    def delete(self, source: Path):
+        try:
+            self.path_for(source).unlink()
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _to_table(df: pd.DataFrame):
+        import pyarrow as pa
+
+        try:
+            return pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Colunas object com tipos mistos: grava como texto
+            mixed = df.copy()
+            for column in mixed.columns:
+                if mixed[column].dtype == object:
+                    mixed[column] = mixed[column].map(lambda v: None if v is None or v != v else str(v))
+            return pa.Table.from_pandas(mixed, preserve_index=False)
@@ -1,20 +1,45 @@
 from openai import AsyncOpenAI
 from typing import AsyncIterator, List, Dict, Any, Optional
 from app.config import settings
+from app.infrastructure.tracing import tracer
+from app.infrastructure.metrics_registry import registry
+import asyncio
+import hashlib
+import json
 import logging
 import math
+import time
 
 logger = logging.getLogger(__name__)
 
+LLM_REQUESTS = registry.counter("llm_requests_total", "Chamadas de chat ao LLM", labels=("model", "mode", "outcome"))
+LLM_IN_FLIGHT = registry.gauge("llm_requests_in_flight", "Chamadas ao LLM em andamento")
+LLM_DURATION = registry.histogram("llm_request_duration_seconds", "Duração das chamadas ao LLM", labels=("model", "mode"))
+LLM_DEDUPE_LOOKUPS = registry.counter(
+    "llm_dedupe_lookups_total", "Consultas ao cache single-flight de chat completions", labels=("result",)
+)
+EMBEDDING_BATCH_SIZE = registry.histogram(
+    "embedding_batch_size", "Textos por chamada de embedding", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+EMBEDDING_DURATION = registry.histogram("embedding_request_duration_seconds", "Duração das chamadas de embedding")
+
+
+class _LeaderCancelled(Exception):
+    """Sinaliza a quem aguarda uma chamada deduplicada que a chamada original foi cancelada"""
+
 
 class OpenAIClient:
     """Cliente OpenAI assíncrono para embeddings e chat completions (compatível com APIs OpenAI)"""
     
-    def __init__(self):
+    def __init__(self, dedupe_inflight: bool = False):
         self.client = AsyncOpenAI(
             api_key=settings.openai_api_key,
             base_url=settings.openai_base_url
         )
+        # Single-flight: chamadas idênticas em andamento compartilham a mesma requisição
+        self.dedupe_inflight = dedupe_inflight
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.dedupe_hits = 0
 
     def estimate_tokens(self, text: str) -> int:
         if not text:
@@ -27,11 +52,14 @@ class OpenAIClient:
     
     async def get_embedding(self, text: str, model: str = "BAAI/bge-m3") -> List[float]:
         """Gera embedding para um texto"""
+        EMBEDDING_BATCH_SIZE.observe(1)
+        started = time.perf_counter()
         try:
             response = await self.client.embeddings.create(
                 model=model,
                 input=text
             )
+            EMBEDDING_DURATION.observe(time.perf_counter() - started)
             return response.data[0].embedding
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
@@ -45,6 +73,9 @@ class OpenAIClient:
         tools: Optional[List[Dict[str, Any]]] = None
     ) -> AsyncIterator[Dict[str, Any]]:
         """Stream de tokens da OpenAI com suporte a tool calls"""
+        started = time.perf_counter()
+        outcome = "error"
+        LLM_IN_FLIGHT.inc()
         try:
             stream = await self.client.chat.completions.create(
                 model=model,
@@ -92,11 +123,39 @@ class OpenAIClient:
                 # Se chunk.choices[0].finish_reason indica tool calls, retorna todos
                 if chunk.choices[0].finish_reason == "tool_calls":
                     yield {"type": "tool_calls", "data": tool_calls_accumulated}
-                    
+            
+            outcome = "success"
         except Exception as e:
             logger.error(f"Error in chat completion stream: {e}")
             raise
+        finally:
+            LLM_IN_FLIGHT.dec()
+            LLM_REQUESTS.inc(model=model, mode="stream", outcome=outcome)
+            LLM_DURATION.observe(time.perf_counter() - started, model=model, mode="stream")
     
+    def _completion_key(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float,
+        tools: Optional[List[Dict[str, Any]]],
+        tool_choice: Optional[str]
+    ) -> str:
+        """Chave determinística da requisição (mensagens completas + modelo + parâmetros)"""
+        raw = json.dumps(
+            {
+                "messages": messages,
+                "model": model,
+                "temperature": temperature,
+                "tools": tools,
+                "tool_choice": tool_choice,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
     async def chat_completion(
         self,
         messages: List[Dict[str, str]],
@@ -105,7 +164,67 @@ class OpenAIClient:
         tools: Optional[List[Dict[str, Any]]] = None,
         tool_choice: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Completação de chat sem streaming"""
+        """Completação de chat sem streaming (com deduplicação de requisições em andamento)"""
+        with tracer.span("llm.chat_completion", model=model):
+            return await self._dedupe_chat_completion(messages, model, temperature, tools, tool_choice)
+
+    async def _dedupe_chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        tools: Optional[List[Dict[str, Any]]],
+        tool_choice: Optional[str]
+    ) -> Dict[str, Any]:
+        """Single-flight: anexa a uma chamada idêntica em andamento, se houver"""
+        if not self.dedupe_inflight:
+            return await self._chat_completion(messages, model, temperature, tools, tool_choice)
+
+        key = self._completion_key(messages, model, temperature, tools, tool_choice)
+        inflight = self._inflight.get(key)
+        LLM_DEDUPE_LOOKUPS.inc(result="hit" if inflight is not None else "miss")
+        if inflight is not None:
+            # Requisição idêntica já em andamento: aguarda o mesmo resultado
+            self.dedupe_hits += 1
+            logger.debug(f"Attaching to in-flight chat completion {key[:12]}")
+            try:
+                result = await asyncio.shield(inflight)
+            except _LeaderCancelled:
+                # Quem fazia a chamada foi cancelado: refaz (ou anexa a uma nova chamada)
+                return await self._dedupe_chat_completion(messages, model, temperature, tools, tool_choice)
+            return dict(result)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._chat_completion(messages, model, temperature, tools, tool_choice)
+            future.set_result(result)
+            return dict(result)
+        except asyncio.CancelledError:
+            # Não cancela o future compartilhado: quem aguarda não foi cancelado
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marca a exceção como consumida caso não haja outros aguardando
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        tools: Optional[List[Dict[str, Any]]],
+        tool_choice: Optional[str]
+    ) -> Dict[str, Any]:
+        """Executa a chamada de chat completion na API"""
+        started = time.perf_counter()
+        outcome = "error"
+        LLM_IN_FLIGHT.inc()
         try:
             response = await self.client.chat.completions.create(
                 model=model,
@@ -121,6 +240,7 @@ class OpenAIClient:
             if not tokens_used:
                 tokens_used = self.estimate_chat_tokens(messages, message.content or "")
             
+            outcome = "success"
             return {
                 'content': message.content,
                 'tool_calls': tool_calls,
@@ -129,3 +249,7 @@ class OpenAIClient:
         except Exception as e:
             logger.error(f"Error in chat completion: {e}")
             raise
+        finally:
+            LLM_IN_FLIGHT.dec()
+            LLM_REQUESTS.inc(model=model, mode="chat", outcome=outcome)
+            LLM_DURATION.observe(time.perf_counter() - started, model=model, mode="chat")
@@ -1,13 +1,19 @@
 import redis.asyncio as redis
+import asyncio
 import json
 import uuid
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator
 from datetime import datetime
 from app.config import settings
+from app.infrastructure.metrics_registry import registry
 import logging
 
 logger = logging.getLogger(__name__)
 
+JOB_FINAL_STATUSES = {"completed", "failed"}
+
+JOBS_ENQUEUED = registry.counter("jobs_enqueued_total", "Jobs adicionados à fila")
+
 
 class RedisClient:
     """Cliente Redis para cache, fila e pub/sub"""
@@ -94,7 +100,16 @@ class RedisClient:
         job_data['created_at'] = datetime.now().isoformat()
         
         try:
-            await self.client.xadd(
+            # Registra o estado inicial e enfileira em um único round trip; o estado é gravado
+            # antes do XADD para nenhum worker atualizar um job ainda sem estado
+            pipe = self.client.pipeline(transaction=False)
+            self._queue_job_state(pipe, job_id, {
+                "agent_id": job_data.get("agent_id"),
+                "status": "queued",
+                "created_at": job_data['created_at'],
+                "group_id": job_data.get("group_id")
+            }, settings.job_result_ttl_seconds)
+            pipe.xadd(
                 settings.redis_stream_name,
                 {
                     'job_id': job_id,
@@ -102,6 +117,8 @@ class RedisClient:
                 },
                 id='*'
             )
+            await pipe.execute()
+            JOBS_ENQUEUED.inc()
             logger.info(f"Enqueued job {job_id}")
             return job_id
         except Exception as e:
@@ -147,6 +164,19 @@ class RedisClient:
             logger.error(f"Error reading job: {e}")
             return None
     
+    async def get_queue_depth(self, consumer_group: str = "workers") -> Dict[str, int]:
+        """Jobs pendentes (entregues e não confirmados) e ainda não lidos (lag) do consumer group"""
+        if not self.client:
+            return {"pending": 0, "lag": 0}
+        try:
+            groups = await self.client.xinfo_groups(settings.redis_stream_name)
+        except redis.ResponseError:
+            return {"pending": 0, "lag": 0}
+        for group in groups:
+            if group.get("name") == consumer_group:
+                return {"pending": int(group.get("pending") or 0), "lag": int(group.get("lag") or 0)}
+        return {"pending": 0, "lag": 0}
+    
     async def ack_job(self, msg_id: str, consumer_group: str = "workers"):
         """Confirma processamento de um job"""
         if not self.client:
@@ -162,10 +192,179 @@ class RedisClient:
         if not self.client:
             return
         try:
-            await self.client.publish(channel, json.dumps(message))
+            await self.client.publish(channel, json.dumps(message, default=str))
         except Exception as e:
             logger.error(f"Error publishing to {channel}: {e}")
     
+    async def listen(self, channel: str, subscribed: Optional[asyncio.Event] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Emite as mensagens JSON publicadas no canal até ser cancelado (erros de conexão propagam)"""
+        if not self.client:
+            return
+        pubsub = self.client.pubsub()
+        try:
+            await pubsub.subscribe(channel)
+            if subscribed is not None:
+                subscribed.set()
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if not message or message.get("type") != "message":
+                    continue
+                try:
+                    data = json.loads(message["data"])
+                except Exception:
+                    continue
+                yield data
+        finally:
+            try:
+                await pubsub.unsubscribe(channel)
+                await pubsub.aclose()
+            except Exception:
+                pass
+    
+    # Job result store
+    def _job_key(self, job_id: str) -> str:
+        return f"job:{job_id}"
+    
+    def _job_channel(self, job_id: str) -> str:
+        return f"job_result:{job_id}"
+    
+    def _queue_job_state(self, pipe, job_id: str, state: Dict[str, Any], ttl: int):
+        """Enfileira no pipeline a mescla de `state` no hash do job (um campo JSON por chave)"""
+        update = {"job_id": job_id, **state}
+        key = self._job_key(job_id)
+        pipe.hset(key, mapping={
+            field: json.dumps(value, ensure_ascii=False, default=str) for field, value in update.items()
+        })
+        pipe.expire(key, ttl)
+        return update
+    
+    async def set_job_state(self, job_id: str, state: Dict[str, Any], ttl: Optional[int] = None):
+        """Mescla `state` no estado do job (com TTL) e publica a atualização no canal do job
+
+        A mescla é feita pelo Redis (HSET no hash do job), então escritas concorrentes não
+        apagam campos umas das outras (created_at, group_id gravados no enfileiramento).
+        """
+        if not self.client:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            update = self._queue_job_state(pipe, job_id, state, ttl or settings.job_result_ttl_seconds)
+            pipe.publish(self._job_channel(job_id), json.dumps(update, ensure_ascii=False, default=str))
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error storing state for job {job_id}: {e}")
+    
+    async def get_job_state(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Recupera o estado atual de um job"""
+        if not self.client:
+            return None
+        try:
+            fields = await self.client.hgetall(self._job_key(job_id))
+            return {field: json.loads(value) for field, value in fields.items()} or None
+        except Exception as e:
+            logger.error(f"Error reading state of job {job_id}: {e}")
+            return None
+    
+    async def iter_job_states(self, job_id: str, timeout: float) -> AsyncIterator[Dict[str, Any]]:
+        """Emite o estado atual do job e cada atualização até um estado final ou timeout"""
+        if not self.client:
+            return
+        
+        channel = self._job_channel(job_id)
+        pubsub = self.client.pubsub()
+        try:
+            await pubsub.subscribe(channel)
+            # Lê o estado só depois de inscrito: resultados publicados antes não se perdem
+            state = await self.get_job_state(job_id)
+            if state is None:
+                return
+            yield state
+            if state.get("status") in JOB_FINAL_STATUSES:
+                return
+            
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if not message or message.get("type") != "message":
+                    continue
+                try:
+                    # Cada mensagem traz só os campos atualizados
+                    state = {**state, **json.loads(message["data"])}
+                except Exception:
+                    continue
+                yield state
+                if state.get("status") in JOB_FINAL_STATUSES:
+                    return
+        finally:
+            try:
+                await pubsub.unsubscribe(channel)
+                await pubsub.aclose()
+            except Exception:
+                pass
+    
+    # Job token streams (worker -> API via Redis Streams)
+    def _job_stream_key(self, job_id: str) -> str:
+        return f"job_stream:{job_id}"
+    
+    async def append_job_stream(self, job_id: str, event: Dict[str, Any], first: bool = False) -> Optional[str]:
+        """Adiciona um evento (delta, done, error) ao stream do job"""
+        if not self.client:
+            return None
+        key = self._job_stream_key(job_id)
+        fields = {"event": json.dumps(event, ensure_ascii=False, default=str)}
+        try:
+            if first:
+                pipe = self.client.pipeline(transaction=False)
+                pipe.xadd(key, fields, id='*')
+                pipe.expire(key, settings.job_result_ttl_seconds)
+                results = await pipe.execute()
+                return results[0]
+            return await self.client.xadd(key, fields, id='*')
+        except Exception as e:
+            logger.error(f"Error appending to stream of job {job_id}: {e}")
+            return None
+    
+    async def iter_job_stream(
+        self,
+        job_id: str,
+        last_id: str = "0",
+        idle_timeout: float = 60.0
+    ) -> AsyncIterator[tuple]:
+        """Lê eventos do stream do job a partir de last_id até 'done'/'error' ou inatividade"""
+        if not self.client:
+            return
+        key = self._job_stream_key(job_id)
+        loop = asyncio.get_running_loop()
+        last_event_at = loop.time()
+        while True:
+            block_ms = int(max(0.1, min(5.0, idle_timeout - (loop.time() - last_event_at))) * 1000)
+            response = await self.client.xread({key: last_id}, count=100, block=block_ms)
+            if not response:
+                if loop.time() - last_event_at >= idle_timeout:
+                    return
+                continue
+            last_event_at = loop.time()
+            for event_id, fields in response[0][1]:
+                last_id = event_id
+                try:
+                    event = json.loads(fields.get("event", "{}"))
+                except Exception:
+                    continue
+                yield event_id, event
+                if event.get("type") in ("done", "error"):
+                    return
+    
+    async def wait_job_state(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Long-poll: aguarda o job terminar (ou o timeout) e retorna o último estado"""
+        state = None
+        async for state in self.iter_job_states(job_id, timeout):
+            pass
+        return state
+    
     # Vector search (improved implementation using document service)
     async def vector_search(self, index_name: str, query_vector: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
         """Busca vetorial no Redis usando similaridade de cosseno"""
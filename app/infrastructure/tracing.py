@@ -0,0 +1,198 @@
+"""Tracing leve em processo (spans cronometrados, sem coletor externo)"""
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+import json
+import logging
+import os
+import random
+import time
+import uuid
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """Trace de uma requisição/job com seus spans"""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, sampled: Optional[bool] = None, **attrs):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.sampled = sampled
+        self.attrs: Dict[str, Any] = dict(attrs)
+        self.started_at = datetime.now().isoformat()
+        self.spans: List[Dict[str, Any]] = []
+        self.duration_ms: Optional[float] = None
+        self._t0 = time.perf_counter()
+
+    def offset_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms or 0.0, 3),
+            "attrs": self.attrs,
+            "spans": self.spans,
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Coleta spans do trace ativo e exporta os amostrados/lentos para um ring buffer e arquivo"""
+
+    def __init__(
+        self,
+        sample_rate: float = 0.01,
+        slow_ms: float = 2000.0,
+        buffer_size: int = 200,
+        export_path: Optional[str] = None
+    ):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.export_path = export_path
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+
+    def start_trace(
+        self,
+        name: str,
+        trace_id: Optional[str] = None,
+        sampled: Optional[bool] = None,
+        **attrs
+    ) -> Tuple[Trace, Token]:
+        """Abre um trace e o torna ativo no contexto atual"""
+        if sampled is None:
+            sampled = random.random() < self.sample_rate
+        trace = Trace(name, trace_id=trace_id, sampled=sampled, **attrs)
+        return trace, _current_trace.set(trace)
+
+    def end_trace(self, trace: Trace, token: Optional[Token] = None):
+        """Fecha o trace; mantém se amostrado ou mais lento que o limite"""
+        trace.duration_ms = trace.offset_ms()
+        if token is not None:
+            try:
+                _current_trace.reset(token)
+            except ValueError:
+                # Token criado em outro contexto (ex.: generator de streaming)
+                _current_trace.set(None)
+        if trace.sampled or trace.duration_ms >= self.slow_ms:
+            self._export(trace.to_dict())
+
+    @contextmanager
+    def trace(self, name: str, trace_id: Optional[str] = None, sampled: Optional[bool] = None, **attrs) -> Iterator[Trace]:
+        trace, token = self.start_trace(name, trace_id=trace_id, sampled=sampled, **attrs)
+        try:
+            yield trace
+        except Exception as e:
+            trace.attrs["error"] = str(e)
+            raise
+        finally:
+            self.end_trace(trace, token)
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[None]:
+        """Cronometra um estágio do trace ativo (no-op sem trace)"""
+        trace = _current_trace.get()
+        if trace is None:
+            yield
+            return
+        parent = _current_span.get()
+        token = _current_span.set(name)
+        start_ms = trace.offset_ms()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span = {
+                "name": name,
+                "parent": parent,
+                "start_ms": round(start_ms, 3),
+                "duration_ms": round(trace.offset_ms() - start_ms, 3),
+            }
+            if attrs:
+                span["attrs"] = attrs
+            if error:
+                span["error"] = error
+            trace.spans.append(span)
+
+    def add_span(self, name: str, duration_ms: float, **attrs):
+        """Registra um span medido externamente que termina agora (ex.: espera na fila)"""
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        span = {
+            "name": name,
+            "parent": _current_span.get(),
+            "start_ms": round(trace.offset_ms() - duration_ms, 3),
+            "duration_ms": round(duration_ms, 3),
+        }
+        if attrs:
+            span["attrs"] = attrs
+        trace.spans.append(span)
+
+    def current_trace(self) -> Optional[Trace]:
+        return _current_trace.get()
+
+    def recent(self, limit: int = 20, min_ms: float = 0.0) -> List[Dict[str, Any]]:
+        """Traces exportados mais recentes (deste processo e do arquivo, se configurado)"""
+        traces = list(self._buffer)
+        if self.export_path:
+            seen = {t["trace_id"] + t["name"] for t in traces}
+            for trace in self._read_exported(limit * 5):
+                if trace.get("trace_id", "") + trace.get("name", "") not in seen:
+                    traces.append(trace)
+        traces = [t for t in traces if t.get("duration_ms", 0) >= min_ms]
+        traces.sort(key=lambda t: t.get("started_at", ""), reverse=True)
+        return traces[:limit]
+
+    def _export(self, data: Dict[str, Any]):
+        self._buffer.append(data)
+        if not self.export_path:
+            return
+        try:
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(data, ensure_ascii=False, default=str) + "\n")
+        except Exception as e:
+            logger.error(f"Error exporting trace {data.get('trace_id')}: {e}")
+
+    def _read_exported(self, limit: int) -> List[Dict[str, Any]]:
+        """Lê as últimas linhas do arquivo de traces (compartilhado entre API e worker)"""
+        if not self.export_path or not os.path.exists(self.export_path):
+            return []
+        try:
+            with open(self.export_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - 256 * 1024))
+                lines = f.read().decode("utf-8", errors="ignore").splitlines()
+        except Exception as e:
+            logger.error(f"Error reading exported traces: {e}")
+            return []
+        traces = []
+        for line in lines[-limit:]:
+            try:
+                traces.append(json.loads(line))
+            except Exception:
+                continue
+        return traces
+
+
+tracer = Tracer(
+    sample_rate=settings.trace_sample_rate,
+    slow_ms=settings.trace_slow_ms,
+    buffer_size=settings.trace_buffer_size,
+    export_path=settings.trace_export_path,
+)
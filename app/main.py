@@ -1,12 +1,13 @@
-from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
-from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, Body
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 import logging
 import os
 # Rate limiting será implementado se necessário
-from app.middleware.rate_limiter import RateLimiterMiddleware
+from app.middleware.rate_limiter import RateLimiterMiddleware, parse_route_limits
 import bleach
 
 from app.config import settings
@@ -20,11 +21,18 @@ from app.domain.agent_service import AgentService
 from app.domain.metrics_service import MetricsService
 from app.domain.rag_document_service import RAGDocumentService
 from app.domain.data_analysis_service import DataAnalysisService
+from app.domain.query_pool import QueryPool
+from app.domain.sql_engine import SQLQueryEngine
 from app.middleware.auth_middleware import AuthMiddleware
 from app.infrastructure import prisma_db
 from app.infrastructure.migration_runner import apply_migrations
+from app.infrastructure.tracing import tracer
+from app.infrastructure.metrics_registry import registry as metrics_registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.middleware.metrics_middleware import MetricsMiddleware
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
+import asyncio
+import shutil
 import time
 import json
 import html
@@ -36,11 +44,14 @@ import uuid
 from pathlib import Path
 
 from app.domain.document_ingestion import extract_text, chunk_text
-from app.security.passwords import verify_password, hash_password
+from app.security.passwords import verify_password_async, hash_password_async, PasswordHasherBusy
+from app.security.login_throttle import LoginThrottle
 from app.security.jwt_service import create_access_token, decode_access_token
 from datetime import datetime, timezone
 from app.security.permissions import get_auth, require_admin_geral, require_admin_grupo
-from app.security.crypto import encrypt_str
+from app.security.crypto import encrypt_str, rotate_str
+from cryptography.fernet import InvalidToken
+from app.security.token_cache import TokenCache
 
 # Configurar logging
 logging.basicConfig(
@@ -52,19 +63,31 @@ logger = logging.getLogger(__name__)
 # Instâncias globais
 agent_loader: AgentLoader = None
 redis_client = RedisClient()
+token_cache = TokenCache(
+    redis_client,
+    max_size=settings.auth_token_cache_size,
+    resync_interval=settings.auth_revocation_resync_seconds
+)
+login_throttle = LoginThrottle(
+    redis_client,
+    max_per_account=settings.login_max_failures_per_account,
+    max_per_ip=settings.login_max_failures_per_ip,
+    window_seconds=settings.login_failure_window_seconds
+)
 qdrant_client: QdrantClient = None
 openai_client: OpenAIClient = None
 agent_service: AgentService = None
 metrics_service: MetricsService = None
 rag_document_service: RAGDocumentService = None
 data_analysis_service: DataAnalysisService = None
+data_query_pool: QueryPool = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Gerencia ciclo de vida da aplicação"""
     global agent_loader, redis_client, qdrant_client, openai_client, agent_service
-    global metrics_service, rag_document_service, data_analysis_service
+    global metrics_service, rag_document_service, data_analysis_service, data_query_pool
     
     # Startup
     logger.info("Starting application...")
@@ -76,10 +99,14 @@ async def lifespan(app: FastAPI):
             await apply_migrations(prisma_db.db)
     
     # Inicializa componentes
-    agent_loader = AgentLoader()
+    agent_loader = AgentLoader(redis_client=redis_client)
     await agent_loader.load_all_agents()
     # redis_client already instantiated globally
     await redis_client.connect()
+    # Aplica mudanças de agentes feitas por outras instâncias (API/workers)
+    await agent_loader.start()
+    if settings.jwt_secret and settings.database_url:
+        await token_cache.start()
     
     # Bootstrap Admin - REMOVED (Replaced by Interactive Setup)
     # Logic now resides in POST /api/setup
@@ -90,18 +117,38 @@ async def lifespan(app: FastAPI):
     
     openai_client = OpenAIClient()
     
-    rag_service = RAGService(redis_client, openai_client, qdrant_client=qdrant_client)
-    data_analysis_service = DataAnalysisService()
-    agent_service = AgentService(redis_client, openai_client, rag_service, data_analysis_service)
-    metrics_service = MetricsService(redis_client)
+    metrics_service = MetricsService(
+        redis_client,
+        buffered=settings.metrics_buffered,
+        flush_interval=settings.metrics_flush_interval_seconds
+    )
+    await metrics_service.start()
+    rag_service = RAGService(
+        redis_client, openai_client, qdrant_client=qdrant_client, metrics_service=metrics_service
+    )
+    data_analysis_service = DataAnalysisService(
+        cache_max_bytes=settings.data_cache_max_mb * 1024 * 1024,
+        sql_engine=SQLQueryEngine(
+            timeout=settings.data_sql_timeout_seconds, memory_limit_mb=settings.data_sql_memory_limit_mb
+        ),
+        result_max_rows=settings.data_result_max_rows,
+        result_max_bytes=settings.data_result_max_bytes,
+        description_max_chars=settings.data_description_max_chars
+    )
+    data_query_pool = QueryPool(
+        data_analysis_service,
+        processes=settings.data_query_processes,
+        timeout=settings.data_query_timeout_seconds,
+        memory_limit_mb=settings.data_query_memory_limit_mb,
+        max_pending=settings.data_query_max_pending
+    )
+    await data_query_pool.start()
+    agent_service = AgentService(
+        redis_client, openai_client, rag_service, data_analysis_service,
+        metrics_service=metrics_service, query_pool=data_query_pool
+    )
     rag_document_service = RAGDocumentService(redis_client, openai_client, qdrant_client=qdrant_client)
-    
-    # Carrega arquivos de análise de dados para agentes existentes
-    agents = agent_loader.list_agents()
-    for agent_id, agent_config in agents.items():
-        if agent_config.data_analysis and agent_config.data_analysis.enabled:
-            if agent_config.data_analysis.files:
-                data_analysis_service.load_agent_files(agent_id, agent_config.data_analysis.files)
+    # Arquivos de análise de dados são carregados sob demanda (primeira mensagem/query do agente)
     
     logger.info("Application started successfully")
     
@@ -109,6 +156,13 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down application...")
+    if metrics_service:
+        await metrics_service.stop()
+    if data_query_pool:
+        await data_query_pool.stop()
+    await token_cache.stop()
+    if agent_loader:
+        await agent_loader.stop()
     try:
         if qdrant_client:
             await qdrant_client.disconnect()
@@ -143,17 +197,45 @@ app.add_middleware(
     AuthMiddleware,
     access_token=settings.acess_token,
     jwt_secret=settings.jwt_secret,
-    jwt_issuer=settings.jwt_issuer
+    jwt_issuer=settings.jwt_issuer,
+    token_cache=token_cache,
+    metrics_token=settings.metrics_scrape_token
 )
 
+def _agent_rate_limit(path: str) -> Optional[Tuple[str, int]]:
+    """Resolve (agent_id, limite/minuto) do agente alvo de um webhook"""
+    if not agent_loader:
+        return None
+    parts = path.strip("/").split("/")
+    if len(parts) != 2:
+        return None
+    if parts[0] == "webhooks":
+        agent = agent_loader.get_agent(parts[1])
+    elif parts[0] == "webhook":
+        agent = agent_loader.get_agent_by_webhook_name(parts[1])
+    else:
+        return None
+    if agent and agent.rate_limit_per_minute:
+        return agent.id, agent.rate_limit_per_minute
+    return None
+
+
 # Rate Limiting
 app.add_middleware(
     RateLimiterMiddleware,
     redis_client=redis_client, 
     # Use lazy init or just new instance. RedisClient handles its own pool.
-    requests_per_minute=60
+    requests_per_minute=settings.rate_limit_per_minute,
+    route_limits=parse_route_limits(settings.rate_limit_routes),
+    token_requests_per_minute=settings.rate_limit_token_per_minute,
+    agent_limit_resolver=_agent_rate_limit,
+    lease_size=settings.rate_limit_lease_size,
+    lease_ttl=settings.rate_limit_lease_ttl_seconds
 )
 
+# Métricas HTTP (mais externo: mede também auth e rate limit)
+app.add_middleware(MetricsMiddleware)
+
 # Servir arquivos estáticos
 static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
 if os.path.exists(static_dir):
@@ -200,6 +282,13 @@ async def login_page():
     return {"message": "Login page not available"}
 
 
+async def _hash_password(password: str) -> str:
+    try:
+        return await hash_password_async(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Serviço ocupado, tente novamente", headers={"Retry-After": "1"})
+
+
 class SetupRequest(BaseModel):
     admin_name: str = Field(min_length=1)
     admin_email: str = Field(min_length=5, max_length=320)
@@ -214,6 +303,7 @@ async def setup_initial_admin(request: SetupRequest):
     if user_count > 0:
         raise HTTPException(status_code=403, detail="Setup already completed. Users exist.")
 
+    senha_hash = await _hash_password(request.admin_password)
     try:
         # Create Default Group
         grupo = await prisma_db.db.grupo.create(
@@ -227,7 +317,7 @@ async def setup_initial_admin(request: SetupRequest):
         admin_user = await prisma_db.db.usuario.create(
             data={
                 "email": request.admin_email,
-                "senhaHash": hash_password(request.admin_password),
+                "senhaHash": senha_hash,
                 "nivel": "ADMIN_GERAL",
                 "grupoId": grupo.id
             }
@@ -246,14 +336,30 @@ class LoginRequest(BaseModel):
 
 
 @app.post("/api/auth/login")
-async def login(request: LoginRequest):
+async def login(request: LoginRequest, http_request: Request):
     """Endpoint de login"""
+    client_ip = http_request.client.host if http_request.client else "unknown"
+    # Conta/IP com falhas demais são recusados antes de qualquer hash
+    retry_after = await login_throttle.retry_after(request.email, client_ip)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Muitas tentativas de login. Tente novamente em {retry_after} segundos.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
     if request.email and request.senha:
         if not settings.jwt_secret:
             raise HTTPException(status_code=500, detail="JWT_SECRET not configured")
         user = await prisma_db.db.usuario.find_unique(where={"email": request.email})
-        if not user or not verify_password(request.senha, user.senhaHash):
+        try:
+            valid = bool(user) and await verify_password_async(request.senha, user.senhaHash)
+        except PasswordHasherBusy:
+            raise HTTPException(status_code=503, detail="Serviço ocupado, tente novamente", headers={"Retry-After": "1"})
+        if not valid:
+            await login_throttle.record_failure(request.email, client_ip)
             raise HTTPException(status_code=401, detail="Credenciais inválidas")
+        await login_throttle.reset(request.email)
 
         token_data = create_access_token(
             secret=settings.jwt_secret,
@@ -292,6 +398,7 @@ async def login(request: LoginRequest):
         if not settings.acess_token:
             return JSONResponse({"success": True, "message": "Login realizado com sucesso"})
         if request.token != settings.acess_token:
+            await login_throttle.record_failure(None, client_ip)
             raise HTTPException(status_code=401, detail="Token inválido")
         response = JSONResponse({"success": True, "message": "Login realizado com sucesso"})
         response.set_cookie(
@@ -322,13 +429,7 @@ async def verify_token(request: Request):
     if settings.jwt_secret:
         try:
             payload = decode_access_token(token=token, secret=settings.jwt_secret, issuer=settings.jwt_issuer)
-            token_row = await prisma_db.db.accesstoken.find_unique(where={"jti": payload.get("jti")})
-            if not token_row or token_row.revokedAt is not None:
-                return {"valid": False}
-            expires_at = token_row.expiresAt
-            if expires_at.tzinfo is None:
-                expires_at = expires_at.replace(tzinfo=timezone.utc)
-            if expires_at <= datetime.now(timezone.utc):
+            if await token_cache.check(payload.get("jti"), payload["exp"]):
                 return {"valid": False}
             return {"valid": True}
         except Exception:
@@ -343,6 +444,10 @@ async def verify_token(request: Request):
 async def logout(request: Request):
     """Endpoint de logout"""
     token = request.cookies.get("access_token")
+    if not token:
+        auth_header = request.headers.get("Authorization")
+        if auth_header and auth_header.startswith("Bearer "):
+            token = auth_header.split(" ")[1]
     if token and settings.jwt_secret:
         try:
             payload = decode_access_token(token=token, secret=settings.jwt_secret, issuer=settings.jwt_issuer)
@@ -350,6 +455,8 @@ async def logout(request: Request):
                 where={"jti": payload.get("jti")},
                 data={"revokedAt": datetime.now(timezone.utc)},
             )
+            # Invalida o token nos caches de todas as instâncias
+            await token_cache.revoke(payload.get("jti"), payload.get("exp"))
         except Exception:
             pass
     response = JSONResponse({"success": True, "message": "Logout realizado"})
@@ -373,6 +480,14 @@ def _encrypt_sensitive_config(value: Any) -> Any:
             if isinstance(v, str) and settings.encryption_key and (
                 key in {"password", "senha", "secret", "token", "api_key", "apikey"} or key.endswith("_key")
             ):
+                if v.startswith("enc:"):
+                    # Já cifrado (config reenviada): recifra com a chave primária em vez de cifrar de novo
+                    try:
+                        encrypted[k] = "enc:" + rotate_str(v[4:], settings.encryption_key)
+                        continue
+                    except InvalidToken:
+                        # Texto puro que só começa com "enc:": cifra como os demais
+                        pass
                 encrypted[k] = "enc:" + encrypt_str(v, settings.encryption_key)
             else:
                 encrypted[k] = _encrypt_sensitive_config(v)
@@ -471,7 +586,7 @@ async def admin_create_user(request: Request, body: UsuarioCreate):
     user = await prisma_db.db.usuario.create(
         data={
             "email": body.email,
-            "senhaHash": hash_password(body.senha),
+            "senhaHash": await _hash_password(body.senha),
             "nivel": nivel,
             "grupoId": body.grupoId,
         }
@@ -496,7 +611,7 @@ async def admin_update_user(request: Request, usuario_id: str, body: UsuarioUpda
     if body.email is not None:
         data["email"] = body.email
     if body.senha is not None:
-        data["senhaHash"] = hash_password(body.senha)
+        data["senhaHash"] = await _hash_password(body.senha)
     if body.nivel is not None:
         if body.nivel not in {"NORMAL", "ADMIN", "ADMIN_GERAL"}:
             raise HTTPException(status_code=422, detail="Nivel inválido")
@@ -515,10 +630,19 @@ async def admin_update_user(request: Request, usuario_id: str, body: UsuarioUpda
 @app.delete("/api/admin/usuarios/{usuario_id}")
 async def admin_delete_user(request: Request, usuario_id: str):
     require_admin_geral(request)
+    # A remoção apaga os tokens em cascata: revoga antes para invalidar os caches das instâncias
+    await token_cache.revoke_user(usuario_id)
     await prisma_db.db.usuario.delete(where={"id": usuario_id})
     return {"deleted": True}
 
 
+async def _agent_changed(agent_id: str):
+    """Atualiza o agente do banco no registro local e avisa as demais instâncias"""
+    if agent_loader:
+        await agent_loader.reload_agent(agent_id)
+        await agent_loader.notify_changed(agent_id)
+
+
 @app.post("/api/grupo/agentes")
 async def group_create_agent(request: Request, body: AgenteCreate):
     user = require_admin_grupo(request)
@@ -529,6 +653,7 @@ async def group_create_agent(request: Request, body: AgenteCreate):
         "criadoPorId": user["id"],
     }
     agente = await prisma_db.db.agente.create(data=data)
+    await _agent_changed(agente.id)
     return agente
 
 
@@ -551,7 +676,9 @@ async def group_update_agent(request: Request, agente_id: str, body: AgenteUpdat
         data["configuracoes"] = _encrypt_sensitive_config(body.configuracoes)
     if not data:
         return agente
-    return await prisma_db.db.agente.update(where={"id": agente_id}, data=data)
+    agente = await prisma_db.db.agente.update(where={"id": agente_id}, data=data)
+    await _agent_changed(agente_id)
+    return agente
 
 
 @app.delete("/api/grupo/agentes/{agente_id}")
@@ -561,6 +688,7 @@ async def group_delete_agent(request: Request, agente_id: str):
     if not agente or agente.grupoId != user["grupoId"]:
         raise HTTPException(status_code=404, detail="Agent not found")
     await prisma_db.db.agente.delete(where={"id": agente_id})
+    await _agent_changed(agente_id)
     return {"deleted": True}
 
 
@@ -599,7 +727,10 @@ async def health_check():
     return {
         "status": "healthy" if redis_ok else "degraded",
         "redis": "connected" if redis_ok else "disconnected",
-        "agents_loaded": len(agent_loader.list_agents()) if agent_loader else 0
+        "agents_loaded": len(agent_loader.agents) if agent_loader else 0,
+        "agents_version": agent_loader.version if agent_loader else 0,
+        "data_cache": data_analysis_service.datasets.stats() if data_analysis_service else None,
+        "data_query_pool": data_query_pool.stats() if data_query_pool else None
     }
 
 
@@ -633,10 +764,13 @@ async def webhook_entry(agent_id: str, request: Request):
     start_time = time.time()
     success = False
     tokens_used = None
+    stream = False
+    trace, trace_token = tracer.start_trace("webhook", agent_id=agent_id)
     
     try:
         # Parse do body (assumindo JSON)
         body = await request.json()
+        sanitize_started = time.perf_counter()
         
         # Sanitiza inputs
         # Sanitiza inputs com Bleach
@@ -677,16 +811,38 @@ async def webhook_entry(agent_id: str, request: Request):
             conversation_id=sanitized_conversation_id
         )
         
+        tracer.add_span("webhook.sanitize", (time.perf_counter() - sanitize_started) * 1000)
+        
         # Recupera histórico de mensagens (já sanitizado acima)
         
         # Verifica se deve usar streaming
         stream = body.get("stream", False)
         
-        if stream:
+        if stream and settings.stream_via_worker:
+            # Worker gera os tokens; a API apenas retransmite o stream do job via SSE
+            job_data = {
+                "agent_id": agent_id,
+                "message": message.dict(),
+                "history": history,
+                "stream": True,
+                "webhook_output_url": agent_config.webhook_output_url,
+                "trace_id": trace.trace_id,
+                "trace_sampled": trace.sampled,
+                "group_id": _request_group_id(request)
+            }
+            with tracer.span("webhook.enqueue"):
+                job_id = await redis_client.enqueue_job(job_data)
+            success = True
+            return _job_stream_response(job_id)
+        elif stream:
             # Stream direto via SSE
             # Nota: Em streaming, não temos tokens até o final, então não registramos métricas aqui
             async def generate():
                 nonlocal success
+                # O generator roda em outra task: abre um trace filho com o mesmo trace_id
+                stream_trace, stream_token = tracer.start_trace(
+                    "webhook.stream", trace_id=trace.trace_id, sampled=trace.sampled, agent_id=agent_id
+                )
                 try:
                     async for token in agent_service.process_message(
                         agent_config, message, stream=True, history=history
@@ -697,6 +853,8 @@ async def webhook_entry(agent_id: str, request: Request):
                     logger.error(f"Error in stream: {e}", exc_info=True)
                     yield f"data: {json.dumps(f'[ERRO: {str(e)}]', ensure_ascii=False)}\n\n"
                     success = False
+                finally:
+                    tracer.end_trace(stream_trace, stream_token)
             
             # Para streaming, não registramos métricas aqui pois não temos tokens
             # As métricas de streaming podem ser registradas no cliente ou via webhook
@@ -715,10 +873,14 @@ async def webhook_entry(agent_id: str, request: Request):
                 "message": message.dict(),
                 "history": history,  # Incluir histórico no job
                 "stream": False,
-                "webhook_output_url": agent_config.webhook_output_url
+                "webhook_output_url": agent_config.webhook_output_url,
+                "trace_id": trace.trace_id,
+                "trace_sampled": trace.sampled,
+                "group_id": _request_group_id(request)
             }
             
-            job_id = await redis_client.enqueue_job(job_data)
+            with tracer.span("webhook.enqueue"):
+                job_id = await redis_client.enqueue_job(job_data)
             success = True
             
             return JSONResponse({
@@ -730,8 +892,10 @@ async def webhook_entry(agent_id: str, request: Request):
     except Exception as e:
         logger.error(f"Error processing webhook: {e}", exc_info=True)
         success = False
+        trace.attrs["error"] = str(e)
         raise HTTPException(status_code=500, detail=str(e))
     finally:
+        tracer.end_trace(trace, trace_token)
         # Registra métricas
         if metrics_service and not stream:
             response_time = time.time() - start_time
@@ -741,10 +905,126 @@ async def webhook_entry(agent_id: str, request: Request):
                 channel=message.channel.value if 'message' in locals() else "web",
                 response_time=response_time,
                 tokens_used=tokens_used,
-                success=success
+                success=success,
+                # O job é só enfileirado aqui; o tempo total é medido pelo worker
+                latency_stage="enqueue"
             )
 
 
+def _request_group_id(request: Request) -> Optional[str]:
+    """Grupo do usuário do JWT (None com o token de acesso estático)"""
+    user = getattr(request.state, "user", None)
+    return user.get("grupoId") if user else None
+
+
+def _check_job_access(request: Request, job_id: str, state: Optional[Dict[str, Any]]):
+    """404 se o job não existe ou pertence a outro grupo (ADMIN_GERAL e o token estático veem todos)"""
+    user = getattr(request.state, "user", None)
+    if state is None or (
+        user and user.get("nivel") != "ADMIN_GERAL" and state.get("group_id") != user.get("grupoId")
+    ):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+
+def _job_stream_response(job_id: str, last_event_id: str = "0") -> StreamingResponse:
+    """Retransmite via SSE os deltas gravados pelo worker no stream do job"""
+    async def generate():
+        resume_from = last_event_id
+        try:
+            while True:
+                async for event_id, event in redis_client.iter_job_stream(
+                    job_id, last_id=resume_from, idle_timeout=settings.job_wait_max_seconds
+                ):
+                    resume_from = event_id
+                    if event.get("type") == "delta":
+                        data = event.get("data", "")
+                    elif event.get("type") == "error":
+                        data = f"[ERRO: {event.get('data', '')}]"
+                    elif event.get("type") == "done":
+                        return
+                    else:
+                        continue
+                    yield f"id: {event_id}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    if event.get("type") == "error":
+                        return
+                
+                # Stream ocioso: o job pode estar na fila ou aguardando o primeiro token
+                state = await redis_client.get_job_state(job_id) or {}
+                status = state.get("status")
+                if status in ("queued", "processing"):
+                    yield ": keep-alive\n\n"
+                    continue
+                if status == "completed":
+                    return
+                if status == "failed":
+                    message = f"[ERRO: {state.get('error', 'job failed')}]"
+                    yield f"event: failed\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+                else:
+                    logger.warning(f"Stream of job {job_id} idle for {settings.job_wait_max_seconds}s (status: {status})")
+                    message = "[ERRO: job sem eventos e sem estado ativo]"
+                    yield f"event: timeout\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+                return
+        except Exception as e:
+            logger.error(f"Error relaying stream of job {job_id}: {e}", exc_info=True)
+            yield f"data: {json.dumps(f'[ERRO: {str(e)}]', ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Job-Id": job_id
+        }
+    )
+
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, request: Request, last_event_id: Optional[str] = None):
+    """Retransmite os tokens de um job de streaming (retoma a partir de Last-Event-ID)"""
+    if not redis_client or not redis_client.client:
+        raise HTTPException(status_code=503, detail="Service not initialized")
+    
+    _check_job_access(request, job_id, await redis_client.get_job_state(job_id))
+    
+    resume_from = request.headers.get("last-event-id") or last_event_id or "0"
+    return _job_stream_response(job_id, resume_from)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, request: Request, wait: float = 0, stream: bool = False):
+    """Consulta o resultado de um job enfileirado (long-poll com ?wait=N ou SSE)"""
+    if not redis_client or not redis_client.client:
+        raise HTTPException(status_code=503, detail="Service not initialized")
+    
+    timeout = max(0.0, min(wait or settings.job_wait_max_seconds, settings.job_wait_max_seconds))
+    
+    if stream or "text/event-stream" in request.headers.get("accept", ""):
+        _check_job_access(request, job_id, await redis_client.get_job_state(job_id))
+        
+        async def generate():
+            async for job_state in redis_client.iter_job_states(job_id, timeout=timeout):
+                yield f"data: {json.dumps(job_state, ensure_ascii=False, default=str)}\n\n"
+        
+        return StreamingResponse(
+            generate(),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive"
+            }
+        )
+    
+    # Checa o dono antes de aguardar: não deixa esperar por jobs de outro grupo
+    state = await redis_client.get_job_state(job_id)
+    _check_job_access(request, job_id, state)
+    if wait > 0:
+        state = await redis_client.wait_job_state(job_id, timeout=timeout)
+        if state is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return state
+
+
 @app.get("/agents")
 async def list_agents(request: Request):
     """Lista todos os agentes configurados (Filtrado por grupo se não for ADMIN_GERAL)"""
@@ -828,6 +1108,7 @@ async def update_agent(agent_id: str, agent: AgentConfig):
     success = agent_loader.save_agent(agent)
     if not success:
         raise HTTPException(status_code=400, detail="Failed to update agent")
+    await agent_loader.notify_changed(agent_id)
 
     return {"status": "updated", "agent_id": agent_id, "agent": agent.dict()}
 
@@ -841,6 +1122,7 @@ async def delete_agent(agent_id: str):
     success = agent_loader.delete_agent(agent_id)
     if not success:
         raise HTTPException(status_code=404, detail=f"Agent {agent_id} not found")
+    await agent_loader.notify_changed(agent_id)
 
     return {"status": "deleted", "agent_id": agent_id}
 
@@ -852,6 +1134,7 @@ async def reload_agent(agent_id: str):
         raise HTTPException(status_code=503, detail="Service not initialized")
     
     success = await agent_loader.reload_agent(agent_id)
+    await agent_loader.notify_changed(agent_id)
     if not success:
         raise HTTPException(status_code=404, detail=f"Agent {agent_id} not found")
     
@@ -870,37 +1153,55 @@ async def reload_all_agents():
     if not agent_loader:
         raise HTTPException(status_code=503, detail="Service not initialized")
     
-    await agent_loader.reload()
+    changed = await agent_loader.reload()
+    if changed:
+        await agent_loader.notify_changed()
     
-    # Recarrega arquivos de análise de dados para todos os agentes
-    if data_analysis_service:
-        agents = agent_loader.list_agents()
-        for agent_id, agent_config in agents.items():
-            if agent_config.data_analysis and agent_config.data_analysis.enabled:
-                if agent_config.data_analysis.files:
-                    data_analysis_service.load_agent_files(agent_id, agent_config.data_analysis.files)
+    # Arquivos de análise de dados não são recarregados aqui: cada uso confere a versão do arquivo
     
-    return {"status": "reloaded", "count": len(agent_loader.list_agents())}
+    return {"status": "reloaded", "count": len(agent_loader.agents), "changed": changed, "version": agent_loader.version}
 
 
 # ==================== MÉTRICAS ====================
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Exposição das métricas do processo no formato texto do Prometheus (sem acesso ao Redis)"""
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/metrics/agents/{agent_id}")
-async def get_agent_metrics(agent_id: str, days: int = 7):
+async def get_agent_metrics(agent_id: str, days: int = 7, hours: Optional[int] = None):
     """Obtém métricas de um agente"""
     if not metrics_service:
         raise HTTPException(status_code=503, detail="Metrics service not initialized")
     
-    return await metrics_service.get_agent_metrics(agent_id, days)
+    return await metrics_service.get_agent_metrics(agent_id, days, hours=hours)
 
 
 @app.get("/metrics/global")
-async def get_global_metrics(days: int = 7):
+async def get_global_metrics(days: int = 7, hours: Optional[int] = None):
     """Obtém métricas globais"""
     if not metrics_service:
         raise HTTPException(status_code=503, detail="Metrics service not initialized")
     
-    return await metrics_service.get_global_metrics(days)
+    return await metrics_service.get_global_metrics(days, hours=hours)
+
+
+@app.get("/metrics/top")
+async def get_top_agents(limit: int = 10, days: int = 7):
+    """Obtém os agentes com mais mensagens no período"""
+    if not metrics_service:
+        raise HTTPException(status_code=503, detail="Metrics service not initialized")
+    
+    return {"period_days": days, "agents": await metrics_service.get_top_agents(limit, days)}
+
+
+@app.get("/traces/slow")
+async def get_slow_traces(limit: int = 20, min_ms: Optional[float] = None):
+    """Lista os traces recentes mais lentos que min_ms (padrão: TRACE_SLOW_MS)"""
+    threshold = settings.trace_slow_ms if min_ms is None else min_ms
+    return {"min_ms": threshold, "traces": tracer.recent(limit=limit, min_ms=threshold)}
 
 
 # ==================== RAG DOCUMENTS ====================
@@ -1083,6 +1384,7 @@ class AgentCreateRequest(BaseModel):
     data_analysis: Optional[Dict[str, Any]] = None
     tools: List[Dict[str, Any]] = Field(default_factory=list)
     webhook_output_url: Optional[str] = None
+    rate_limit_per_minute: Optional[int] = None
 
 
 @app.post("/agents/create")
@@ -1123,13 +1425,15 @@ async def create_agent(request: AgentCreateRequest):
             rag=rag_config,
             data_analysis=data_analysis_config,
             tools=tools,
-            webhook_output_url=request.webhook_output_url
+            webhook_output_url=request.webhook_output_url,
+            rate_limit_per_minute=request.rate_limit_per_minute
         )
         
         # Salva agente
         success = agent_loader.save_agent(agent_config)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to save agent")
+        await agent_loader.notify_changed(request.id)
         
         # Carrega arquivos de análise de dados se houver
         if data_analysis_config and data_analysis_config.enabled and data_analysis_config.files:
@@ -1150,6 +1454,23 @@ async def create_agent(request: AgentCreateRequest):
 
 # ==================== AGENT FILES ====================
 
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Gravação e conversão de uploads de dados: threads próprias, fora do executor padrão
+_data_ingest_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="data-ingest")
+
+
+def _copy_upload(source, destination: Path):
+    """Copia o upload (arquivo temporário do Starlette) em blocos, sem carregá-lo inteiro"""
+    source.seek(0)
+    try:
+        with open(destination, "wb") as out:
+            shutil.copyfileobj(source, out, UPLOAD_CHUNK_BYTES)
+    except BaseException:
+        destination.unlink(missing_ok=True)
+        raise
+
+
 @app.post("/agents/{agent_id}/files")
 async def upload_agent_file(
     agent_id: str,
@@ -1168,11 +1489,13 @@ async def upload_agent_file(
         raise HTTPException(status_code=404, detail=f"Agent {agent_id} not found")
     
     try:
-        # Lê conteúdo do arquivo
-        content = await file.read()
-        
-        # Salva arquivo
-        success = data_analysis_service.save_file(agent_id, file.filename, content)
+        # Grava o upload em blocos e converte para colunar fora do event loop
+        loop = asyncio.get_running_loop()
+        upload_path = data_analysis_service.upload_path(agent_id)
+        await loop.run_in_executor(_data_ingest_executor, _copy_upload, file.file, upload_path)
+        success = await loop.run_in_executor(
+            _data_ingest_executor, data_analysis_service.ingest_file, agent_id, file.filename, upload_path
+        )
         if not success:
             raise HTTPException(status_code=400, detail="Failed to save file")
         
@@ -1180,7 +1503,8 @@ async def upload_agent_file(
         if agent_config.data_analysis and agent_config.data_analysis.enabled:
             if file.filename not in agent_config.data_analysis.files:
                 agent_config.data_analysis.files.append(file.filename)
-                agent_loader.save_agent(agent_config)
+                if agent_loader.save_agent(agent_config):
+                    await agent_loader.notify_changed(agent_id)
         
         return {
             "status": "uploaded",
@@ -1238,7 +1562,8 @@ async def delete_agent_file(agent_id: str, filename: str):
     # Atualiza configuração do agente
     if agent_config.data_analysis and filename in agent_config.data_analysis.files:
         agent_config.data_analysis.files.remove(filename)
-        agent_loader.save_agent(agent_config)
+        if agent_loader.save_agent(agent_config):
+            await agent_loader.notify_changed(agent_id)
     
     return {
         "status": "deleted",
@@ -1247,13 +1572,35 @@ async def delete_agent_file(agent_id: str, filename: str):
     }
 
 
+async def _cancel_on_disconnect(request: Request, coro):
+    """Aguarda coro, cancelando-o se o cliente desconectar antes do fim"""
+    task = asyncio.ensure_future(coro)
+    
+    async def wait_disconnect():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+    
+    watcher = asyncio.ensure_future(wait_disconnect())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            # Aguarda o cancelamento: o pool encerra o executor da consulta
+            await asyncio.gather(task, return_exceptions=True)
+    if task.cancelled():
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    return task.result()
+
+
 @app.post("/agents/{agent_id}/data/query")
-async def test_data_query(agent_id: str, query: str):
-    """Testa uma query de dados para um agente"""
+async def test_data_query(agent_id: str, http_request: Request, plan: Dict[str, Any] = Body(...)):
+    """Testa um plano de consulta de dados (ou {"sql": ...} com engine SQL) para um agente"""
     if not agent_loader:
         raise HTTPException(status_code=503, detail="Service not initialized")
     
-    if not data_analysis_service:
+    if not data_analysis_service or not agent_service:
         raise HTTPException(status_code=503, detail="Data analysis service not initialized")
     
     # Verifica se agente existe
@@ -1265,16 +1612,12 @@ async def test_data_query(agent_id: str, query: str):
     if not agent_config.data_analysis or not agent_config.data_analysis.enabled:
         raise HTTPException(status_code=400, detail="Data analysis not enabled for this agent")
     
-    # Carrega arquivos se necessário
-    if agent_config.data_analysis.files:
-        data_analysis_service.load_agent_files(agent_id, agent_config.data_analysis.files)
-    
-    # Executa query
-    result = data_analysis_service.execute_query(agent_id, query)
+    # Executa query no pool de consultas (abortada se o cliente desconectar)
+    result = await _cancel_on_disconnect(http_request, agent_service.execute_data_query(agent_config, plan))
     
     return {
         "agent_id": agent_id,
-        "query": query,
+        "query": plan,
         "result": result
     }
 
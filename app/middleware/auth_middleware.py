@@ -1,95 +1,114 @@
 """Middleware de autenticação"""
-from fastapi import Request, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response, JSONResponse
+from fastapi import status
+from starlette.requests import HTTPConnection
+from starlette.responses import Response, JSONResponse, RedirectResponse
 
+import hmac
 import logging
-from datetime import datetime, timezone
+from typing import Optional, Tuple
 
-from app.infrastructure import prisma_db
 from app.security.jwt_service import decode_access_token
+from app.security.token_cache import TokenCache
 
 logger = logging.getLogger(__name__)
 
+# Endpoints públicos que não precisam de autenticação
+PUBLIC_PATHS = (
+    "/health",
+    "/static",
+    "/login",
+    "/api/setup",
+    "/api/auth/login",
+    "/api/auth/verify"
+)
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    """Middleware para autenticação via token"""
-    
-    def __init__(self, app, access_token: str, jwt_secret: str | None = None, jwt_issuer: str = "ai-agent-api"):
-        super().__init__(app)
+# Caminho exato do scrape do Prometheus; aceita também o token de scrape
+METRICS_PATH = "/metrics"
+
+
+def _is_public(path: str) -> bool:
+    return path.startswith("/static") or any(
+        path == public or path.startswith(public + "/") for public in PUBLIC_PATHS
+    )
+
+
+def _is_api(path: str) -> bool:
+    return path.startswith("/api/") or path.startswith("/webhooks/") or path == METRICS_PATH
+
+
+def _extract_token(conn: HTTPConnection) -> Optional[str]:
+    """Token do cookie ou, se ausente, do header Authorization"""
+    token = conn.cookies.get("access_token")
+    if not token:
+        auth_header = conn.headers.get("Authorization")
+        if auth_header and auth_header.startswith("Bearer "):
+            token = auth_header.split(" ")[1]
+    return token
+
+
+class AuthMiddleware:
+    """Middleware para autenticação via token (ASGI puro, não envolve o corpo da resposta)"""
+
+    def __init__(
+        self,
+        app,
+        access_token: str,
+        jwt_secret: str | None = None,
+        jwt_issuer: str = "ai-agent-api",
+        token_cache: Optional[TokenCache] = None,
+        metrics_token: str = ""
+    ):
+        self.app = app
         self.access_token = access_token
         self.jwt_secret = jwt_secret
         self.jwt_issuer = jwt_issuer
-    
-    async def dispatch(self, request: Request, call_next):
-        # Endpoints públicos que não precisam de autenticação
-        public_paths = [
-            "/health",
-            "/static",
-            "/login",
-            "/api/setup",
-            "/api/auth/login",
-            "/api/auth/verify"
-        ]
-        
-        # Verifica se o path é público
-        is_public = any(
-            request.url.path == path or 
-            request.url.path.startswith(path + "/") or
-            request.url.path.startswith("/static")
-            for path in public_paths
-        )
-        
-        if is_public:
-            return await call_next(request)
-        
-        # Verifica autenticação via cookie ou header
-        token = None
-        
-        # Tenta obter do cookie primeiro
-        token = request.cookies.get("access_token")
-        
-        # Se não tiver no cookie, tenta no header
-        if not token:
-            auth_header = request.headers.get("Authorization")
-            if auth_header and auth_header.startswith("Bearer "):
-                token = auth_header.split(" ")[1]
-        
+        # Sem cache compartilhado: consulta o banco a cada requisição
+        self.token_cache = token_cache or TokenCache(max_size=0)
+        # Token só do scrape: não dá acesso a nenhuma outra rota
+        self.metrics_token = metrics_token
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _is_public(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        conn = HTTPConnection(scope)
+        rejection, user = await self._authenticate(conn)
+        if rejection is not None:
+            await rejection(scope, receive, send)
+            return
+
+        if user is not None:
+            # Equivalente a request.state.user
+            scope.setdefault("state", {})["user"] = user
+        await self.app(scope, receive, send)
+
+    async def _authenticate(self, conn: HTTPConnection) -> Tuple[Optional[Response], Optional[dict]]:
+        """Retorna (resposta de rejeição, usuário do JWT); ambos None libera sem usuário"""
+        path = conn.url.path
+        token = _extract_token(conn)
+
+        if path == METRICS_PATH and self.metrics_token and token and hmac.compare_digest(token, self.metrics_token):
+            return None, None
+
         if token and self.jwt_secret:
             try:
                 payload = decode_access_token(token=token, secret=self.jwt_secret, issuer=self.jwt_issuer)
                 jti = payload.get("jti")
-                token_row = await prisma_db.db.accesstoken.find_unique(where={"jti": jti})
-                if not token_row or token_row.revokedAt is not None:
+                reason = await self.token_cache.check(jti, payload["exp"])
+                if reason == "revoked":
                     # Token removido/revogado
-                    if request.url.path.startswith("/api/") or request.url.path.startswith("/webhooks/"):
-                        return JSONResponse(
-                            status_code=status.HTTP_401_UNAUTHORIZED,
-                            content={"detail": "Token revogado ou inválido"}
-                        )
-                    from starlette.responses import RedirectResponse
-                    return RedirectResponse(url="/login", status_code=302)
-
-                expires_at = token_row.expiresAt
-                if expires_at.tzinfo is None:
-                    expires_at = expires_at.replace(tzinfo=timezone.utc)
-                if expires_at <= datetime.now(timezone.utc):
+                    return self._reject(path, "Token revogado ou inválido"), None
+                if reason == "expired":
                     # Token expirado
-                    if request.url.path.startswith("/api/") or request.url.path.startswith("/webhooks/"):
-                        return JSONResponse(
-                            status_code=status.HTTP_401_UNAUTHORIZED,
-                            content={"detail": "Token expirado"}
-                        )
-                    from starlette.responses import RedirectResponse
-                    return RedirectResponse(url="/login", status_code=302)
-
-                request.state.user = {
+                    return self._reject(path, "Token expirado"), None
+
+                return None, {
                     "id": payload.get("sub"),
                     "grupoId": payload.get("grp"),
                     "nivel": payload.get("lvl"),
                     "jti": jti,
                 }
-                return await call_next(request)
             except Exception:
                 # Se falhar decode/validação, considera inválido
                 token = None
@@ -97,18 +116,16 @@ class AuthMiddleware(BaseHTTPMiddleware):
         # Se não tiver token configurado, permite acesso (modo desenvolvimento)
         if not self.access_token and not self.jwt_secret:
             logger.warning("No auth configured, allowing access")
-            return await call_next(request)
+            return None, None
 
         if not token or (self.access_token and token != self.access_token):
-            # Se for requisição de API, retorna 401
-            if request.url.path.startswith("/api/") or request.url.path.startswith("/webhooks/"):
-                return JSONResponse(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    content={"detail": "Token de acesso inválido ou ausente"}
-                )
-            # Se for página HTML, redireciona para login
-            from starlette.responses import RedirectResponse
-            return RedirectResponse(url="/login", status_code=302)
-        
-        return await call_next(request)
+            return self._reject(path, "Token de acesso inválido ou ausente"), None
+
+        return None, None
 
+    @staticmethod
+    def _reject(path: str, detail: str) -> Response:
+        # Requisição de API recebe 401; página HTML redireciona para login
+        if _is_api(path):
+            return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED, content={"detail": detail})
+        return RedirectResponse(url="/login", status_code=302)
@@ -0,0 +1,50 @@
+"""Middleware ASGI de métricas HTTP"""
+import time
+
+from app.infrastructure.metrics_registry import registry
+
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "Requisições HTTP processadas", labels=("method", "handler", "status")
+)
+HTTP_DURATION = registry.histogram(
+    "http_request_duration_seconds", "Duração das requisições HTTP", labels=("method", "handler")
+)
+HTTP_IN_FLIGHT = registry.gauge("http_requests_in_flight", "Requisições HTTP em andamento")
+
+
+class MetricsMiddleware:
+    """Conta requisições por handler/status e mede a duração (ASGI puro)"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status_code = 500
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # O roteador grava o endpoint no scope: usa o nome do handler como label (baixa cardinalidade)
+            endpoint = scope.get("endpoint")
+            if endpoint is not None:
+                handler = getattr(endpoint, "__name__", "unknown")
+            elif scope.get("path", "").startswith("/static"):
+                handler = "static"
+            else:
+                handler = "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(method=method, handler=handler, status=str(status_code))
+            HTTP_DURATION.observe(time.perf_counter() - start, method=method, handler=handler)
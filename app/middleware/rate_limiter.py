@@ -1,61 +1,348 @@
 """Middleware de rate limiting"""
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse
 from app.infrastructure.redis_client import RedisClient
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import hashlib
+import json
+import math
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+# GCRA (generic cell rate algorithm) atômico para várias chaves em um único round trip.
+# KEYS[i] -> ARGV[3i-2] = intervalo de emissão (ms), ARGV[3i-1] = burst, ARGV[3i] = quantidade pedida.
+# Cada chave concede até a quantidade pedida (lease em bloco); só consome se todas concederem ao menos 1.
+# Retorno: {permitido, retry_after_ms, concedido_1, restante_1, espera_1, ...}
+GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local retry_after = 0
+local tats = {}
+local result = {1, 0}
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[i * 3 - 2])
+    local burst = tonumber(ARGV[i * 3 - 1])
+    local cost = tonumber(ARGV[i * 3])
+    local tat = tonumber(redis.call('GET', key)) or now
+    if tat < now then
+        tat = now
+    end
+    local available = math.floor((interval * burst - (tat - now)) / interval)
+    local grant = 0
+    local wait = 0
+    if available < 1 then
+        wait = tat + interval - interval * burst - now
+        if wait > retry_after then
+            retry_after = wait
+        end
+    else
+        grant = math.min(cost, available)
+    end
+    tats[i] = tat
+    table.insert(result, grant)
+    table.insert(result, available - grant)
+    table.insert(result, wait)
+end
+if retry_after > 0 then
+    result[1] = 0
+    result[2] = retry_after
+    return result
+end
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[i * 3 - 2])
+    local new_tat = tats[i] + result[i * 3] * interval
+    redis.call('SET', key, new_tat, 'PX', math.ceil(new_tat - now))
+end
+return result
+"""
 
-class RateLimiterMiddleware(BaseHTTPMiddleware):
-    """Middleware para rate limiting baseado em IP"""
+# Devolve cota reservada e não usada: recua o TAT da chave em `quantidade * intervalo`.
+# KEYS[1] -> ARGV[1] = intervalo de emissão (ms), ARGV[2] = quantidade devolvida.
+REFUND_SCRIPT = """
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat then
+    return 0
+end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local new_tat = tat - tonumber(ARGV[1]) * tonumber(ARGV[2])
+if new_tat <= now then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+end
+return 1
+"""
+
+# Máximo de chaves com lease local mantidas em memória por processo
+MAX_LOCAL_LEASES = 10000
+
+
+class _Lease:
+    """Cota local concedida pelo Redis para uma chave de limite"""
+    __slots__ = ("rpm", "block", "tokens", "remaining", "expires_at", "blocked_until", "refilling", "timer")
+
+    def __init__(self):
+        self.rpm = 0
+        self.block = 1
+        self.tokens = 0
+        self.remaining = -1
+        self.expires_at = 0.0
+        self.blocked_until = 0.0
+        self.refilling = False
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+def parse_route_limits(raw: str) -> Dict[str, int]:
+    """Lê limites por rota (prefixo -> requisições/minuto) de um JSON"""
+    if not raw or not raw.strip():
+        return {}
+    try:
+        data = json.loads(raw)
+        return {str(prefix): int(limit) for prefix, limit in data.items()}
+    except Exception as e:
+        logger.error(f"Invalid RATE_LIMIT_ROUTES: {e}")
+        return {}
+
+
+class RateLimiterMiddleware:
+    """Middleware para rate limiting por IP/rota, agente e token de API (GCRA no Redis)
+
+    Com lease_size > 0 o processo reserva cota do Redis em blocos e decide a maioria
+    das requisições localmente, reabastecendo em background. O bloco começa em 1 e só
+    cresce enquanto o tráfego esgota o lease antes de expirar; a cota não usada é
+    devolvida ao Redis quando o lease expira. ASGI puro: respostas em streaming (SSE)
+    passam direto, sem buffer.
+    """
     
-    def __init__(self, app, redis_client: RedisClient, requests_per_minute: int = 60):
-        super().__init__(app)
+    def __init__(
+        self,
+        app,
+        redis_client: RedisClient,
+        requests_per_minute: int = 60,
+        route_limits: Optional[Dict[str, int]] = None,
+        token_requests_per_minute: int = 0,
+        agent_limit_resolver: Optional[Callable[[str], Optional[Tuple[str, int]]]] = None,
+        lease_size: int = 0,
+        lease_ttl: float = 1.0
+    ):
+        self.app = app
         self.redis = redis_client
         self.requests_per_minute = requests_per_minute
+        # Prefixos mais longos primeiro: o mais específico vence
+        self.route_limits = sorted((route_limits or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.token_requests_per_minute = token_requests_per_minute
+        self.agent_limit_resolver = agent_limit_resolver
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self._script = None
+        self._refund_script = None
+        self._leases: "OrderedDict[str, _Lease]" = OrderedDict()
+        self._refill_tasks: Set[asyncio.Task] = set()
     
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope, receive, send):
         # Ignora rate limiting para health check e endpoints de admin
-        if request.url.path in ["/health", "/admin", "/static"] or request.url.path.startswith("/static"):
-            return await call_next(request)
-        
-        # Obtém IP do cliente
-        client_ip = request.client.host if request.client else "unknown"
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path in ["/health", "/admin", "/static"] or path.startswith("/static"):
+            await self.app(scope, receive, send)
+            return
         
-        # Verifica rate limit
-        if await self._check_rate_limit(client_ip):
-            return await call_next(request)
-        else:
-            raise HTTPException(
+        rules = self._rules_for(HTTPConnection(scope))
+        allowed, retry_after_ms, remaining = await self._check_rate_limit(rules)
+        if not allowed:
+            retry_after = max(1, math.ceil(retry_after_ms / 1000))
+            response = JSONResponse(
                 status_code=429,
-                detail=f"Rate limit exceeded. Maximum {self.requests_per_minute} requests per minute."
+                content={"detail": f"Rate limit exceeded. Retry after {retry_after} seconds."},
+                headers={"Retry-After": str(retry_after)}
             )
+            await response(scope, receive, send)
+            return
+        
+        if remaining < 0:
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-RateLimit-Remaining"] = str(remaining)
+            await send(message)
+        
+        await self.app(scope, receive, send_wrapper)
+    
+    def _rules_for(self, request: HTTPConnection) -> List[Tuple[str, int]]:
+        """Monta as chaves/limites (requisições por minuto) aplicáveis à requisição"""
+        path = request.url.path
+        client_ip = request.client.host if request.client else "unknown"
+        
+        route, limit = "*", self.requests_per_minute
+        for prefix, route_limit in self.route_limits:
+            if path.startswith(prefix):
+                route, limit = prefix, route_limit
+                break
+        rules = [(f"ratelimit:ip:{client_ip}:{route}", limit)]
+        
+        if self.agent_limit_resolver:
+            agent_limit = self.agent_limit_resolver(path)
+            if agent_limit:
+                agent_id, agent_rpm = agent_limit
+                rules.append((f"ratelimit:agent:{agent_id}", agent_rpm))
+        
+        if self.token_requests_per_minute > 0:
+            token = request.cookies.get("access_token")
+            auth_header = request.headers.get("Authorization")
+            if not token and auth_header and auth_header.startswith("Bearer "):
+                token = auth_header.split(" ")[1]
+            if token:
+                token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()[:32]
+                rules.append((f"ratelimit:token:{token_hash}", self.token_requests_per_minute))
+        
+        return [(key, rpm) for key, rpm in rules if rpm and rpm > 0]
     
-    async def _check_rate_limit(self, client_ip: str) -> bool:
-        """Verifica se o IP pode fazer mais requisições"""
-        if not self.redis.client:
-            return True  # Se Redis não estiver disponível, permite
+    async def _check_rate_limit(self, rules: List[Tuple[str, int]]) -> Tuple[bool, int, int]:
+        """Verifica e consome os limites. Retorna (permitido, retry_after_ms, restantes)"""
+        if not self.redis.client or not rules:
+            return True, 0, -1  # Se Redis não estiver disponível, permite
         
+        if self.lease_size <= 0:
+            result = await self._acquire([(key, rpm, 1) for key, rpm in rules])
+            if result is None:
+                return True, 0, -1  # Em caso de erro, permite
+            allowed, retry_after_ms, grants = result
+            return allowed, retry_after_ms, min(remaining for _, remaining, _ in grants) if allowed else 0
+        
+        now = time.monotonic()
+        leases = [self._get_lease(key) for key, _ in rules]
+        
+        # Bloqueio conhecido localmente: nega sem consultar o Redis
+        blocked_until = max(lease.blocked_until for lease in leases)
+        if blocked_until > now:
+            return False, math.ceil((blocked_until - now) * 1000), 0
+        
+        # Chaves sem cota local válida precisam de um lease síncrono
+        missing = []
+        for (key, rpm), lease in zip(rules, leases):
+            if lease.expires_at <= now:
+                self._release(key, lease)
+            if lease.tokens <= 0:
+                # Lease ainda válido e esgotado: tráfego contínuo, o próximo bloco cresce
+                size = self._grow(lease, rpm) if lease.expires_at > now else lease.block
+                missing.append((key, rpm, size, lease))
+        
+        if missing:
+            result = await self._acquire([(key, rpm, size) for key, rpm, size, _ in missing])
+            if result is None:
+                return True, 0, -1  # Em caso de erro, permite
+            allowed, retry_after_ms, grants = result
+            now = time.monotonic()
+            if not allowed:
+                for (_, _, _, lease), (_, _, wait_ms) in zip(missing, grants):
+                    if wait_ms > 0:
+                        lease.blocked_until = now + wait_ms / 1000
+                return False, retry_after_ms, 0
+            for (key, rpm, _, lease), (granted, remaining, _) in zip(missing, grants):
+                self._credit(key, rpm, lease, granted, remaining, now)
+        
+        for (key, rpm), lease in zip(rules, leases):
+            lease.tokens -= 1
+            if lease.block > 1 and lease.tokens <= lease.block // 2 and not lease.refilling:
+                lease.refilling = True
+                task = asyncio.create_task(self._refill(key, rpm, lease))
+                self._refill_tasks.add(task)
+                task.add_done_callback(self._refill_tasks.discard)
+        
+        return True, 0, min(max(0, lease.tokens) + max(0, lease.remaining) for lease in leases)
+    
+    def _block_size(self, rpm: int) -> int:
+        """Tamanho máximo do bloco reservado por lease (pequeno para limites baixos, para não esgotar outras réplicas)"""
+        return max(1, min(self.lease_size, rpm // 10))
+    
+    def _grow(self, lease: _Lease, rpm: int) -> int:
+        """Dobra o bloco do lease (até o máximo) enquanto o tráfego o mantém ocupado"""
+        lease.block = min(self._block_size(rpm), lease.block * 2)
+        return lease.block
+    
+    def _get_lease(self, key: str) -> _Lease:
+        lease = self._leases.get(key)
+        if lease is None:
+            lease = _Lease()
+            self._leases[key] = lease
+            if len(self._leases) > MAX_LOCAL_LEASES:
+                evicted_key, evicted = self._leases.popitem(last=False)
+                self._release(evicted_key, evicted)
+        else:
+            self._leases.move_to_end(key)
+        return lease
+    
+    def _credit(self, key: str, rpm: int, lease: _Lease, granted: int, remaining: int, now: float):
+        lease.rpm = rpm
+        lease.tokens += granted
+        lease.remaining = remaining
+        lease.expires_at = now + self.lease_ttl
+        lease.blocked_until = 0.0
+        if lease.timer:
+            lease.timer.cancel()
+        lease.timer = asyncio.get_running_loop().call_later(self.lease_ttl, self._expire, key, lease)
+    
+    def _expire(self, key: str, lease: _Lease):
+        lease.timer = None
+        if lease.expires_at <= time.monotonic():
+            self._release(key, lease)
+    
+    def _release(self, key: str, lease: _Lease):
+        """Encerra o lease: a cota não usada volta ao Redis e o próximo bloco recomeça em 1"""
+        if lease.timer:
+            lease.timer.cancel()
+            lease.timer = None
+        lease.block = 1
+        if lease.tokens <= 0:
+            return  # Mantém débito, se houver
+        tokens, lease.tokens = lease.tokens, 0
+        task = asyncio.create_task(self._refund(key, lease.rpm, tokens))
+        self._refill_tasks.add(task)
+        task.add_done_callback(self._refill_tasks.discard)
+    
+    async def _refill(self, key: str, rpm: int, lease: _Lease):
+        """Reserva o próximo bloco em background, fora do caminho da requisição"""
+        try:
+            result = await self._acquire([(key, rpm, self._grow(lease, rpm))])
+            if result and result[0]:
+                granted, remaining, _ = result[2][0]
+                self._credit(key, rpm, lease, granted, remaining, time.monotonic())
+        finally:
+            lease.refilling = False
+    
+    async def _refund(self, key: str, rpm: int, tokens: int):
+        """Recua o TAT da chave pelas células reservadas e não usadas"""
         try:
-            key = f"ratelimit:{client_ip}"
-            current = await self.redis.client.get(key)
-            
-            if current is None:
-                # Primeira requisição
-                await self.redis.client.setex(key, 60, "1")
-                return True
-            
-            count = int(current)
-            if count >= self.requests_per_minute:
-                return False
-            
-            # Incrementa contador
-            await self.redis.client.incr(key)
-            return True
+            if self._refund_script is None:
+                self._refund_script = self.redis.client.register_script(REFUND_SCRIPT)
+            await self._refund_script(keys=[key], args=[self._interval_ms(rpm), tokens])
+        except Exception as e:
+            logger.error(f"Error refunding rate limit lease: {e}")
+    
+    @staticmethod
+    def _interval_ms(rpm: int) -> int:
+        return math.ceil(60000 / rpm)
+    
+    async def _acquire(self, requests: List[Tuple[str, int, int]]) -> Optional[Tuple[bool, int, List[Tuple[int, int, int]]]]:
+        """Executa o GCRA no Redis para (chave, limite/minuto, quantidade). None em caso de erro"""
+        try:
+            if self._script is None:
+                self._script = self.redis.client.register_script(GCRA_SCRIPT)
+            args: List[int] = []
+            for _, rpm, cost in requests:
+                args.extend([self._interval_ms(rpm), rpm, cost])
+            result = await self._script(keys=[key for key, _, _ in requests], args=args)
+            values = [int(v) for v in result]
+            grants = [tuple(values[i:i + 3]) for i in range(2, len(values), 3)]
+            return bool(values[0]), values[1], grants
         
         except Exception as e:
             logger.error(f"Error checking rate limit: {e}")
-            return True  # Em caso de erro, permite
-
+            return None
@@ -53,7 +53,7 @@ class DataAnalysisConfig(BaseModel):
     """Configuração de análise de dados para um agente"""
     enabled: bool = False
     files: List[str] = Field(default_factory=list)  # Lista de arquivos carregados (CSV, JSON, XLSX)
-    query_engine: str = "pandas"  # Tipo de engine (pandas, etc)
+    query_engine: str = "pandas"  # Tipo de engine: "pandas" (plano estruturado) ou "sql"/"duckdb"
 
 
 class AgentConfig(BaseModel):
@@ -71,6 +71,7 @@ class AgentConfig(BaseModel):
     data_analysis: Optional[DataAnalysisConfig] = None
     tools: List[AgentTool] = Field(default_factory=list)
     webhook_output_url: Optional[str] = None
+    rate_limit_per_minute: Optional[int] = None  # Limite de requisições/minuto do agente (todas as origens)
 
 
 class RAGContext(BaseModel):
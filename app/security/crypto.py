@@ -1,12 +1,19 @@
+from functools import lru_cache
 from typing import Optional
 
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 
 
-def _get_fernet(key: Optional[str]) -> Fernet:
+@lru_cache(maxsize=8)
+def _get_fernet(key: Optional[str]) -> MultiFernet:
+    # ENCRYPTION_KEY aceita várias chaves separadas por vírgula (rotação):
+    # a primeira cifra, todas decifram
     if not key:
         raise ValueError("ENCRYPTION_KEY not configured")
-    return Fernet(key.encode("utf-8"))
+    keys = [k.strip() for k in key.split(",") if k.strip()]
+    if not keys:
+        raise ValueError("ENCRYPTION_KEY not configured")
+    return MultiFernet([Fernet(k.encode("utf-8")) for k in keys])
 
 
 def encrypt_str(value: str, key: Optional[str]) -> str:
@@ -14,7 +21,14 @@ def encrypt_str(value: str, key: Optional[str]) -> str:
     return f.encrypt(value.encode("utf-8")).decode("utf-8")
 
 
+@lru_cache(maxsize=4096)
 def decrypt_str(value: str, key: Optional[str]) -> str:
+    # Memoizado por texto cifrado: recarregar agentes não decifra de novo o que não mudou
     f = _get_fernet(key)
     return f.decrypt(value.encode("utf-8")).decode("utf-8")
 
+
+def rotate_str(value: str, key: Optional[str]) -> str:
+    """Recifra com a chave primária um valor cifrado com qualquer chave configurada"""
+    f = _get_fernet(key)
+    return f.rotate(value.encode("utf-8")).decode("utf-8")
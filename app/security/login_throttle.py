@@ -0,0 +1,78 @@
+"""Limite de tentativas de login com falha por conta e por IP"""
+from typing import Optional
+import hashlib
+import logging
+
+from app.infrastructure.redis_client import RedisClient
+
+logger = logging.getLogger(__name__)
+
+
+class LoginThrottle:
+    """Conta falhas em janelas fixas no Redis; verificado antes de qualquer hash de senha"""
+
+    def __init__(
+        self,
+        redis_client: RedisClient,
+        max_per_account: int = 5,
+        max_per_ip: int = 20,
+        window_seconds: int = 900
+    ):
+        self.redis = redis_client
+        self.max_per_account = max_per_account
+        self.max_per_ip = max_per_ip
+        self.window_seconds = window_seconds
+
+    def _account_key(self, account: str) -> str:
+        digest = hashlib.sha256(account.strip().lower().encode("utf-8")).hexdigest()[:32]
+        return f"login_fail:acct:{digest}"
+
+    def _ip_key(self, ip: str) -> str:
+        return f"login_fail:ip:{ip}"
+
+    async def retry_after(self, account: Optional[str], ip: str) -> Optional[int]:
+        """Segundos até liberar, se a conta ou o IP excederam o limite de falhas"""
+        if not self.redis.client:
+            return None
+        checks = [(self._ip_key(ip), self.max_per_ip)]
+        if account:
+            checks.append((self._account_key(account), self.max_per_account))
+        try:
+            pipe = self.redis.client.pipeline(transaction=False)
+            for key, _ in checks:
+                pipe.get(key)
+                pipe.ttl(key)
+            results = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error checking login failures: {e}")
+            return None
+        wait = None
+        for i, (_, limit) in enumerate(checks):
+            failures, ttl = results[2 * i], results[2 * i + 1]
+            if failures and int(failures) >= limit:
+                wait = max(wait or 0, ttl if ttl and ttl > 0 else self.window_seconds)
+        return wait
+
+    async def record_failure(self, account: Optional[str], ip: str):
+        if not self.redis.client:
+            return
+        keys = [self._ip_key(ip)]
+        if account:
+            keys.append(self._account_key(account))
+        try:
+            pipe = self.redis.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.incr(key)
+                pipe.expire(key, self.window_seconds, nx=True)
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error recording login failure: {e}")
+
+    async def reset(self, account: str):
+        """Zera as falhas da conta após um login bem-sucedido"""
+        if not self.redis.client:
+            return
+        try:
+            await self.redis.client.delete(self._account_key(account))
+        except Exception as e:
+            logger.error(f"Error resetting login failures: {e}")
@@ -1,7 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import asyncio
+
 from passlib.context import CryptContext
 
+from app.config import settings
+
 _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt custa ~100-300 ms de CPU: roda em threads dedicadas, fora do event loop
+_executor: Optional[ThreadPoolExecutor] = None
+_pending = 0
+
+
+class PasswordHasherBusy(Exception):
+    """Fila de hashing cheia"""
+
 
 def hash_password(password: str) -> str:
     return _pwd_context.hash(password)
@@ -10,3 +24,31 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, password_hash: str) -> bool:
     return _pwd_context.verify(password, password_hash)
 
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.password_hash_workers), thread_name_prefix="password-hash"
+        )
+    return _executor
+
+
+async def _run(fn, *args):
+    """Executa fn no pool de hashing; recusa se já houver trabalhos demais na fila"""
+    global _pending
+    if _pending >= settings.password_hash_max_pending:
+        raise PasswordHasherBusy()
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password)
+
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    return await _run(verify_password, password, password_hash)
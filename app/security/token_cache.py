@@ -0,0 +1,209 @@
+"""Cache de tokens JWT validados com revogação propagada via Redis pub/sub"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional, Set
+import asyncio
+import hashlib
+import logging
+import math
+import time
+
+from app.infrastructure import prisma_db
+from app.infrastructure.metrics_registry import registry
+from app.infrastructure.redis_client import RedisClient
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_CHANNEL = "auth:revoked"
+
+AUTH_TOKEN_LOOKUPS = registry.counter(
+    "auth_token_lookups_total", "Validações de jti por origem (cache, db)", labels=("source",)
+)
+
+
+class BloomFilter:
+    """Filtro de Bloom simples: 'não contém' é definitivo, 'contém' pode ser falso positivo"""
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class TokenCache:
+    """Decide a validade de um jti sem I/O na maioria das requisições
+
+    - um jti só entra no LRU depois que o banco confirma o token (existe, não revogado,
+      não vencido) e fica lá até o vencimento do token;
+    - revogações publicadas via pub/sub removem o jti do LRU em todas as instâncias;
+    - a cada ressincronização, os revogados ainda não vencidos são carregados do banco em
+      um filtro de Bloom e os jtis do LRU que aparecem nele são descartados.
+    Sem inscrição ativa no canal de revogação nada é cacheado (toda validação vai ao banco).
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[RedisClient] = None,
+        max_size: int = 10000,
+        bloom_capacity: int = 100000,
+        resync_interval: float = 300.0
+    ):
+        self.redis = redis_client
+        self.max_size = max_size
+        self.bloom_capacity = bloom_capacity
+        self.resync_interval = resync_interval
+        self._valid: "OrderedDict[str, float]" = OrderedDict()  # jti -> expira em (epoch)
+        self._revoked: Optional[BloomFilter] = None
+        self._recent_revoked: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._synced = False
+
+    async def start(self):
+        """Carrega o filtro de revogados e passa a ouvir revogações"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def check(self, jti: str, exp: float) -> Optional[str]:
+        """None se o token é válido; senão 'revoked' ou 'expired'"""
+        now = time.time()
+        cached = self._valid.get(jti)
+        if cached is not None:
+            if cached > now:
+                self._valid.move_to_end(jti)
+                AUTH_TOKEN_LOOKUPS.inc(source="cache")
+                return None
+            self._valid.pop(jti, None)
+
+        AUTH_TOKEN_LOOKUPS.inc(source="db")
+        token_row = await prisma_db.db.accesstoken.find_unique(where={"jti": jti})
+        if not token_row or token_row.revokedAt is not None:
+            return "revoked"
+        expires_at = token_row.expiresAt
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at <= datetime.now(timezone.utc):
+            return "expired"
+        self._remember(jti, min(exp, expires_at.timestamp()))
+        return None
+
+    async def revoke(self, jti: str, exp: Optional[float] = None):
+        """Invalida o jti neste processo e avisa os demais"""
+        self._mark_revoked(jti)
+        if self.redis:
+            await self.redis.publish(REVOCATION_CHANNEL, {"jti": jti, "exp": exp})
+
+    async def revoke_user(self, usuario_id: str):
+        """Revoga os tokens ainda válidos de um usuário (ex.: antes de removê-lo, já que a
+        remoção apaga as linhas em cascata sem marcar revokedAt)"""
+        rows = await prisma_db.db.accesstoken.find_many(
+            where={"usuarioId": usuario_id, "expiresAt": {"gt": datetime.now(timezone.utc)}}
+        )
+        for row in rows:
+            await self.revoke(row.jti, row.expiresAt.timestamp())
+
+    def _remember(self, jti: str, expires_at: float):
+        if not self._synced:
+            return
+        # Revogação recebida enquanto o banco era consultado
+        if jti in self._recent_revoked or (self._revoked is not None and jti in self._revoked):
+            return
+        self._valid[jti] = expires_at
+        self._valid.move_to_end(jti)
+        while len(self._valid) > self.max_size:
+            self._valid.popitem(last=False)
+
+    def _mark_revoked(self, jti: str):
+        self._valid.pop(jti, None)
+        self._recent_revoked.add(jti)
+        if self._revoked is not None:
+            self._revoked.add(jti)
+
+    async def _run(self):
+        """Ressincroniza o filtro periodicamente e aplica revogações publicadas"""
+        if not self.redis or not self.redis.client:
+            logger.warning("Redis not available, token cache disabled")
+            return
+        while True:
+            listener = None
+            try:
+                subscribed = asyncio.Event()
+                listener = asyncio.create_task(self._listen(subscribed))
+                # Inscreve antes de carregar: revogações concorrentes não se perdem
+                await asyncio.wait_for(subscribed.wait(), timeout=10)
+                # A inscrição continua ativa entre as ressincronizações (sem janela sem revogações)
+                while True:
+                    await self._load_revoked()
+                    self._synced = True
+                    done, _ = await asyncio.wait({listener}, timeout=self.resync_interval)
+                    if done:
+                        listener.result()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Token revocation listener error: {e}")
+                # Sem garantia de receber revogações: descarta o cache e volta a consultar o banco
+                self._synced = False
+                self._valid.clear()
+                await asyncio.sleep(5)
+            finally:
+                if listener is not None:
+                    listener.cancel()
+
+    async def _listen(self, subscribed: asyncio.Event):
+        async for message in self.redis.listen(REVOCATION_CHANNEL, subscribed=subscribed):
+            jti = message.get("jti")
+            if jti:
+                self._mark_revoked(jti)
+        raise RuntimeError("Revocation subscription closed")
+
+    async def _load_revoked(self):
+        """Reconstrói o filtro com os tokens revogados ainda não vencidos"""
+        started_with = set(self._recent_revoked)
+        rows = await prisma_db.db.accesstoken.find_many(
+            where={"revokedAt": {"not": None}, "expiresAt": {"gt": datetime.now(timezone.utc)}}
+        )
+        bloom = BloomFilter(max(self.bloom_capacity, len(rows) * 2))
+        for row in rows:
+            bloom.add(row.jti)
+        # Revogações recebidas durante a carga entram no novo filtro
+        for jti in self._recent_revoked:
+            bloom.add(jti)
+        self._revoked = bloom
+        self._recent_revoked -= started_with
+        # Descarta jtis cacheados revogados no banco (falsos positivos só voltam a consultar o banco)
+        for jti in [jti for jti in self._valid if jti in bloom]:
+            self._valid.pop(jti, None)
+        logger.debug(f"Loaded {len(rows)} revoked tokens into revocation filter")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cached": len(self._valid),
+            "revoked_filter": self._revoked.count if self._revoked else 0,
+            "synced": int(self._synced),
+        }
@@ -1,18 +1,23 @@
 import asyncio
 import logging
 import json
-from typing import Optional
+import uuid
+from typing import Optional, List, Dict
 import httpx
 
 from app.config import settings
-from app.models import WebhookMessage, AgentResponse
+from app.models import WebhookMessage, AgentResponse, AgentConfig
 from app.agent_loader import AgentLoader
+from app.infrastructure import prisma_db
 from app.infrastructure.redis_client import RedisClient
 from app.infrastructure.qdrant_client import QdrantClient
 from app.infrastructure.openai_client import OpenAIClient
 from app.domain.rag_service import RAGService
 from app.domain.agent_service import AgentService
 from app.domain.metrics_service import MetricsService
+from app.infrastructure.tracing import tracer
+from app.infrastructure.metrics_registry import registry, serve_metrics
+from datetime import datetime
 import time
 
 # Configurar logging
@@ -22,29 +27,54 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+JOBS_PROCESSED = registry.counter("jobs_processed_total", "Jobs processados pelo worker", labels=("outcome",))
+JOB_DURATION = registry.histogram("job_processing_duration_seconds", "Tempo de processamento de um job")
+JOB_QUEUE_WAIT = registry.histogram("job_queue_wait_seconds", "Tempo entre o enfileiramento e o início do job")
+QUEUE_DEPTH = registry.gauge("job_queue_depth", "Jobs na fila do consumer group", labels=("state",))
+
 
 class Worker:
     """Worker assíncrono para processar jobs"""
     
     def __init__(self):
-        self.agent_loader = AgentLoader()
         self.redis = RedisClient()
+        self.agent_loader = AgentLoader(redis_client=self.redis)
         self.qdrant = QdrantClient()
-        self.openai = OpenAIClient()
-        self.rag_service = RAGService(self.redis, self.openai, qdrant_client=self.qdrant)
-        self.agent_service = AgentService(self.redis, self.openai, self.rag_service)
-        self.metrics_service = MetricsService(self.redis)
+        self.openai = OpenAIClient(dedupe_inflight=settings.llm_dedupe_inflight)
+        self.metrics_service = MetricsService(
+            self.redis,
+            buffered=settings.metrics_buffered,
+            flush_interval=settings.metrics_flush_interval_seconds
+        )
+        self.rag_service = RAGService(
+            self.redis, self.openai, qdrant_client=self.qdrant, metrics_service=self.metrics_service
+        )
+        self.agent_service = AgentService(
+            self.redis, self.openai, self.rag_service, metrics_service=self.metrics_service
+        )
         self.running = False
     
     async def start(self):
         """Inicia o worker"""
         await self.redis.connect()
         await self.qdrant.connect()
+        if settings.database_url:
+            try:
+                await prisma_db.connect()
+            except Exception as e:
+                logger.error(f"Failed to connect to database: {e}")
+        # Cache de agentes aquecido no startup e atualizado pelas notificações da API
+        await self.agent_loader.load_all_agents()
+        await self.agent_loader.start()
+        await self.metrics_service.start()
         self.running = True
         logger.info("Worker started")
         
+        if settings.worker_metrics_port:
+            await serve_metrics("0.0.0.0", settings.worker_metrics_port)
+        
         # Inicia múltiplos consumidores concorrentes
-        tasks = []
+        tasks = [asyncio.create_task(self.queue_gauge_loop())]
         for i in range(3):  # 3 workers concorrentes
             task = asyncio.create_task(self.consume_loop(f"worker-{i+1}"))
             tasks.append(task)
@@ -54,8 +84,14 @@ class Worker:
         except KeyboardInterrupt:
             logger.info("Worker shutting down...")
             self.running = False
+            await self.agent_loader.stop()
+            await self.metrics_service.stop()
             await self.redis.disconnect()
             await self.qdrant.disconnect()
+            try:
+                await prisma_db.disconnect()
+            except Exception:
+                pass
     
     async def consume_loop(self, consumer_name: str):
         """Loop principal de consumo de jobs"""
@@ -79,6 +115,26 @@ class Worker:
                 logger.error(f"Error in consume loop {consumer_name}: {e}", exc_info=True)
                 await asyncio.sleep(1)
     
+    async def get_agent(self, agent_id: str) -> Optional[AgentConfig]:
+        """Agente do cache local; em caso de miss, busca só esse agente (arquivo ou linha do banco)"""
+        agent_config = self.agent_loader.get_agent(agent_id)
+        if agent_config is None and agent_id:
+            if await self.agent_loader.reload_agent(agent_id):
+                logger.info(f"Agent {agent_id} fetched on cache miss")
+            agent_config = self.agent_loader.get_agent(agent_id)
+        return agent_config
+    
+    async def queue_gauge_loop(self, interval: float = 5.0):
+        """Atualiza periodicamente o gauge de profundidade da fila (o scrape não consulta o Redis)"""
+        while self.running:
+            try:
+                depth = await self.redis.get_queue_depth("workers")
+                QUEUE_DEPTH.set(depth["pending"], state="pending")
+                QUEUE_DEPTH.set(depth["lag"], state="lag")
+            except Exception as e:
+                logger.debug(f"Error refreshing queue depth: {e}")
+            await asyncio.sleep(interval)
+    
     async def process_job(self, job: dict, consumer_name: str):
         """Processa um job"""
         job_id = job.get('job_id')
@@ -91,14 +147,37 @@ class Worker:
         
         logger.info(f"Processing job {job_id} for agent {agent_id} (consumer: {consumer_name})")
         
+        # Continua o trace iniciado no webhook (trace_id propagado no payload do job)
+        trace, trace_token = tracer.start_trace(
+            "worker.job",
+            trace_id=job.get('trace_id'),
+            sampled=job.get('trace_sampled'),
+            job_id=job_id,
+            agent_id=agent_id,
+            consumer=consumer_name
+        )
+        try:
+            queue_wait = max(0.0, (datetime.now() - datetime.fromisoformat(job['created_at'])).total_seconds())
+            tracer.add_span("queue_wait", queue_wait * 1000)
+            JOB_QUEUE_WAIT.observe(queue_wait)
+        except Exception:
+            pass
+        
         try:
             # Carrega configuração do agente
-            agent_config = self.agent_loader.get_agent(agent_id)
+            agent_config = await self.get_agent(agent_id)
             if not agent_config:
                 logger.error(f"Agent {agent_id} not found")
+                await self.redis.set_job_state(job_id, {
+                    "agent_id": agent_id,
+                    "status": "failed",
+                    "error": f"Agent {agent_id} not found"
+                })
                 await self.redis.ack_job(msg_id)
                 return
             
+            await self.redis.set_job_state(job_id, {"agent_id": agent_id, "status": "processing"})
+            
             # Parse da mensagem
             message_data = job.get('message', {})
             message = WebhookMessage(**message_data)
@@ -106,12 +185,16 @@ class Worker:
             # Recupera histórico do job
             history = job.get('history', [])
             
-            # Processa mensagem
-            response = await self.agent_service.process_message_sync(
-                agent_config,
-                message,
-                history=history
-            )
+            # Processa mensagem (jobs de streaming publicam os deltas no stream do job)
+            with tracer.span("agent.process", stream=bool(job.get('stream'))):
+                if job.get('stream'):
+                    response = await self.stream_job(job_id, agent_config, message, history)
+                else:
+                    response = await self.agent_service.process_message_sync(
+                        agent_config,
+                        message,
+                        history=history
+                    )
             
             tokens_used = response.tokens_used
             success = True
@@ -123,6 +206,13 @@ class Worker:
             if webhook_output_url:
                 await self.send_webhook_response(webhook_output_url, response)
             
+            # Armazena resultado (notifica quem aguarda em GET /jobs/{job_id})
+            await self.redis.set_job_state(job_id, {
+                "agent_id": agent_id,
+                "status": "completed",
+                "result": response.dict()
+            })
+            
             # Publica no canal pub/sub
             await self.redis.publish(
                 f"agent_response:{agent_id}",
@@ -137,10 +227,19 @@ class Worker:
         except Exception as e:
             logger.error(f"Error processing job {job_id}: {e}", exc_info=True)
             success = False
+            trace.attrs["error"] = str(e)
+            await self.redis.set_job_state(job_id, {
+                "agent_id": agent_id,
+                "status": "failed",
+                "error": str(e)
+            })
             # Ainda assim, ack o job para não ficar preso (em produção, implementar retry)
             await self.redis.ack_job(msg_id)
         
         finally:
+            tracer.end_trace(trace, trace_token)
+            JOBS_PROCESSED.inc(outcome="success" if success else "error")
+            JOB_DURATION.observe(time.time() - start_time)
             # Registra métricas
             if self.metrics_service and 'message' in locals():
                 response_time = time.time() - start_time
@@ -153,6 +252,37 @@ class Worker:
                     success=success
                 )
     
+    async def stream_job(
+        self,
+        job_id: str,
+        agent_config: AgentConfig,
+        message: WebhookMessage,
+        history: List[Dict[str, str]]
+    ) -> AgentResponse:
+        """Gera a resposta em streaming gravando cada delta no Redis Stream do job"""
+        chunks: List[str] = []
+        first = True
+        try:
+            async for token in self.agent_service.process_message(
+                agent_config, message, stream=True, history=history
+            ):
+                if not token:
+                    continue
+                chunks.append(token)
+                await self.redis.append_job_stream(job_id, {"type": "delta", "data": token}, first=first)
+                first = False
+        except Exception as e:
+            await self.redis.append_job_stream(job_id, {"type": "error", "data": str(e)}, first=first)
+            raise
+        
+        await self.redis.append_job_stream(job_id, {"type": "done"}, first=first)
+        
+        return AgentResponse(
+            agent_id=agent_config.id,
+            conversation_id=message.conversation_id or str(uuid.uuid4()),
+            response="".join(chunks)
+        )
+    
     async def send_webhook_response(self, url: str, response: AgentResponse):
         """Envia resposta para webhook de saída"""
         try:
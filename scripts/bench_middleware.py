@@ -0,0 +1,176 @@
+"""
+Benchmark da pilha de middlewares: RPS de um endpoint JSON e TTFB de um endpoint SSE.
+
+Compara a pilha ASGI pura (AuthMiddleware + RateLimiterMiddleware) com a mesma pilha
+envolvida por duas camadas BaseHTTPMiddleware (o custo de plumbing da versão anterior).
+
+Uso:
+    python scripts/bench_middleware.py                  # sobe um servidor local para cada variante
+    python scripts/bench_middleware.py --url http://localhost:8000 --token $ACESS_TOKEN \
+        --sse-path /webhooks/meu_agente --sse-body '{"text": "oi", "stream": true}'
+
+Com `--sse-body` o SSE é medido com POST (corpo JSON), como nos webhooks; sem ele, com GET.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Adiciona o diretório raiz ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from app.infrastructure.redis_client import RedisClient
+from app.middleware.auth_middleware import AuthMiddleware
+from app.middleware.rate_limiter import RateLimiterMiddleware
+
+BENCH_TOKEN = "bench-token"
+
+
+class _PassthroughMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        return await call_next(request)
+
+
+def build_app(variant: str) -> Starlette:
+    """App mínima com /api/ping (JSON) e /webhooks/stream (SSE)"""
+
+    async def ping(request):
+        return JSONResponse({"ok": True})
+
+    async def stream(request):
+        async def events():
+            for i in range(5):
+                yield f"data: {i}\n\n"
+                await asyncio.sleep(0.01)
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    app = Starlette(routes=[
+        Route("/api/ping", ping), Route("/webhooks/stream", stream, methods=["GET", "POST"])
+    ])
+    # Redis não conectado: o rate limiter libera sem round trip (mede só o middleware)
+    app.add_middleware(RateLimiterMiddleware, redis_client=RedisClient(), requests_per_minute=10**9)
+    app.add_middleware(AuthMiddleware, access_token=BENCH_TOKEN)
+    if variant == "base":
+        app.add_middleware(_PassthroughMiddleware)
+        app.add_middleware(_PassthroughMiddleware)
+    return app
+
+
+async def measure_rps(client: httpx.AsyncClient, url: str, requests: int, concurrency: int) -> float:
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            response = await client.get(url)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - start)
+
+
+async def measure_ttfb(
+    client: httpx.AsyncClient, url: str, samples: int, concurrency: int, body: Optional[Any] = None
+) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    method = "GET" if body is None else "POST"
+
+    async def one() -> float:
+        async with semaphore:
+            ttfb = None
+            start = time.perf_counter()
+            async with client.stream(method, url, json=body) as response:
+                response.raise_for_status()
+                async for _ in response.aiter_raw():
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - start
+            return (ttfb or 0.0) * 1000
+
+    return list(await asyncio.gather(*(one() for _ in range(samples))))
+
+
+async def run_against(base_url: str, token: str, args) -> Dict[str, float]:
+    headers = {"Authorization": f"Bearer {token}"}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=30) as client:
+        await measure_rps(client, base_url + args.json_path, 50, args.concurrency)  # aquecimento
+        rps = await measure_rps(client, base_url + args.json_path, args.requests, args.concurrency)
+        ttfb = sorted(await measure_ttfb(
+            client, base_url + args.sse_path, args.sse_samples, args.concurrency, args.sse_body
+        ))
+    return {
+        "rps": rps,
+        "ttfb_p50_ms": statistics.median(ttfb),
+        "ttfb_p95_ms": ttfb[int(len(ttfb) * 0.95) - 1],
+    }
+
+
+def _serve(variant: str, port: int):
+    uvicorn.run(build_app(variant), host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+
+
+async def run_local(variant: str, port: int, args) -> Dict[str, float]:
+    # Servidor em outro processo para não dividir o event loop com o cliente
+    server = multiprocessing.Process(target=_serve, args=(variant, port), daemon=True)
+    server.start()
+    try:
+        async with httpx.AsyncClient() as client:
+            for _ in range(100):
+                try:
+                    await client.get(f"http://127.0.0.1:{port}/health")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+        return await run_against(f"http://127.0.0.1:{port}", BENCH_TOKEN, args)
+    finally:
+        server.terminate()
+        server.join()
+
+
+def print_result(name: str, result: Dict[str, float], baseline: Optional[Dict[str, float]] = None):
+    line = f"{name:<6} rps={result['rps']:8.0f}  sse ttfb p50={result['ttfb_p50_ms']:6.2f}ms p95={result['ttfb_p95_ms']:6.2f}ms"
+    if baseline:
+        line += f"  ({(result['rps'] / baseline['rps'] - 1) * 100:+.1f}% rps)"
+    print(line)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de RPS e TTFB SSE da pilha de middlewares")
+    parser.add_argument("--url", help="Mede um servidor já em execução em vez das variantes locais")
+    parser.add_argument("--token", default=BENCH_TOKEN)
+    parser.add_argument("--json-path", default="/api/ping")
+    parser.add_argument("--sse-path", default="/webhooks/stream")
+    parser.add_argument("--sse-body", type=json.loads, help="Corpo JSON do SSE (envia POST em vez de GET)")
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--sse-samples", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.url:
+        print_result("remote", await run_against(args.url.rstrip("/"), args.token, args))
+        return
+
+    base = await run_local("base", args.port, args)
+    print_result("base", base)
+    asgi = await run_local("asgi", args.port + 1, args)
+    print_result("asgi", asgi, base)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
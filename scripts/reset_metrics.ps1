@@ -19,14 +19,26 @@ EOF
     Write-Host "Todas as métricas foram resetadas." -ForegroundColor Green
 } else {
     Write-Host "Resetando métricas do agente: $AgentId" -ForegroundColor Yellow
-    docker exec ai-agent-redis redis-cli --eval - <<EOF
+    # Contadores, histogramas de latência do agente e sua posição nos rankings diários
+    # (os histogramas globais mantêm as amostras já agregadas)
+    $script = @'
 local agent_id = ARGV[1]
-local keys = redis.call('keys', 'metrics:agent:' .. agent_id .. ':*')
-for i=1,#keys do
-    redis.call('del', keys[i])
+local removed = 0
+local patterns = {'metrics:agent:' .. agent_id .. ':*', 'metrics:latency:agent:' .. agent_id .. ':*'}
+for _, pattern in ipairs(patterns) do
+    local keys = redis.call('keys', pattern)
+    for i=1,#keys do
+        redis.call('del', keys[i])
+        removed = removed + 1
+    end
 end
-return #keys
-EOF
+local days = redis.call('keys', 'metrics:top:d:*')
+for i=1,#days do
+    removed = removed + redis.call('zrem', days[i], agent_id)
+end
+return removed
+'@
+    docker exec ai-agent-redis redis-cli EVAL $script 0 $AgentId
     Write-Host "Métricas do agente $AgentId foram resetadas." -ForegroundColor Green
 }
 
@@ -18,14 +18,26 @@ EOF
     echo "Todas as métricas foram resetadas."
 else
     echo "Resetando métricas do agente: $AGENT_ID"
-    docker exec -it ai-agent-redis redis-cli --eval - <<EOF
+    # Contadores, histogramas de latência do agente e sua posição nos rankings diários
+    # (os histogramas globais mantêm as amostras já agregadas)
+    docker exec ai-agent-redis redis-cli EVAL "$(cat <<'LUA'
 local agent_id = ARGV[1]
-local keys = redis.call('keys', 'metrics:agent:' .. agent_id .. ':*')
-for i=1,#keys do
-    redis.call('del', keys[i])
+local removed = 0
+local patterns = {'metrics:agent:' .. agent_id .. ':*', 'metrics:latency:agent:' .. agent_id .. ':*'}
+for _, pattern in ipairs(patterns) do
+    local keys = redis.call('keys', pattern)
+    for i=1,#keys do
+        redis.call('del', keys[i])
+        removed = removed + 1
+    end
 end
-return #keys
-EOF
+local days = redis.call('keys', 'metrics:top:d:*')
+for i=1,#days do
+    removed = removed + redis.call('zrem', days[i], agent_id)
+end
+return removed
+LUA
+)" 0 "$AGENT_ID"
     echo "Métricas do agente $AGENT_ID foram resetadas."
 fi
 